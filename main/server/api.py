@@ -3,9 +3,12 @@ from pydantic import BaseModel
 from typing import Dict, List, Optional
 import json
 from main import create_rent_agreement
+from metrics import instrument_llm_calls, metrics_middleware, metrics_response
 import logging
 
 app = FastAPI()
+app.middleware("http")(metrics_middleware)
+instrument_llm_calls()
 
 class ContractRequest(BaseModel):
     user_prompt: str
@@ -63,3 +66,8 @@ async def generate_contract(details: RentalDetails):
 async def get_contract_status(contract_id: str):
     # Implement contract status checking
     return {"status": "completed"}
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text format: LLM tokens, cost and latency, request latency per route
+    return metrics_response()
@@ -4,6 +4,7 @@ import json
 import logging
 from dotenv import load_dotenv
 from fpdf import FPDF
+from metrics import llm_metadata
 import streamlit as st
 
 # Set up logging
@@ -21,7 +22,11 @@ def get_llm(llm_type="openai"):
     return LLM(
         model="openai/gpt-4o-mini",
         api_key=os.getenv("OPENAI_API_KEY"),
-        temperature=0.2
+        # Unset uses the OpenAI API; load tests point this at a local stand-in
+        base_url=os.getenv("OPENAI_BASE_URL"),
+        temperature=0.2,
+        # Passed on to LiteLLM, whose callbacks label the call's metrics with it
+        metadata=llm_metadata(),
     ) 
 
 def load_json_data(file_path):
@@ -0,0 +1,104 @@
+import time
+import logging
+from contextvars import ContextVar
+
+from fastapi import Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+LLM_LABELS = ("endpoint", "model")
+
+# Same metric names as the Django API so dashboards work for both services
+LLM_CALLS = Counter("llm_calls_total", "Chat completion calls by outcome (ok, error).", LLM_LABELS + ("outcome",))
+LLM_PROMPT_TOKENS = Counter("llm_prompt_tokens_total", "Prompt tokens sent.", LLM_LABELS)
+LLM_COMPLETION_TOKENS = Counter("llm_completion_tokens_total", "Completion tokens received.", LLM_LABELS)
+LLM_COST = Counter("llm_cost_usd_total", "Estimated spend in USD.", LLM_LABELS)
+LLM_PROMPT_SIZE = Histogram("llm_prompt_size_tokens", "Prompt tokens per call.", LLM_LABELS, buckets=TOKEN_BUCKETS)
+LLM_LATENCY = Histogram("llm_provider_latency_seconds", "Provider time per call.", LLM_LABELS, buckets=LATENCY_BUCKETS)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to produce a response, per endpoint.", ("endpoint", "method", "status"),
+    buckets=LATENCY_BUCKETS,
+)
+
+# Label for requests no route matches, so unknown paths cannot create new series
+UNMATCHED = "unmatched"
+
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="unknown")
+
+
+def route_path(request: Request) -> str:
+    """Path template of the route that will serve `request`, e.g. /api/contract/{contract_id}.
+
+    Routing only runs inside call_next, so the middleware matches the routes itself.
+    """
+    partial = None
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", UNMATCHED)
+        if match == Match.PARTIAL and partial is None:
+            # Right path, wrong method: answered with a 405 by that route
+            partial = getattr(route, "path", UNMATCHED)
+    return partial or UNMATCHED
+
+
+async def metrics_middleware(request: Request, call_next):
+    """Label LLM calls made while serving a request with its route, and time the request."""
+    endpoint = route_path(request)
+    token = current_endpoint.set(endpoint)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        current_endpoint.reset(token)
+    HTTP_LATENCY.labels(endpoint, request.method, response.status_code).observe(time.perf_counter() - started)
+    return response
+
+
+def llm_metadata() -> dict:
+    """LiteLLM metadata naming the current endpoint, for the LLMs a request builds.
+
+    LiteLLM runs its callbacks on other threads, which the ContextVar does not reach.
+    """
+    return {"endpoint": current_endpoint.get()}
+
+
+def _endpoint(kwargs) -> str:
+    metadata = (kwargs.get("litellm_params") or {}).get("metadata") or {}
+    return metadata.get("endpoint") or current_endpoint.get()
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def _record_success(kwargs, completion_response, start_time, end_time):
+    endpoint, model = _endpoint(kwargs), kwargs.get("model", "unknown")
+    LLM_CALLS.labels(endpoint, model, "ok").inc()
+    usage = getattr(completion_response, "usage", None)
+    if usage is not None:
+        LLM_PROMPT_TOKENS.labels(endpoint, model).inc(usage.prompt_tokens)
+        LLM_COMPLETION_TOKENS.labels(endpoint, model).inc(usage.completion_tokens)
+        LLM_PROMPT_SIZE.labels(endpoint, model).observe(usage.prompt_tokens)
+    if kwargs.get("response_cost"):
+        LLM_COST.labels(endpoint, model).inc(kwargs["response_cost"])
+    LLM_LATENCY.labels(endpoint, model).observe((end_time - start_time).total_seconds())
+
+
+def _record_failure(kwargs, completion_response, start_time, end_time):
+    LLM_CALLS.labels(_endpoint(kwargs), kwargs.get("model", "unknown"), "error").inc()
+
+
+def instrument_llm_calls() -> None:
+    """Record every LLM call the CrewAI agents make, through LiteLLM's callbacks."""
+    try:
+        import litellm
+    except ImportError:
+        logger.warning("litellm is not installed; LLM calls will not be recorded in /metrics.")
+        return
+    litellm.success_callback.append(_record_success)
+    litellm.failure_callback.append(_record_failure)
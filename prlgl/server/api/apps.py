@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        if settings.WARMUP_EMBEDDINGS:
+            from .embeddings import get_embedding_service
+            get_embedding_service().warm_up()
+        if settings.PRELOAD_KNOWLEDGE_INDEX:
+            from .knowledge_index import preload
+            preload()
@@ -0,0 +1,226 @@
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import List, Optional, Pattern, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from api.tokens import DEFAULT_MODEL, get_encoding
+
+DEFAULT_CHUNK_TOKENS = 160
+DEFAULT_OVERLAP_TOKENS = 24
+# A chunk is closed early at a strong boundary once it holds this share of the budget.
+DEFAULT_MIN_FILL = 0.5
+MAX_SECTION_TITLE = 120
+# Encoded on its own, a chunk can take a token more at each edge than its share of the page's tokens.
+EDGE_TOKENS = 2
+
+# Places a chunk may end, strongest first. For "start" patterns the boundary is
+# where the match begins (a new heading or clause), otherwise where it ends.
+BOUNDARIES: List[Tuple[str, Pattern, bool]] = [
+    ("heading", re.compile(r"^[ \t]*(?i:part|chapter|title|schedule|annex|appendix)[ \t]+(?:[IVXLC]+|\d+|[A-Z])\b", re.M), True),
+    ("article", re.compile(r"^[ \t]*(?:(?i:article|section|clause)[ \t]+\d+[A-Za-z]?\b|§[ \t]*\d+)", re.M), True),
+    # 1.2 / 3.4.1 / "7. Termination", but not a wrapped line starting "30 days"
+    ("clause", re.compile(r"^[ \t]*(?:\d+(?:\.\d+)+\.?|\d+\.(?=[ \t]+[A-Z]))[ \t]+", re.M), True),
+    ("subclause", re.compile(r"^[ \t]*\((?:[a-z]{1,2}|[ivx]+|\d+)\)[ \t]+", re.M), True),
+    ("paragraph", re.compile(r"\n[ \t]*\n\s*"), False),
+    ("sentence", re.compile(r"(?<=[.;:!?])[ \t\n]+(?=[\"'(“A-Z0-9])"), False),
+    ("line", re.compile(r"\n"), False),
+    ("word", re.compile(r"\s+"), False),
+]
+LEVELS = {name: level for level, (name, _, _) in enumerate(BOUNDARIES)}
+# Headings and articles start a new chunk unless the current one is a short section of its own ...
+SECTION_LEVEL = LEVELS["article"]
+# ... and chunks cut at a clause boundary or stronger need no overlap with the previous one.
+CLAUSE_LEVEL = LEVELS["subclause"]
+DOCUMENT_START = -1
+
+
+@dataclass
+class Segment:
+    start: int
+    end: int
+    tokens: int
+    # Level of the boundary the segment starts at
+    level: int
+
+
+@dataclass
+class Chunk:
+    start: int
+    end: int
+    tokens: int
+    section: Optional[str] = None
+
+
+class TokenOffsets:
+    """Token count of any span of a text, from one encoding of the whole text."""
+
+    def __init__(self, text: str, model: str = DEFAULT_MODEL):
+        self.encoding = get_encoding(model)
+        _, self.starts = self.encoding.decode_with_offsets(self.encoding.encode_ordinary(text))
+
+    def count(self, start: int, end: int) -> int:
+        # Tokens starting inside the span, so counts of adjacent spans add up exactly
+        return bisect_left(self.starts, end) - bisect_left(self.starts, start)
+
+    def cut_points(self, start: int, end: int, size: int) -> List[int]:
+        """Offsets splitting the span every `size` tokens."""
+        first = bisect_left(self.starts, start)
+        last = bisect_left(self.starts, end)
+        return [self.starts[i] for i in range(first + size, last, size)]
+
+
+class ClauseSplitter:
+    """Splits legal text into chunks of at most `chunk_size` tokens at clause boundaries.
+
+    Text is cut recursively at the strongest boundaries in BOUNDARIES until
+    every piece fits, and the pieces are packed back together up to the
+    budget. A chunk ends at the strongest boundary in its second half
+    rather than wherever the budget runs out, and a new heading or article
+    starts a new chunk unless the section before it fills less than
+    `min_fill` of one. Only chunks cut below clause level repeat up to
+    `chunk_overlap` tokens of the previous chunk, in whole segments.
+    Token counts use the project's tokenizer (api.tokens).
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = DEFAULT_CHUNK_TOKENS,
+        chunk_overlap: int = DEFAULT_OVERLAP_TOKENS,
+        model: str = DEFAULT_MODEL,
+        min_fill: float = DEFAULT_MIN_FILL,
+    ):
+        if chunk_overlap >= chunk_size - EDGE_TOKENS:
+            raise ValueError(f"Chunk overlap ({chunk_overlap}) must be smaller than the chunk size ({chunk_size}).")
+        self.chunk_size = chunk_size
+        # What the pieces of a chunk may add up to
+        self.budget = chunk_size - EDGE_TOKENS
+        self.chunk_overlap = chunk_overlap
+        self.model = model
+        self.min_tokens = int(chunk_size * min_fill)
+
+    def split_spans(self, text: str) -> List[Chunk]:
+        """Chunks of `text` as offsets; text[chunk.start:chunk.end] is the chunk."""
+        if not text.strip():
+            return []
+        offsets = TokenOffsets(text, self.model)
+        segments = self._segments(text, offsets, 0, len(text), 0, DOCUMENT_START)
+        sections = self._sections(text)
+        chunks = []
+        for first, end in self._pack(segments):
+            start, stop = segments[first].start, segments[end - 1].end
+            # Leading and trailing whitespace is not part of the chunk
+            while start < stop and text[start].isspace():
+                start += 1
+            while stop > start and text[stop - 1].isspace():
+                stop -= 1
+            if start < stop:
+                n_tokens = len(offsets.encoding.encode_ordinary(text[start:stop]))
+                chunks.append(Chunk(start, stop, n_tokens, self._section_at(sections, start)))
+        return chunks
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[chunk.start:chunk.end] for chunk in self.split_spans(text)]
+
+    def split_documents(self, documents: Sequence[Document]) -> List[Document]:
+        """Chunk each document; metadata is copied and gains start/end offsets and the section."""
+        chunks = []
+        for doc in documents:
+            for chunk in self.split_spans(doc.page_content):
+                metadata = dict(doc.metadata, start_index=chunk.start, end_index=chunk.end)
+                if chunk.section:
+                    metadata["section"] = chunk.section
+                chunks.append(Document(page_content=doc.page_content[chunk.start:chunk.end], metadata=metadata))
+        return chunks
+
+    def _segments(self, text: str, offsets: TokenOffsets, start: int, end: int, level: int, boundary: int) -> List[Segment]:
+        """Pieces of text[start:end] within the budget, cut at the strongest boundaries first."""
+        n_tokens = offsets.count(start, end)
+        # Headings and articles are always separated; the packer decides whether they share a chunk
+        if n_tokens <= self.budget and level > SECTION_LEVEL:
+            return [Segment(start, end, n_tokens, boundary)]
+        if level == len(BOUNDARIES):
+            # No boundary left, e.g. a long run without whitespace: cut by token count
+            cuts = offsets.cut_points(start, end, self.budget)
+            bounds = [start] + cuts + [end]
+            return [Segment(a, b, offsets.count(a, b), boundary if i == 0 else level)
+                    for i, (a, b) in enumerate(zip(bounds, bounds[1:]))]
+
+        _, pattern, at_start = BOUNDARIES[level]
+        cuts = sorted({m.start() if at_start else m.end() for m in pattern.finditer(text, start, end)} - {start, end})
+        if not cuts:
+            return self._segments(text, offsets, start, end, level + 1, boundary)
+        segments = []
+        bounds = [start] + cuts + [end]
+        for i, (a, b) in enumerate(zip(bounds, bounds[1:])):
+            segments.extend(self._segments(text, offsets, a, b, level + 1, boundary if i == 0 else level))
+        return segments
+
+    def _pack(self, segments: List[Segment]) -> List[Tuple[int, int]]:
+        """Group consecutive segments into chunks, as (first, end) index ranges."""
+        ranges = []
+        # Segments first..fresh-1 repeat the end of the previous chunk as overlap
+        first = fresh = 0
+        while fresh < len(segments):
+            total = sum(s.tokens for s in segments[first:fresh])
+            # Overlap gives way so that at least the next new segment fits the budget
+            while first < fresh and total + segments[fresh].tokens > self.budget:
+                total -= segments[first].tokens
+                first += 1
+            end = fresh
+            while end < len(segments):
+                segment = segments[end]
+                # A short section may share a chunk with the next one, the tail of a longer one may not
+                if end > fresh and (
+                    total + segment.tokens > self.budget
+                    or (segment.level <= SECTION_LEVEL and (total >= self.min_tokens or segments[first].level > SECTION_LEVEL))
+                ):
+                    break
+                total += segment.tokens
+                end += 1
+            if end < len(segments) and segments[end].level > SECTION_LEVEL:
+                end = self._best_cut(segments, first, fresh, end)
+            ranges.append((first, end))
+
+            next_first = end
+            if end < len(segments) and segments[end].level > CLAUSE_LEVEL:
+                overlap = 0
+                while next_first - 1 > first and overlap + segments[next_first - 1].tokens <= self.chunk_overlap:
+                    next_first -= 1
+                    overlap += segments[next_first].tokens
+            first, fresh = next_first, end
+        return ranges
+
+    def _best_cut(self, segments: List[Segment], first: int, fresh: int, end: int) -> int:
+        """The strongest boundary between fresh and end that leaves the chunk at least min_tokens long."""
+        best, best_level = end, segments[end].level
+        total = sum(s.tokens for s in segments[first:fresh])
+        for k in range(fresh, end - 1):
+            total += segments[k].tokens
+            # Ties go to the later cut, for fuller chunks
+            if total >= self.min_tokens and segments[k + 1].level < best_level:
+                best, best_level = k + 1, segments[k + 1].level
+        return best
+
+    def _sections(self, text: str) -> List[Tuple[int, str]]:
+        """Start offset and title line of every heading and article, in order."""
+        found = []
+        for _, pattern, _ in BOUNDARIES[:SECTION_LEVEL + 1]:
+            for m in pattern.finditer(text):
+                line_end = text.find("\n", m.start())
+                title = text[m.start():line_end if line_end != -1 else len(text)].strip()
+                found.append((m.start(), title[:MAX_SECTION_TITLE]))
+        return sorted(found)
+
+    @staticmethod
+    def _section_at(sections: List[Tuple[int, str]], offset: int) -> Optional[str]:
+        i = bisect_right(sections, (offset, "￿"))
+        return sections[i - 1][1] if i else None
+
+
+def split_documents_parallel(groups: Sequence[Sequence[Document]], splitter: ClauseSplitter, executor=None) -> List[List[Document]]:
+    """Chunk several documents (each a list of pages), one process per document if an executor is given."""
+    if executor is None or len(groups) < 2:
+        return [splitter.split_documents(pages) for pages in groups]
+    return list(executor.map(splitter.split_documents, groups))
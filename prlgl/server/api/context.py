@@ -0,0 +1,147 @@
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+from api.tokens import DEFAULT_MODEL, get_encoding, num_tokens_from_strings
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+DEFAULT_TOKEN_BUDGET = 1500
+# Shortest suffix/prefix match taken as chunk overlap when offsets are unknown.
+MIN_TEXT_OVERLAP = 32
+
+
+@dataclass
+class Passage:
+    """A span of one page of one source document, with its best retrieval score."""
+
+    text: str
+    score: float
+    source: Optional[str] = None
+    page: Optional[int] = None
+    start: Optional[int] = None
+
+    @property
+    def end(self) -> Optional[int]:
+        return None if self.start is None else self.start + len(self.text)
+
+    @classmethod
+    def from_document(cls, doc: "Document", score: float) -> "Passage":
+        return cls(
+            text=doc.page_content,
+            score=score,
+            source=doc.metadata.get("source"),
+            page=doc.metadata.get("page"),
+            start=doc.metadata.get("start_index"),
+        )
+
+
+def text_overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of `left` that is a prefix of `right`, if long enough."""
+    probe = right[:MIN_TEXT_OVERLAP]
+    if len(probe) < MIN_TEXT_OVERLAP:
+        return 0
+    position = left.find(probe)
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(probe, position + 1)
+    return 0
+
+
+def _merge_by_offset(passages: List[Passage]) -> List[Passage]:
+    merged: List[Passage] = []
+    for passage in sorted(passages, key=lambda p: p.start):
+        last = merged[-1] if merged else None
+        if last is not None and passage.start <= last.end:
+            last.text += passage.text[last.end - passage.start:]
+            last.score = max(last.score, passage.score)
+        else:
+            merged.append(Passage(passage.text, passage.score, passage.source, passage.page, passage.start))
+    return merged
+
+
+def _merge_by_text(passages: List[Passage]) -> List[Passage]:
+    merged: List[Passage] = []
+    for passage in passages:
+        passage = Passage(passage.text, passage.score, passage.source, passage.page)
+        for other in merged:
+            if text_overlap(other.text, passage.text):
+                other.text += passage.text[text_overlap(other.text, passage.text):]
+            elif text_overlap(passage.text, other.text):
+                other.text = passage.text + other.text[text_overlap(passage.text, other.text):]
+            else:
+                continue
+            other.score = max(other.score, passage.score)
+            break
+        else:
+            merged.append(passage)
+    return merged
+
+
+def merge_passages(passages: Sequence[Passage]) -> List[Passage]:
+    """Join overlapping or adjacent passages from the same page into one.
+
+    Passages with a start offset are merged by offset; the rest (e.g. from
+    indexes built without `add_start_index`) by exact suffix/prefix overlap.
+    """
+    groups: Dict[Tuple, List[Passage]] = {}
+    for passage in passages:
+        groups.setdefault((passage.source, passage.page), []).append(passage)
+
+    merged: List[Passage] = []
+    for group in groups.values():
+        merged += _merge_by_offset([p for p in group if p.start is not None])
+        merged += _merge_by_text([p for p in group if p.start is None])
+    return merged
+
+
+def drop_duplicates(passages: Sequence[Passage]) -> List[Passage]:
+    """Drop passages whose whitespace-normalised text is contained in a higher-scoring one."""
+    kept: List[Passage] = []
+    kept_texts: List[str] = []
+    for passage in sorted(passages, key=lambda p: (-p.score, -len(p.text))):
+        text = " ".join(passage.text.split())
+        if not text or any(text in other for other in kept_texts):
+            continue
+        kept.append(passage)
+        kept_texts.append(text)
+    return kept
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    encoding = get_encoding(model)
+    return encoding.decode(encoding.encode_ordinary(text)[:max_tokens])
+
+
+def pack_passages(
+    passages: Sequence[Passage], token_budget: int, model: str = DEFAULT_MODEL
+) -> List[Passage]:
+    """Highest-scoring passages that fit in `token_budget`, best first.
+
+    Passages too long for the remaining budget are skipped in favour of
+    shorter ones; if not even the best passage fits, it is truncated.
+    """
+    passages = sorted(passages, key=lambda p: -p.score)
+    packed: List[Passage] = []
+    remaining = token_budget
+    # Each passage is prefixed with a newline in the prompt, which costs a token.
+    for passage, n_tokens in zip(passages, num_tokens_from_strings([p.text for p in passages], model=model)):
+        if n_tokens + 1 <= remaining:
+            packed.append(passage)
+            remaining -= n_tokens + 1
+    if not packed and passages and token_budget > 1:
+        best = passages[0]
+        packed.append(Passage(truncate_to_tokens(best.text, token_budget - 1, model), best.score, best.source, best.page, best.start))
+    return packed
+
+
+def build_context(
+    docs_and_scores: Sequence[Tuple["Document", float]],
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    model: str = DEFAULT_MODEL,
+) -> str:
+    """Prompt context from retrieved chunks: merged, de-duplicated and packed into the budget."""
+    passages = [Passage.from_document(doc, score) for doc, score in docs_and_scores]
+    packed = pack_passages(drop_duplicates(merge_passages(passages)), token_budget, model)
+    return "".join(f"\n{passage.text}" for passage in packed)
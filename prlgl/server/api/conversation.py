@@ -0,0 +1,208 @@
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+
+from api.llm import DEFAULT_N_PAST_MESSAGES, get_completion
+from api.tokens import num_tokens_from_messages, num_tokens_from_string
+from api.context import truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "chat-session:"
+DEFAULT_SESSION_TTL = 24 * 60 * 60
+# Older turns are folded into the summary once they add up to this many tokens.
+DEFAULT_SUMMARY_TRIGGER_TOKENS = 1000
+DEFAULT_SUMMARY_MAX_TOKENS = 300
+# Summary plus recent turns never exceed this, and neither do the turns waiting to be summarised.
+DEFAULT_SESSION_TOKEN_CAP = 4000
+
+SUMMARY_PROMPT = """Summarise the conversation below between a user and a legal assistant in at most \
+{max_words} words. Keep the facts, clauses, definitions and open questions the assistant may need later; \
+leave out pleasantries. If a previous summary is given, merge it in.
+
+Previous summary: {summary}
+
+Conversation:
+{transcript}"""
+
+
+@dataclass
+class Conversation:
+    """What is remembered of one chat session: a rolling summary and the turns after it."""
+
+    session_id: str
+    summary: str = ""
+    turns: List[Dict[str, str]] = field(default_factory=list)
+
+    def history(self, n_past_messages: int = DEFAULT_N_PAST_MESSAGES) -> List[Dict[str, str]]:
+        """Messages to put before a new question: the summary, then the last `n_past_messages` turns."""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the conversation so far: {self.summary}"})
+        return messages + (self.turns[-n_past_messages:] if n_past_messages > 0 else [])
+
+
+class ConversationStore:
+    """Chat sessions kept in a Django cache, so the store follows that cache's backend.
+
+    With the local-memory backend sessions live in one worker; the file-based
+    backend shares them between workers on a host. Each session expires `ttl`
+    seconds after its last turn. Two requests on the same session at once both
+    append to the history they read, and the later save wins.
+
+    Summarising older turns takes an LLM call, so it runs on a background
+    thread after the exchange is saved, never on the request path.
+    """
+
+    def __init__(
+        self,
+        alias: str = "default",
+        ttl: int = DEFAULT_SESSION_TTL,
+        n_past_messages: int = DEFAULT_N_PAST_MESSAGES,
+        summary_trigger_tokens: int = DEFAULT_SUMMARY_TRIGGER_TOKENS,
+        summary_max_tokens: int = DEFAULT_SUMMARY_MAX_TOKENS,
+        token_cap: int = DEFAULT_SESSION_TOKEN_CAP,
+    ):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.ttl = ttl
+        self.n_past_messages = n_past_messages
+        self.summary_trigger_tokens = summary_trigger_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.token_cap = token_cap
+        # A thread rather than a task: under WSGI the request's event loop is gone once it returns
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._compacting: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def load(self, session_id: Optional[str] = None) -> Conversation:
+        """The stored session, or a new one (with a fresh id if none is given)."""
+        session_id = session_id or uuid.uuid4().hex
+        data = self.cache.get(KEY_PREFIX + session_id)
+        return Conversation(**data) if data else Conversation(session_id)
+
+    def save(self, conversation: Conversation) -> None:
+        self.cache.set(KEY_PREFIX + conversation.session_id, asdict(conversation), timeout=self.ttl)
+
+    def clear(self, session_id: str) -> None:
+        self.cache.delete(KEY_PREFIX + session_id)
+
+    def history(self, conversation: Conversation) -> List[Dict[str, str]]:
+        return conversation.history(self.n_past_messages)
+
+    def summarize(self, summary: str, turns: List[Dict[str, str]]) -> str:
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        prompt = SUMMARY_PROMPT.format(
+            max_words=int(self.summary_max_tokens * 0.75), summary=summary or "(none)", transcript=transcript
+        )
+        response = get_completion([{"role": "user", "content": prompt}], max_tokens=self.summary_max_tokens)
+        return response.choices[0].message.content.strip()
+
+    def split_turns(self, turns: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+        """Turns before the last `n_past_messages`, and the last `n_past_messages` turns."""
+        n_older = max(len(turns) - self.n_past_messages, 0) if self.n_past_messages > 0 else len(turns)
+        return turns[:n_older], turns[n_older:]
+
+    def older_turns(self, conversation: Conversation) -> List[Dict[str, str]]:
+        """Turns before the last `n_past_messages`, once they are worth summarising."""
+        older, _ = self.split_turns(conversation.turns)
+        return older if older and num_tokens_from_messages(older) >= self.summary_trigger_tokens else []
+
+    def enforce_cap(self, conversation: Conversation) -> None:
+        """Drop the oldest turns until summary and recent turns fit in `token_cap`.
+
+        Turns before the last `n_past_messages` are left for the summary
+        rather than counted against the cap. They have a cap of their own,
+        also `token_cap`, for when summarising keeps failing.
+        """
+        if conversation.summary:
+            conversation.summary = truncate_to_tokens(conversation.summary, self.summary_max_tokens)
+        summary_tokens = num_tokens_from_string(conversation.summary) if conversation.summary else 0
+        while conversation.turns:
+            older, recent = self.split_turns(conversation.turns)
+            if (not older or num_tokens_from_messages(older) <= self.token_cap) and (
+                not recent or summary_tokens + num_tokens_from_messages(recent) <= self.token_cap
+            ):
+                break
+            conversation.turns = conversation.turns[1:]
+
+    def compact(self, session_id: str) -> None:
+        """Fold turns older than the last `n_past_messages` into the summary.
+
+        Older turns are summarised in one call once they reach
+        `summary_trigger_tokens`, so most exchanges make no summary call. The
+        session is read again before saving, and the summarised turns are
+        only removed if they are still its oldest, so turns added meanwhile
+        are kept. If summarising fails the session is left as it is, and the
+        turns are summarised after the next exchange.
+        """
+        conversation = self.load(session_id)
+        older = self.older_turns(conversation)
+        if not older:
+            return
+        try:
+            summary = self.summarize(conversation.summary, older)
+        except Exception as e:
+            logger.warning("Could not summarise session %s, will retry after its next exchange: %s", session_id, e)
+            return
+
+        latest = self.load(session_id)
+        if latest.turns[:len(older)] != older:
+            # Cleared, expired or rewritten while we were summarising
+            return
+        latest.summary = summary
+        latest.turns = latest.turns[len(older):]
+        self.enforce_cap(latest)
+        self.save(latest)
+
+    def compact_in_background(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self._compacting:
+                return
+            self._compacting.add(session_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary")
+        self._executor.submit(self._compact_and_release, session_id)
+
+    def _compact_and_release(self, session_id: str) -> None:
+        try:
+            self.compact(session_id)
+        except Exception:
+            logger.exception("Compacting session %s failed.", session_id)
+        finally:
+            with self._lock:
+                self._compacting.discard(session_id)
+
+    async def add_exchange(self, conversation: Conversation, question: str, answer: str) -> None:
+        """Record a question and its answer and save the session; summarising happens afterwards."""
+        conversation.turns += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        self.enforce_cap(conversation)
+        await self.cache.aset(KEY_PREFIX + conversation.session_id, asdict(conversation), timeout=self.ttl)
+        if self.older_turns(conversation):
+            self.compact_in_background(conversation.session_id)
+
+
+_store: Optional[ConversationStore] = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store() -> ConversationStore:
+    """Return the process-wide store configured from settings."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ConversationStore(
+                    alias=getattr(settings, "CHAT_MEMORY_CACHE_ALIAS", "default"),
+                    ttl=getattr(settings, "CHAT_SESSION_TTL", DEFAULT_SESSION_TTL),
+                    n_past_messages=getattr(settings, "CHAT_N_PAST_MESSAGES", DEFAULT_N_PAST_MESSAGES),
+                    summary_trigger_tokens=getattr(settings, "CHAT_SUMMARY_TRIGGER_TOKENS", DEFAULT_SUMMARY_TRIGGER_TOKENS),
+                    summary_max_tokens=getattr(settings, "CHAT_SUMMARY_MAX_TOKENS", DEFAULT_SUMMARY_MAX_TOKENS),
+                    token_cap=getattr(settings, "CHAT_SESSION_TOKEN_CAP", DEFAULT_SESSION_TOKEN_CAP),
+                )
+    return _store
@@ -0,0 +1,208 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 10000
+# About 600 MB of 1536-dimensional vectors.
+DEFAULT_MAX_DISK_ENTRIES = 100000
+# Stay below SQLite's limit on bound parameters per statement.
+SQLITE_BATCH = 500
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a clause for cache lookups: NFKC with whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class LRUTier:
+    """Bounded in-process tier, least recently used entries evicted first."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+            return vector
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteStore:
+    """Rows keyed by text in one table of a SQLite file shared by every worker on the host.
+
+    `columns` maps the value columns to their SQLite types; each row also
+    records when it was written. Holds at most `max_entries` rows (0 for no
+    limit), the oldest writes evicted first. `table` and the column names go
+    into the SQL as they are, so they must be constants.
+    """
+
+    def __init__(self, path: str, table: str, columns: Dict[str, str], max_entries: int = 0):
+        self.path = path
+        self.table = table
+        self.columns = list(columns)
+        self.max_entries = max_entries
+        self.evictions = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        definitions = "".join(f"{name} {type_} NOT NULL, " for name, type_ in columns.items())
+        with self._connect() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, {definitions}created REAL NOT NULL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_created ON {table} (created)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread and per process; connections must not cross a fork.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get_many(self, keys: Sequence[str], column: str) -> Dict[str, Any]:
+        """`column` of every row whose key is in `keys`."""
+        found = {}
+        conn = self._connect()
+        for start in range(0, len(keys), SQLITE_BATCH):
+            batch = list(keys[start:start + SQLITE_BATCH])
+            placeholders = ",".join("?" * len(batch))
+            found.update(conn.execute(
+                f"SELECT key, {column} FROM {self.table} WHERE key IN ({placeholders})", batch
+            ).fetchall())
+        return found
+
+    def put_many(self, rows: Dict[str, Tuple]) -> None:
+        """Insert or replace rows, given as key -> values in the order of `columns`."""
+        if not rows:
+            return
+        now = time.time()
+        names = ", ".join(["key"] + self.columns + ["created"])
+        placeholders = ", ".join("?" * (len(self.columns) + 2))
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} ({names}) VALUES ({placeholders})",
+                [(key, *values, now) for key, values in rows.items()],
+            )
+            if self.max_entries:
+                excess = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    conn.execute(
+                        f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY created LIMIT ?)",
+                        (excess,),
+                    )
+                    self.evictions += excess
+
+
+class SQLiteTier:
+    """On-disk tier shared by every worker on the host; vectors stored as float32 blobs.
+
+    Holds at most `max_entries` rows (0 for no limit); the oldest writes are
+    evicted first.
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_DISK_ENTRIES):
+        self.store = SQLiteStore(path, "embeddings", {"model": "TEXT", "dim": "INTEGER", "vector": "BLOB"}, max_entries)
+
+    @property
+    def evictions(self) -> int:
+        return self.store.evictions
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        return {key: np.frombuffer(blob, dtype=np.float32) for key, blob in self.store.get_many(keys, "vector").items()}
+
+    def put_many(self, model_name: str, items: Dict[str, np.ndarray]) -> None:
+        self.store.put_many({
+            key: (model_name, len(v), np.asarray(v, dtype=np.float32).tobytes()) for key, v in items.items()
+        })
+
+
+class EmbeddingCache:
+    """Query-embedding cache keyed by model name and normalised text.
+
+    Lookups go to the in-process LRU first and then, if configured, to the
+    SQLite tier; disk hits are promoted into the LRU.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        path: Optional[str] = None,
+        max_disk_entries: int = DEFAULT_MAX_DISK_ENTRIES,
+    ):
+        self.memory = LRUTier(max_entries)
+        self.disk = SQLiteTier(path, max_disk_entries) if path else None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_many(self, model_name: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        keys = [cache_key(model_name, text) for text in texts]
+        found: List[Optional[np.ndarray]] = [self.memory.get(key) for key in keys]
+        memory_hits = sum(vector is not None for vector in found)
+
+        disk_hits = 0
+        missing = [key for key, vector in zip(keys, found) if vector is None]
+        if missing and self.disk is not None:
+            from_disk = self.disk.get_many(missing)
+            for i, key in enumerate(keys):
+                if found[i] is None and key in from_disk:
+                    found[i] = from_disk[key]
+                    self.memory.put(key, found[i])
+                    disk_hits += 1
+
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.disk_hits += disk_hits
+            self.misses += len(keys) - memory_hits - disk_hits
+        return found
+
+    def put_many(self, model_name: str, texts: Sequence[str], vectors: Sequence[np.ndarray]) -> None:
+        items = {}
+        for text, vector in zip(texts, vectors):
+            key = cache_key(model_name, text)
+            vector = np.asarray(vector, dtype=np.float32)
+            self.memory.put(key, vector)
+            items[key] = vector
+        if self.disk is not None:
+            self.disk.put_many(model_name, items)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self.memory),
+            "max_entries": self.memory.max_entries,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.memory.evictions,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "disk_enabled": self.disk is not None,
+            "disk_evictions": self.disk.evictions if self.disk is not None else 0,
+        }
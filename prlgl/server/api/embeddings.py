@@ -0,0 +1,250 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+from api.embedding_cache import DEFAULT_MAX_DISK_ENTRIES, EmbeddingCache
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5.0
+STATS_WINDOW = 1024
+
+
+class BatchStats:
+    """Rolling per-batch size and latency figures for one embedding service."""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self._lock = threading.Lock()
+        self._sizes = deque(maxlen=window)
+        self._latencies_ms = deque(maxlen=window)
+        self.n_batches = 0
+        self.n_items = 0
+
+    def record(self, size: int, latency_ms: float) -> None:
+        with self._lock:
+            self._sizes.append(size)
+            self._latencies_ms.append(latency_ms)
+            self.n_batches += 1
+            self.n_items += size
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            sizes = np.asarray(self._sizes, dtype=np.float64)
+            latencies = np.asarray(self._latencies_ms, dtype=np.float64)
+            n_batches, n_items = self.n_batches, self.n_items
+        if not len(sizes):
+            return {"batches": n_batches, "items": n_items}
+        return {
+            "batches": n_batches,
+            "items": n_items,
+            "batch_size_mean": float(sizes.mean()),
+            "batch_size_max": int(sizes.max()),
+            "latency_ms_mean": float(latencies.mean()),
+            "latency_ms_p50": float(np.percentile(latencies, 50)),
+            "latency_ms_p95": float(np.percentile(latencies, 95)),
+            "latency_ms_max": float(latencies.max()),
+        }
+
+
+class EmbeddingService(Embeddings):
+    """A sentence-transformers model loaded once per process.
+
+    Document embeddings are encoded directly as one batch. Query embeddings
+    are looked up in `cache` first; misses are handed to a background thread
+    that gathers concurrent requests into micro-batches of at most
+    `max_batch_size`, waiting at most `max_wait_ms` for a batch to fill up.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_EMBEDDING_MODEL,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.cache = cache
+        self.stats = BatchStats()
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_pid = None
+        self._worker_lock = threading.Lock()
+
+    @property
+    def model(self) -> "SentenceTransformer":
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    # torch and transformers take seconds to import; only pay for it when a model is needed
+                    from sentence_transformers import SentenceTransformer
+                    started = time.perf_counter()
+                    self._model = SentenceTransformer(self.model_name)
+                    logger.info("Loaded embedding model %s in %.2fs.", self.model_name, time.perf_counter() - started)
+        return self._model
+
+    def warm_up(self) -> None:
+        """Load the model and run one encode so the first request pays nothing."""
+        self.encode(["warm up"])
+        self._ensure_worker()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        # Same preprocessing as HuggingFaceEmbeddings so existing indexes stay valid.
+        texts = [text.replace("\n", " ") for text in texts]
+        return self.model.encode(texts, batch_size=self.max_batch_size, convert_to_numpy=True)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        started = time.perf_counter()
+        vectors = self.encode(texts)
+        self.stats.record(len(texts), (time.perf_counter() - started) * 1000)
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed independent queries, serving repeats from the cache.
+
+        A single miss goes through the micro-batcher; several misses are
+        already a batch and are encoded together in one call.
+        """
+        vectors = self._cached(texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if len(missing) > 1:
+            encoded = dict(zip(missing, self.embed_documents(missing)))
+            self._store(missing, [encoded[text] for text in missing])
+            return [encoded[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+
+        futures: Dict[str, Future] = {}
+        for text, vector in zip(texts, vectors):
+            if vector is None and text not in futures:
+                futures[text] = self.submit(text)
+        for i, text in enumerate(texts):
+            if vectors[i] is None:
+                vectors[i] = futures[text].result()
+        self._store(list(futures), [future.result() for future in futures.values()])
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self._cached([text])[0]
+        if vector is None:
+            vector = await asyncio.wrap_future(self.submit(text))
+            self._store([text], [vector])
+        return vector
+
+    def _cached(self, texts: List[str]) -> List[Optional[List[float]]]:
+        if self.cache is None:
+            return [None] * len(texts)
+        return [None if v is None else v.tolist() for v in self.cache.get_many(self.model_name, texts)]
+
+    def _store(self, texts: List[str], vectors: List[List[float]]) -> None:
+        if self.cache is not None and texts:
+            self.cache.put_many(self.model_name, texts, vectors)
+
+    def submit(self, text: str) -> Future:
+        """Queue one query for the micro-batcher and return its future."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _ensure_worker(self) -> None:
+        # Threads do not survive a fork, so a pre-forked worker starts its own.
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(
+                target=self._run, name=f"embedding-batcher-{self.model_name}", daemon=True
+            )
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            texts = [text for text, _ in batch]
+            started = time.perf_counter()
+            try:
+                vectors = self.encode(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.stats.record(len(batch), (time.perf_counter() - started) * 1000)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector.tolist())
+
+
+_registry: Dict[str, EmbeddingService] = {}
+_registry_lock = threading.Lock()
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Return the query-embedding cache shared by every model in this process."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(
+                    max_entries=getattr(settings, "EMBEDDING_CACHE_SIZE", 10000),
+                    path=getattr(settings, "EMBEDDING_CACHE_PATH", None),
+                    max_disk_entries=getattr(settings, "EMBEDDING_CACHE_MAX_ROWS", DEFAULT_MAX_DISK_ENTRIES),
+                )
+    return _cache
+
+
+def get_embedding_service(model_name: str = DEFAULT_EMBEDDING_MODEL) -> EmbeddingService:
+    """Return the process-wide service for `model_name`, creating it on first use."""
+    service = _registry.get(model_name)
+    if service is None:
+        with _registry_lock:
+            service = _registry.get(model_name)
+            if service is None:
+                service = EmbeddingService(
+                    model_name,
+                    max_batch_size=getattr(settings, "EMBEDDING_MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE),
+                    max_wait_ms=getattr(settings, "EMBEDDING_MAX_WAIT_MS", DEFAULT_MAX_WAIT_MS),
+                    cache=get_embedding_cache(),
+                )
+                _registry[model_name] = service
+    return service
+
+
+def embedding_stats() -> Dict[str, Dict]:
+    """Batch statistics for every loaded model and the query-embedding cache counters."""
+    return {
+        "models": {name: service.stats.snapshot() for name, service in _registry.items()},
+        "cache": get_embedding_cache().stats(),
+    }
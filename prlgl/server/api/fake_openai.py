@@ -0,0 +1,185 @@
+"""Local stand-in for the OpenAI chat completions API, for load tests.
+
+Run it with `python -m api.fake_openai --port 8090` and point a server at it
+with OPENAI_BASE_URL=http://127.0.0.1:8090/v1. Every reply takes
+`latency_ms` plus the time to "generate" its tokens at `tokens_per_second`,
+and a `rate_limit_rate` share of requests is answered with a 429. Replies
+in JSON mode follow the JSON schema found in the prompt, so structured
+outputs validate; other replies are filler text of `completion_tokens`
+tokens. Streaming is supported. GET /stats returns request counts.
+"""
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+SCHEMA_MARKER = "conforms to this JSON schema:\n"
+CLAUSE_ID = re.compile(r'<clause id="([^"]+)">')
+FILLER = "The clause allocates risk between the parties and should state the governing terms clearly."
+# Rough tokens per filler word, to size replies without a tokenizer.
+TOKENS_PER_WORD = 1.3
+
+
+def filler_text(n_tokens: int) -> str:
+    words = FILLER.split()
+    n_words = max(1, int(n_tokens / TOKENS_PER_WORD))
+    return " ".join(words[i % len(words)] for i in range(n_words))
+
+
+def instance_of(schema: Dict[str, Any], defs: Dict[str, Any], text: str, keys: List[str]) -> Any:
+    """A small value that validates against a JSON schema as pydantic writes them.
+
+    Free-form objects (e.g. clause id -> institutions) get one entry per key in `keys`.
+    """
+    if "$ref" in schema:
+        return instance_of(defs[schema["$ref"].rsplit("/", 1)[-1]], defs, text, keys)
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in schema:
+            return instance_of(schema[key][0], defs, text, keys)
+    kind = schema.get("type")
+    if kind == "object":
+        if "properties" in schema:
+            return {name: instance_of(prop, defs, text, keys) for name, prop in schema["properties"].items()}
+        if isinstance(schema.get("additionalProperties"), dict):
+            return {key: instance_of(schema["additionalProperties"], defs, text, keys) for key in keys or ["0"]}
+        return {}
+    if kind == "array":
+        return [instance_of(schema.get("items", {}), defs, text, keys)]
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return False
+    if kind == "null":
+        return None
+    return text
+
+
+def json_reply(messages: List[Dict[str, str]], n_tokens: int) -> str:
+    keys = [key for message in messages for key in CLAUSE_ID.findall(message.get("content") or "")]
+    for message in reversed(messages):
+        content = message.get("content") or ""
+        if SCHEMA_MARKER in content:
+            schema = json.loads(content.split(SCHEMA_MARKER, 1)[1])
+            return json.dumps(instance_of(schema, schema.get("$defs", {}), filler_text(n_tokens), keys))
+    return json.dumps({"reply": filler_text(n_tokens)})
+
+
+class FakeOpenAI:
+    def __init__(
+        self,
+        latency_ms: float = 300.0,
+        tokens_per_second: float = 50.0,
+        completion_tokens: int = 150,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 0.5,
+        seed: Optional[int] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.counts = {"requests": 0, "completed": 0, "rate_limited": 0, "streamed": 0}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.counts)
+
+    def reply(self, body: Dict[str, Any]) -> str:
+        n_tokens = min(self.completion_tokens, body.get("max_tokens") or self.completion_tokens)
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            return json_reply(body.get("messages", []), n_tokens)
+        return filler_text(n_tokens)
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.counts["requests"] += 1
+        body = await request.json()
+        if self.random.random() < self.rate_limit_rate:
+            self.counts["rate_limited"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached (injected).", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"retry-after": str(self.retry_after)},
+            )
+
+        content = self.reply(body)
+        pieces = re.findall(r"\S+\s*", content)
+        prompt_tokens = sum(len((m.get("content") or "").split()) for m in body.get("messages", []))
+        completion_tokens = int(len(pieces) * TOKENS_PER_WORD)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        model = body.get("model", "gpt-4-turbo-preview")
+        await asyncio.sleep(self.latency_ms / 1000)
+
+        if body.get("stream"):
+            self.counts["streamed"] += 1
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            delay = TOKENS_PER_WORD / self.tokens_per_second if self.tokens_per_second else 0
+            for i, piece in enumerate(pieces):
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece} if i == 0 else {"content": piece},
+                                 "finish_reason": None}],
+                }
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await asyncio.sleep(delay)
+            last = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            await response.write(f"data: {json.dumps(last)}\n\n".encode())
+            if (body.get("stream_options") or {}).get("include_usage"):
+                usage = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [], "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                                  "total_tokens": prompt_tokens + completion_tokens}}
+                await response.write(f"data: {json.dumps(usage)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+            self.counts["completed"] += 1
+            return response
+
+        if self.tokens_per_second:
+            await asyncio.sleep(completion_tokens / self.tokens_per_second)
+        self.counts["completed"] += 1
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Time to first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Generation speed; 0 for instant.")
+    parser.add_argument("--completion-tokens", type=int, default=150, help="Length of plain-text replies.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests answered with 429.")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="Retry-After seconds sent with a 429.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    fake = FakeOpenAI(args.latency_ms, args.tokens_per_second, args.completion_tokens,
+                      args.rate_limit_rate, args.retry_after, args.seed)
+    web.run_app(fake.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import re
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from api.retrieval import reciprocal_rank_fusion
+from api.tokens import num_tokens_from_strings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_K = 5
+DEFAULT_TOKEN_BUDGET = 500
+# Terms less similar than this to the question are left out unless named in it.
+DEFAULT_MIN_SIMILARITY = 0.3
+INITIAL_CAPACITY = 64
+
+WORD = re.compile(r"\w+")
+
+
+def words(text: str) -> List[str]:
+    return WORD.findall(text.lower())
+
+
+class GlossaryIndex:
+    """Glossary of term -> explanation searchable by question.
+
+    Each entry is embedded once when it is added; a question is embedded
+    and compared with every entry (dense), and terms whose words all occur
+    in the question are found through an inverted index (lexical). The two
+    rankings are fused with reciprocal-rank fusion. Adding, replacing or
+    removing a term touches only that term, so no rebuild is needed.
+    """
+
+    def __init__(
+        self,
+        embeddings=None,
+        top_k: int = DEFAULT_TOP_K,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        min_similarity: float = DEFAULT_MIN_SIMILARITY,
+    ):
+        self._embeddings = embeddings
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._terms: List[str] = []
+        self._explanations: Dict[str, str] = {}
+        self._rows: Dict[str, int] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._by_word: Dict[str, set] = {}
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            from api.embeddings import get_embedding_service
+            self._embeddings = get_embedding_service()
+        return self._embeddings
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self._explanations
+
+    def __getitem__(self, term: str) -> str:
+        return self._explanations[term]
+
+    def items(self) -> List[Tuple[str, str]]:
+        return [(term, self._explanations[term]) for term in self._terms]
+
+    def _embed(self, entries: Dict[str, str]) -> np.ndarray:
+        texts = [f"{term}: {explanation}" for term, explanation in entries.items()]
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def update(self, entries: Dict[str, str]) -> None:
+        """Add or replace terms; new explanations are embedded in one batch."""
+        entries = {term: explanation for term, explanation in entries.items() if self._explanations.get(term) != explanation}
+        if not entries:
+            return
+        vectors = self._embed(entries)
+        with self._lock:
+            n_new = sum(term not in self._rows for term in entries)
+            self._reserve(len(self._terms) + n_new, vectors.shape[1])
+            for (term, explanation), vector in zip(entries.items(), vectors):
+                if term not in self._rows:
+                    self._rows[term] = len(self._terms)
+                    self._terms.append(term)
+                    for word in set(words(term)):
+                        self._by_word.setdefault(word, set()).add(term)
+                self._vectors[self._rows[term]] = vector
+                self._explanations[term] = explanation
+
+    def add(self, term: str, explanation: str) -> None:
+        self.update({term: explanation})
+
+    def remove(self, term: str) -> None:
+        with self._lock:
+            row = self._rows.pop(term, None)
+            if row is None:
+                return
+            # Move the last entry into the freed row
+            last = self._terms.pop()
+            if last != term:
+                self._terms[row] = last
+                self._rows[last] = row
+                self._vectors[row] = self._vectors[len(self._terms)]
+            del self._explanations[term]
+            for word in set(words(term)):
+                self._by_word[word].discard(term)
+
+    def _reserve(self, size: int, dim: int) -> None:
+        # Grow geometrically so adding terms one at a time stays cheap
+        if self._vectors is None:
+            self._vectors = np.zeros((max(INITIAL_CAPACITY, size), dim), dtype=np.float32)
+        elif size > len(self._vectors):
+            grown = np.zeros((max(size, 2 * len(self._vectors)), dim), dtype=np.float32)
+            grown[:len(self._terms)] = self._vectors[:len(self._terms)]
+            self._vectors = grown
+
+    def lexical_search(self, question: str) -> List[str]:
+        """Terms all of whose words occur in the question, longest first."""
+        question_words = set(words(question))
+        with self._lock:
+            candidates = set().union(*(self._by_word.get(word, ()) for word in question_words))
+            found = [term for term in candidates if set(words(term)) <= question_words]
+        return sorted(found, key=lambda term: -len(words(term)))
+
+    def dense_search(self, question: str, k: int) -> List[str]:
+        with self._lock:
+            terms, vectors = list(self._terms), self._vectors[:len(self._terms)]
+        if not terms:
+            return []
+        query = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        scores = vectors @ (query / max(np.linalg.norm(query), 1e-12))
+        best = np.argsort(-scores)[:k]
+        return [terms[i] for i in best if scores[i] >= self.min_similarity]
+
+    def search(self, question: str, k: Optional[int] = None) -> List[Tuple[str, str]]:
+        """The `k` most relevant (term, explanation) pairs for a question."""
+        k = k or self.top_k
+        if not self._terms:
+            return []
+        rankings = [self.lexical_search(question), self.dense_search(question, k)]
+        fused = reciprocal_rank_fusion([ranking for ranking in rankings if ranking])
+        return [(term, self._explanations[term]) for term, _ in fused[:k] if term in self._explanations]
+
+    def context(self, question: str) -> Optional[str]:
+        """Relevant entries as prompt text within the token budget, or None if nothing is relevant."""
+        lines = [f"- {term}: {explanation}" for term, explanation in self.search(question)]
+        kept, remaining = [], self.token_budget
+        for line, n_tokens in zip(lines, num_tokens_from_strings(lines)):
+            if n_tokens <= remaining:
+                kept.append(line)
+                remaining -= n_tokens
+        if not kept:
+            return None
+        return "Glossary entries relevant to the question:\n" + "\n".join(kept)
+
+
+def load_glossary_file(path: str) -> Dict[str, str]:
+    """Read a JSON object of term -> explanation."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+_glossary: Optional[GlossaryIndex] = None
+_glossary_lock = threading.Lock()
+
+
+def get_glossary() -> GlossaryIndex:
+    """Return the process-wide glossary, seeded from CHATBOT_GLOSSARY_PATH if set."""
+    global _glossary
+    if _glossary is None:
+        with _glossary_lock:
+            if _glossary is None:
+                glossary = GlossaryIndex(
+                    top_k=getattr(settings, "CHATBOT_GLOSSARY_TOP_K", DEFAULT_TOP_K),
+                    token_budget=getattr(settings, "CHATBOT_GLOSSARY_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET),
+                    min_similarity=getattr(settings, "CHATBOT_GLOSSARY_MIN_SIMILARITY", DEFAULT_MIN_SIMILARITY),
+                )
+                path = getattr(settings, "CHATBOT_GLOSSARY_PATH", None)
+                if path:
+                    glossary.update(load_glossary_file(path))
+                    logger.info("Loaded %d glossary terms from %s.", len(glossary), path)
+                _glossary = glossary
+    return _glossary
@@ -0,0 +1,214 @@
+import os
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from langchain_community.document_loaders import TextLoader
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.documents import Document
+
+from api.chunking import ClauseSplitter, split_documents_parallel
+from api.knowledge_index import (
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    CHUNKER,
+    EMBEDDING_MODEL,
+    FAISS_INDEX_DIR,
+    KNOWLEDGE_BASE_DIR,
+    current_version,
+    file_sha256,
+    get_embeddings,
+    index_version,
+    load_index,
+    read_manifest,
+    save_version,
+    settings_match,
+    write_current,
+)
+from api.pdf_loader import get_page_executor, pdf_loader
+from api.retrieval import SparseIndex
+
+logger = logging.getLogger(__name__)
+
+LOADERS = {
+    ".pdf": pdf_loader,
+    ".txt": TextLoader,
+    ".md": TextLoader,
+}
+
+
+@dataclass
+class IngestReport:
+    version: str
+    added_documents: List[str] = field(default_factory=list)
+    changed_documents: List[str] = field(default_factory=list)
+    deleted_documents: List[str] = field(default_factory=list)
+    unchanged_documents: int = 0
+    embedded_chunks: int = 0
+    removed_chunks: int = 0
+    total_chunks: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added_documents or self.changed_documents or self.deleted_documents)
+
+
+def chunk_id(source: str, content: str) -> str:
+    """Content hash identifying a chunk of `source` in the docstore."""
+    return hashlib.sha256(f"{source}\0{content}".encode("utf-8")).hexdigest()
+
+
+def scan_documents(source_dir: str) -> Dict[str, str]:
+    """Map every supported document below `source_dir` (relative path) to its absolute path."""
+    found = {}
+    for root, _, files in os.walk(source_dir):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in LOADERS:
+                path = os.path.join(root, name)
+                found[os.path.relpath(path, source_dir).replace(os.sep, "/")] = path
+    return found
+
+
+def load_document(path: str) -> List[Document]:
+    return LOADERS[os.path.splitext(path)[1].lower()](path).load()
+
+
+def keyed_chunks(source: str, docs: List[Document]) -> Dict[str, Document]:
+    """Chunks of one document keyed by chunk id."""
+    chunks = {}
+    for doc in docs:
+        doc.metadata["source"] = source
+        # Repeated boilerplate inside one document is indexed once.
+        chunks.setdefault(chunk_id(source, doc.page_content), doc)
+    return chunks
+
+
+def split_document(path: str, source: str) -> Dict[str, Document]:
+    """Load and split one document into chunks keyed by chunk id."""
+    return keyed_chunks(source, ClauseSplitter(CHUNK_SIZE, CHUNK_OVERLAP).split_documents(load_document(path)))
+
+
+def ingest_directory(
+    source_dir: str = KNOWLEDGE_BASE_DIR,
+    index_dir: str = FAISS_INDEX_DIR,
+    force: bool = False,
+) -> IngestReport:
+    """Bring the knowledge index in line with the documents in `source_dir`.
+
+    Documents whose file hash is unchanged are skipped without being read.
+    Changed documents are re-split, in parallel on the page extraction
+    pool, and only chunks with a new content hash are embedded; chunks
+    that disappeared are deleted from the index.
+    Documents removed from `source_dir` leave a tombstone in the manifest.
+    The result is saved as a new index version together with a TF-IDF
+    matrix over all chunks; refitting it is cheap next to embedding.
+    """
+    files = scan_documents(source_dir)
+    if not files:
+        raise FileNotFoundError(f"No documents found in {source_dir}.")
+
+    previous = None
+    vector_store: Optional[FAISS] = None
+    version = current_version(index_dir)
+    if version is not None and not force:
+        previous = read_manifest(index_dir, version)
+        if settings_match(previous):
+            vector_store = load_index(index_dir, version)
+        else:
+            logger.info("Index settings changed, rebuilding from scratch.")
+            previous = None
+
+    documents: Dict[str, Dict[str, Any]] = dict(previous["documents"]) if previous else {}
+    tombstones: Dict[str, Dict[str, Any]] = dict(previous.get("tombstones", {})) if previous else {}
+    report = IngestReport(version=version or "")
+    now = datetime.now(timezone.utc).isoformat()
+
+    to_add: Dict[str, Document] = {}
+    to_remove: List[str] = []
+    to_refresh: Dict[str, Document] = {}
+
+    pending = []
+    for source, path in sorted(files.items()):
+        content_hash = file_sha256(path)
+        known = documents.get(source)
+        if known is not None and known["sha256"] == content_hash:
+            report.unchanged_documents += 1
+        else:
+            pending.append((source, path, content_hash, known))
+
+    # Pages are loaded first, so the pool is free for splitting by the time it is used for that.
+    split = split_documents_parallel(
+        [load_document(path) for _, path, _, _ in pending],
+        ClauseSplitter(CHUNK_SIZE, CHUNK_OVERLAP),
+        get_page_executor(),
+    )
+    for (source, path, content_hash, known), docs in zip(pending, split):
+        chunks = keyed_chunks(source, docs)
+        old_ids = set(known["chunks"]) if known else set()
+        for id_, doc in chunks.items():
+            if id_ in old_ids:
+                # Same text, possibly a different page number: no re-embedding.
+                to_refresh[id_] = doc
+            else:
+                to_add[id_] = doc
+        to_remove.extend(old_ids.difference(chunks))
+
+        documents[source] = {"sha256": content_hash, "chunks": list(chunks)}
+        tombstones.pop(source, None)
+        (report.changed_documents if known else report.added_documents).append(source)
+
+    for source in sorted(set(documents).difference(files)):
+        removed = documents.pop(source)
+        to_remove.extend(removed["chunks"])
+        tombstones[source] = {"deleted_at": now, "sha256": removed["sha256"], "chunks": removed["chunks"]}
+        report.deleted_documents.append(source)
+
+    report.total_chunks = sum(len(doc["chunks"]) for doc in documents.values())
+    if vector_store is not None and not report.changed:
+        logger.info("Knowledge index %s is up to date.", version)
+        write_current(index_dir, version)
+        return report
+
+    if to_remove and vector_store is not None:
+        vector_store.delete(to_remove)
+    if to_refresh and vector_store is not None:
+        vector_store.docstore.delete(list(to_refresh))
+        vector_store.docstore.add(to_refresh)
+    if to_add:
+        ids = list(to_add)
+        docs = [to_add[id_] for id_ in ids]
+        if vector_store is None:
+            vector_store = FAISS.from_documents(docs, get_embeddings(), ids=ids)
+        else:
+            vector_store.add_documents(docs, ids=ids)
+    if vector_store is None:
+        raise ValueError(f"No text could be extracted from the documents in {source_dir}.")
+    report.embedded_chunks = len(to_add)
+    report.removed_chunks = len(to_remove)
+
+    corpus_hash = hashlib.sha256(
+        "\n".join(f"{source}:{doc['sha256']}" for source, doc in sorted(documents.items())).encode("utf-8")
+    ).hexdigest()
+    report.version = index_version(corpus_hash)
+    manifest = {
+        "version": report.version,
+        "parent": version,
+        "embedding_model": EMBEDDING_MODEL,
+        "chunker": CHUNKER,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "n_chunks": report.total_chunks,
+        "built_at": now,
+        "documents": documents,
+        "tombstones": tombstones,
+    }
+    # TF-IDF cannot be fitted without text, so an index whose documents were all deleted is dense only
+    sparse_index = SparseIndex.from_vector_store(vector_store) if report.total_chunks else None
+    save_version(vector_store, manifest, index_dir, sparse_index=sparse_index)
+    logger.info(
+        "Built knowledge index %s: %d chunks embedded, %d removed, %d total.",
+        report.version, report.embedded_chunks, report.removed_chunks, report.total_chunks,
+    )
+    return report
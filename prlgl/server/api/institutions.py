@@ -0,0 +1,226 @@
+import os
+import re
+import csv
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+
+from api.embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_GAZETTEER_PATH = os.path.join(os.path.dirname(API_DIR), "instituteData", "arbitral-dataset.csv")
+GAZETTEER_COLUMN = "Flag"
+DEFAULT_NER_MODEL = "en_core_web_sm"
+# How often, at most, the gazetteer file is checked for changes.
+RELOAD_CHECK_SECONDS = 5.0
+
+NO_INSTITUTIONS = "No legal institutions found"
+
+# Words that make an ORG entity an institution rather than e.g. a contracting company.
+INSTITUTION_WORDS = re.compile(
+    r"\b(court|tribunal|arbitra\w*|mediat\w*|concilia\w*|chamber|cent(?:re|er)|commission|council|"
+    r"authority|institute|institution|association|board|agency|regulator\w*|ministry|registry|"
+    r"bureau|office|federation|bar)\b",
+    re.IGNORECASE,
+)
+# A clause that mentions none of these is taken not to name an institution.
+INSTITUTION_CUES = re.compile(
+    r"\b(court|tribunal|arbitra\w*|mediat\w*|concilia\w*|chamber|commission|regulator\w*|authority|"
+    r"institute|association|rules of)\b",
+    re.IGNORECASE,
+)
+
+GAZETTEER_CONFIDENCE = 1.0
+# Without NER an unknown institution next to a known one can go unseen
+GAZETTEER_ONLY_CONFIDENCE = 0.5
+NER_CONFIDENCE = 0.8
+NO_CUE_CONFIDENCE = 0.9
+UNRESOLVED_CONFIDENCE = 0.3
+
+
+@dataclass
+class LocalExtraction:
+    institutions: List[str]
+    confidence: float
+    # Organisations the local pass saw but could not classify as institutions.
+    unresolved: List[str] = field(default_factory=list)
+
+
+def is_acronym(name: str) -> bool:
+    return " " not in name and sum(c.isupper() for c in name) >= max(2, len(name) // 2)
+
+
+def unrecognised_institution(text: str, covered: List[Tuple[int, int]]) -> bool:
+    """Whether `text` has a capitalised institution word outside the `covered` spans."""
+    for m in INSTITUTION_WORDS.finditer(text):
+        if m.group()[0].isupper() and not any(start <= m.start() < end for start, end in covered):
+            return True
+    return False
+
+
+def read_gazetteer(path: str) -> List[str]:
+    """Institution names from the `Flag` column of the gazetteer CSV, normalised and de-duplicated."""
+    with open(path, newline="", encoding="utf-8") as f:
+        names = [normalize_text(row.get(GAZETTEER_COLUMN) or "").strip('"') for row in csv.DictReader(f)]
+    return list(dict.fromkeys(name for name in names if len(name) >= 2))
+
+
+class Gazetteer:
+    """Aho-Corasick automata over known institution names.
+
+    Full names match case-insensitively; acronyms such as "ICC" or "VIAC"
+    only in their own case. Matches must start and end on word boundaries
+    and overlapping matches keep the longest.
+    """
+
+    def __init__(self, names: List[str]):
+        import ahocorasick
+
+        self.names = names
+        self._names_ci = ahocorasick.Automaton()
+        self._acronyms = ahocorasick.Automaton()
+        for name in names:
+            if is_acronym(name):
+                self._acronyms.add_word(name, name)
+            else:
+                self._names_ci.add_word(name.lower(), name)
+        for automaton in (self._names_ci, self._acronyms):
+            if len(automaton):
+                automaton.make_automaton()
+
+    def _spans(self, automaton, text: str) -> List[Tuple[int, int, str]]:
+        if not len(automaton):
+            return []
+        spans = []
+        for end, name in automaton.iter(text):
+            start = end - len(name) + 1
+            if (start == 0 or not text[start - 1].isalnum()) and (end + 1 == len(text) or not text[end + 1].isalnum()):
+                spans.append((start, end + 1, name))
+        return spans
+
+    def find_spans(self, text: str) -> List[Tuple[int, int, str]]:
+        """Matches in `text`, which must already be normalised, in order of position."""
+        spans = self._spans(self._names_ci, text.lower()) + self._spans(self._acronyms, text)
+        found = []
+        for start, end, name in sorted(spans, key=lambda s: (s[0] - s[1], s[0])):
+            if not any(start < t_end and t_start < end for t_start, t_end, _ in found):
+                found.append((start, end, name))
+        return sorted(found)
+
+    def find(self, text: str) -> List[str]:
+        return [name for _, _, name in self.find_spans(normalize_text(text))]
+
+
+class InstitutionExtractor:
+    """Local institution extraction: gazetteer matches plus spaCy ORG entities.
+
+    Organisations that are neither in the gazetteer nor named like an
+    institution lower the confidence, as does a clause that talks about
+    arbitration or courts without naming anything we recognise, or that
+    still has a capitalised institution word ("Arbitration Board") outside
+    everything recognised; callers fall back to the LLM below their
+    threshold. Without the spaCy model only the gazetteer is used, and its
+    matches alone are never confident enough to skip the LLM.
+
+    The gazetteer is reloaded when its file changes on disk.
+    """
+
+    def __init__(self, gazetteer_path: str = DEFAULT_GAZETTEER_PATH, ner_model: Optional[str] = DEFAULT_NER_MODEL):
+        self.gazetteer_path = gazetteer_path
+        self.ner_model = ner_model
+        self._gazetteer: Optional[Gazetteer] = None
+        self._gazetteer_mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._nlp = None
+        self._nlp_loaded = False
+        self._lock = threading.Lock()
+
+    def reload(self) -> int:
+        """Rebuild the gazetteer from its file and return the number of names."""
+        mtime = os.path.getmtime(self.gazetteer_path)
+        gazetteer = Gazetteer(read_gazetteer(self.gazetteer_path))
+        # Readers keep using the old automaton until this assignment
+        self._gazetteer, self._gazetteer_mtime = gazetteer, mtime
+        logger.info("Loaded %d institution names from %s.", len(gazetteer.names), self.gazetteer_path)
+        return len(gazetteer.names)
+
+    @property
+    def gazetteer(self) -> Gazetteer:
+        now = time.monotonic()
+        if self._gazetteer is None or now - self._checked_at > RELOAD_CHECK_SECONDS:
+            with self._lock:
+                if self._gazetteer is None or now - self._checked_at > RELOAD_CHECK_SECONDS:
+                    self._checked_at = now
+                    if self._gazetteer is None or os.path.getmtime(self.gazetteer_path) != self._gazetteer_mtime:
+                        self.reload()
+        return self._gazetteer
+
+    @property
+    def nlp(self):
+        if not self._nlp_loaded:
+            with self._lock:
+                if not self._nlp_loaded:
+                    if self.ner_model:
+                        try:
+                            import spacy
+                            # Only the NER pipe is needed
+                            self._nlp = spacy.load(self.ner_model, exclude=["parser", "lemmatizer", "textcat"])
+                        except (ImportError, OSError) as e:
+                            logger.warning("spaCy model %s unavailable (%s); using the gazetteer only.", self.ner_model, e)
+                    self._nlp_loaded = True
+        return self._nlp
+
+    def warm_up(self) -> None:
+        self.extract("Disputes shall be referred to the ICC International Court of Arbitration.")
+
+    def extract(self, clause: str) -> LocalExtraction:
+        text = normalize_text(clause)
+        spans = self.gazetteer.find_spans(text)
+        found = [name for _, _, name in spans]
+        known = {name.lower() for name in found}
+        covered = [(start, end) for start, end, _ in spans]
+
+        named, unresolved = [], []
+        if self.nlp is not None:
+            for ent in self.nlp(text).ents:
+                if ent.label_ != "ORG":
+                    continue
+                covered.append((ent.start_char, ent.end_char))
+                name = ent.text
+                if name.lower() in known or any(name.lower() in k or k in name.lower() for k in known):
+                    continue
+                (named if INSTITUTION_WORDS.search(name) else unresolved).append(name)
+
+        institutions = found + list(dict.fromkeys(named))
+        if unresolved or unrecognised_institution(text, covered) or (not institutions and INSTITUTION_CUES.search(text)):
+            confidence = UNRESOLVED_CONFIDENCE
+        elif named:
+            confidence = NER_CONFIDENCE
+        elif found:
+            confidence = GAZETTEER_CONFIDENCE if self.nlp is not None else GAZETTEER_ONLY_CONFIDENCE
+        else:
+            confidence = NO_CUE_CONFIDENCE
+        return LocalExtraction(institutions or [NO_INSTITUTIONS], confidence, unresolved)
+
+
+_extractor: Optional[InstitutionExtractor] = None
+_extractor_lock = threading.Lock()
+
+
+def get_institution_extractor() -> InstitutionExtractor:
+    """Return the process-wide extractor configured from settings."""
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                _extractor = InstitutionExtractor(
+                    gazetteer_path=getattr(settings, "INSTITUTION_GAZETTEER_PATH", None) or DEFAULT_GAZETTEER_PATH,
+                    ner_model=getattr(settings, "INSTITUTION_NER_MODEL", DEFAULT_NER_MODEL) or None,
+                )
+    return _extractor
@@ -0,0 +1,248 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from django.conf import settings
+
+from api.embeddings import get_embedding_service
+from api.quantization import QUANTIZATION_MODES, QuantizedIndex, save_quantized
+from api.retrieval import HybridRetriever, SparseIndex
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores.faiss import FAISS
+
+logger = logging.getLogger(__name__)
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+KNOWLEDGE_BASE_DIR = os.path.join(API_DIR, "knowledge_base")
+FAISS_INDEX_DIR = os.path.join(API_DIR, "data", "faiss_index")
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Chunks are sized in tokens (api.tokens) and cut at clause boundaries by api.chunking.
+# 160 tokens stays within the 256 word pieces the embedding model reads.
+CHUNKER = "clause-v1"
+CHUNK_SIZE = 160
+CHUNK_OVERLAP = 24
+
+INDEX_NAME = "index"
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+KEEP_VERSIONS = 3
+
+_lock = threading.Lock()
+_retriever = None
+_loaded_version = None
+
+
+def get_embeddings():
+    """Return the embedding service shared by every index in this process."""
+    return get_embedding_service(EMBEDDING_MODEL)
+
+
+def file_sha256(path: str) -> str:
+    """Return the hex SHA-256 of a file, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def index_version(corpus_hash: str) -> str:
+    """Version name for an index built from `corpus_hash` with the current settings.
+
+    The build parameters are folded in so that changing the model or the
+    chunking settings produces a new version as well.
+    """
+    key = f"{corpus_hash}:{EMBEDDING_MODEL}:{CHUNKER}:{CHUNK_SIZE}:{CHUNK_OVERLAP}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def settings_match(manifest: Dict[str, Any]) -> bool:
+    """Whether an existing build used the embedding model and chunking we use now."""
+    return (
+        manifest.get("embedding_model") == EMBEDDING_MODEL
+        and manifest.get("chunker") == CHUNKER
+        and manifest.get("chunk_size") == CHUNK_SIZE
+        and manifest.get("chunk_overlap") == CHUNK_OVERLAP
+    )
+
+
+def current_version(index_dir: str = FAISS_INDEX_DIR) -> Optional[str]:
+    """Return the version the CURRENT pointer refers to, or None if nothing is built."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), "r") as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    if version and os.path.exists(os.path.join(index_dir, version, MANIFEST_FILE)):
+        return version
+    return None
+
+
+def read_manifest(index_dir: str = FAISS_INDEX_DIR, version: Optional[str] = None) -> Dict[str, Any]:
+    version = version or current_version(index_dir)
+    if version is None:
+        raise FileNotFoundError(f"No knowledge index has been built in {index_dir}.")
+    with open(os.path.join(index_dir, version, MANIFEST_FILE), "r") as f:
+        return json.load(f)
+
+
+def write_current(index_dir: str, version: str) -> None:
+    # Write-then-rename so readers never observe a half written pointer.
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, prefix=".current-")
+    with os.fdopen(fd, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(index_dir, CURRENT_FILE))
+
+
+def save_version(
+    vector_store: "FAISS",
+    manifest: Dict[str, Any],
+    index_dir: str = FAISS_INDEX_DIR,
+    sparse_index: Optional[SparseIndex] = None,
+) -> str:
+    """Write `vector_store` as version `manifest["version"]` and point CURRENT at it.
+
+    Each build lives in its own `<index_dir>/<version>/` directory, staged
+    and renamed into place, so a running worker keeps reading the previous
+    version until the pointer is flipped. The sparse index, if any, is
+    stored alongside the FAISS files, as are the int8 and binary indexes
+    and the float vectors they are re-scored with.
+    """
+    version = manifest["version"]
+    version_dir = os.path.join(index_dir, version)
+    os.makedirs(index_dir, exist_ok=True)
+
+    staging_dir = tempfile.mkdtemp(dir=index_dir, prefix=".build-")
+    try:
+        vector_store.save_local(folder_path=staging_dir, index_name=INDEX_NAME)
+        save_quantized(vector_store.index, staging_dir)
+        if sparse_index is not None:
+            sparse_index.save(staging_dir)
+        with open(os.path.join(staging_dir, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+        if os.path.exists(version_dir):
+            shutil.rmtree(version_dir)
+        os.replace(staging_dir, version_dir)
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    write_current(index_dir, version)
+    prune_versions(index_dir)
+    return version
+
+
+def prune_versions(index_dir: str = FAISS_INDEX_DIR, keep: int = KEEP_VERSIONS) -> None:
+    """Delete all but the `keep` most recently written versions, never the current one."""
+    current = current_version(index_dir)
+    versions = [
+        name for name in os.listdir(index_dir)
+        if os.path.exists(os.path.join(index_dir, name, MANIFEST_FILE))
+    ]
+    versions.sort(key=lambda name: os.path.getmtime(os.path.join(index_dir, name, MANIFEST_FILE)), reverse=True)
+    for name in versions[keep:]:
+        if name != current:
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+
+
+def load_index(index_dir: str = FAISS_INDEX_DIR, version: Optional[str] = None) -> "FAISS":
+    """Load a built index from disk."""
+    from langchain_community.vectorstores.faiss import FAISS
+
+    version = version or current_version(index_dir)
+    if version is None:
+        raise FileNotFoundError(f"No knowledge index has been built in {index_dir}.")
+    return FAISS.load_local(
+        folder_path=os.path.join(index_dir, version),
+        embeddings=get_embeddings(),
+        index_name=INDEX_NAME,
+        # The index is produced by our own build step, never uploaded.
+        allow_dangerous_deserialization=True,
+    )
+
+
+def load_quantized_index(index_dir: str, version: str, mode: str) -> Optional["FAISS"]:
+    """Load a built version for search only, with a quantized dense index instead of the float one.
+
+    Returns None for builds made before quantized indexes were stored.
+    """
+    import pickle
+    from langchain_community.vectorstores.faiss import FAISS
+
+    version_dir = os.path.join(index_dir, version)
+    index = QuantizedIndex.load(
+        version_dir, mode, rescore_factor=getattr(settings, "DENSE_RESCORE_FACTOR", 4)
+    )
+    if index is None:
+        return None
+    # Same docstore file FAISS.save_local writes; produced by our own build step
+    with open(os.path.join(version_dir, f"{INDEX_NAME}.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(get_embeddings(), index, docstore, index_to_docstore_id)
+
+
+def load_retriever(index_dir: str = FAISS_INDEX_DIR, version: Optional[str] = None) -> HybridRetriever:
+    """Load a built version as a hybrid retriever (dense only for builds without a sparse index).
+
+    With DENSE_INDEX_QUANTIZATION set to "int8" or "binary" the dense pass
+    searches that compact index and re-scores from the memory-mapped float
+    vectors; the float FAISS index is not loaded.
+    """
+    version = version or current_version(index_dir)
+    mode = getattr(settings, "DENSE_INDEX_QUANTIZATION", "none")
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown DENSE_INDEX_QUANTIZATION {mode!r}.")
+    vector_store = None
+    if mode != "none":
+        vector_store = load_quantized_index(index_dir, version, mode)
+        if vector_store is None:
+            logger.warning("Knowledge index %s has no %s index; run `python manage.py build_index --force`.", version, mode)
+    if vector_store is None:
+        vector_store = load_index(index_dir, version)
+    return HybridRetriever(vector_store, SparseIndex.load(os.path.join(index_dir, version)))
+
+
+def get_retriever() -> HybridRetriever:
+    """Return the process-wide knowledge base retriever.
+
+    The loaded index is swapped when the CURRENT pointer moves to a new
+    version. If nothing has been built yet the knowledge base directory is
+    ingested once, serialised by a lock.
+    """
+    global _retriever, _loaded_version
+    version = current_version()
+    if _retriever is not None and version == _loaded_version:
+        return _retriever
+
+    with _lock:
+        version = current_version()
+        if _retriever is not None and version == _loaded_version:
+            return _retriever
+        if version is None:
+            from api.ingest import ingest_directory
+            logger.warning("No knowledge index found, building it in-process.")
+            version = ingest_directory().version
+        _retriever = load_retriever(version=version)
+        _loaded_version = version
+        logger.info("Loaded knowledge index %s.", version)
+        return _retriever
+
+
+def get_index() -> "FAISS":
+    """Return the FAISS store behind the process-wide retriever."""
+    return get_retriever().vector_store
+
+
+def preload() -> None:
+    """Load the index at startup if one has been built; never builds."""
+    if current_version() is None:
+        logger.warning("Knowledge index not built yet; run `python manage.py build_index`.")
+        return
+    get_retriever()
@@ -1,14 +1,20 @@
 import os
-from dotenv import load_dotenv
-from typing import Any, Dict, Iterable, List, Optional
-from openai import OpenAI
+import time
+import asyncio
+import weakref
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+import httpx
+from openai import AsyncOpenAI, OpenAI
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion
 
-# CHECK: Read OpenAI API key from an environment variable
-# Load the environment variables from .env file
-
-o = os.path.dirname(os.path.abspath(__file__))
-
-os.chdir(o)
+from api.llm_cache import get_response_cache
+from api.llm_scheduler import get_scheduler
+from api.metrics import count_llm_call
+from api.request_context import get_endpoint
+from api.tokens import log_usage
+from api.tracing import annotate, traced
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
@@ -26,8 +32,110 @@ DEFAULT_PRESENCE_PENALTY = 0.0
 DEFAULT_N_PAST_MESSAGES = 10
 DEFAULT_SEED = None
 
-client = OpenAI(api_key = OPENAI_API_KEY)
+# Async HTTP pool: one per event loop, since pooled connections belong to the loop that opened them
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '500'))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', '100'))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '30'))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '120'))
+LLM_HTTP2 = os.getenv('LLM_HTTP2', 'true').lower() in ('1', 'true', 'yes')
+
+_client: Optional[OpenAI] = None
+_client_lock = threading.Lock()
+
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_client() -> OpenAI:
+    """Return the process-wide sync client, created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Retries are done by the scheduler, which also knows about our rate limits
+                _client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    return _client
+
+
+def create_async_client(**client_kwargs) -> AsyncOpenAI:
+    """Build an AsyncOpenAI client on a pooled keep-alive httpx client (HTTP/2 if h2 is installed)."""
+    http_client = httpx.AsyncClient(
+        http2=LLM_HTTP2 and _http2_available(),
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+    )
+    client_kwargs.setdefault('api_key', OPENAI_API_KEY)
+    client_kwargs.setdefault('max_retries', 0)
+    return AsyncOpenAI(http_client=http_client, **client_kwargs)
+
+
+def get_async_client() -> AsyncOpenAI:
+    """Return the async client for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        async_client = create_async_client()
+        _async_clients[loop] = async_client
+    return async_client
+
+
+def _completion_params(max_tokens, temperature, top_p, frequency_penalty, presence_penalty, seed,
+                       model=DEFAULT_MODEL, response_format=None):
+    params = dict(
+        model=model,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        frequency_penalty=frequency_penalty,
+        presence_penalty=presence_penalty,
+        seed=seed,
+    )
+    # Only sent when asked for, e.g. {"type": "json_object"} for JSON mode
+    if response_format is not None:
+        params['response_format'] = response_format
+    return params
+
+
+def _chunk_usage(chunk) -> Optional[CompletionUsage]:
+    """Usage sent with the last chunk of a stream opened with include_usage (a plain dict on older SDKs)."""
+    usage = getattr(chunk, 'usage', None)
+    if isinstance(usage, dict):
+        usage = CompletionUsage.model_validate(usage)
+    return usage
 
+
+def _log_usage(messages, params, content, usage, timings):
+    """Record the call's tokens and cost; returns (total_cost, total_tokens)."""
+    annotate(
+        queue_ms=round(timings.get('queue_seconds', 0.0) * 1000, 1),
+        provider_ms=round(timings.get('latency_seconds', 0.0) * 1000, 1),
+    )
+    if usage is not None:
+        annotate(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+    return log_usage(
+        messages,
+        content,
+        model=params['model'],
+        endpoint=get_endpoint(),
+        prompt_tokens=usage.prompt_tokens if usage is not None else None,
+        completion_tokens=usage.completion_tokens if usage is not None else None,
+        queue_seconds=timings.get('queue_seconds'),
+        latency_seconds=timings.get('latency_seconds'),
+    )
+
+
+@traced("llm_completion")
 def get_completion(
     messages: List[Dict[str, str]],
     max_tokens: Optional[int] = DEFAULT_MAX_TOKENS,
@@ -36,20 +144,185 @@ def get_completion(
     frequency_penalty: Optional[float] = DEFAULT_FREQUENCY_PENALTY,
     presence_penalty: Optional[float] = DEFAULT_PRESENCE_PENALTY,
     seed: Optional[int] = DEFAULT_SEED,
+    use_cache: bool = True,
+    model: str = DEFAULT_MODEL,
+    response_format: Optional[Dict[str, Any]] = None,
+    cacheable: Optional[Callable[[str], bool]] = None,
 ):
-    response = client.chat.completions.create(
-        model=DEFAULT_MODEL,
-        messages=messages,  # type: ignore
-        max_tokens=max_tokens,
-        temperature=temperature,
-        top_p=top_p,
-        frequency_penalty=frequency_penalty,
-        presence_penalty=presence_penalty,
-        seed=seed,
-        stream=False,
-    )
+    params = _completion_params(max_tokens, temperature, top_p, frequency_penalty, presence_penalty, seed,
+                                model, response_format)
+    cache = get_response_cache() if use_cache else None
+    annotate(model=params['model'])
+    if cache is not None:
+        cached = cache.get(messages, params)
+        if cached is not None:
+            count_llm_call(get_endpoint(), params['model'], 'cached')
+            annotate(cache_hit=True)
+            return cached
+
+    timings = {}
+    try:
+        response = get_scheduler().run(
+            lambda: get_client().chat.completions.create(
+                messages=messages,  # type: ignore
+                stream=False,
+                **params,
+            ),
+            messages,
+            params,
+            timings,
+        )
+    except Exception:
+        count_llm_call(get_endpoint(), params['model'], 'error')
+        raise
+    reply_content = response.choices[0].message.content
+    _log_usage(messages, params, reply_content or '', response.usage, timings)
+    if reply_content:
+        # Replies the caller is going to reject, e.g. JSON not matching its schema, are not cached
+        if cache is not None and (cacheable is None or cacheable(reply_content)):
+            cache.set(messages, params, response)
+        return response
+
+    raise ValueError("No reply content from API response!")
+
+
+@traced("llm_completion")
+async def aget_completion(
+    messages: List[Dict[str, str]],
+    max_tokens: Optional[int] = DEFAULT_MAX_TOKENS,
+    temperature: Optional[float] = DEFAULT_TEMPERATURE,
+    top_p: Optional[float] = DEFAULT_TOP_P,
+    frequency_penalty: Optional[float] = DEFAULT_FREQUENCY_PENALTY,
+    presence_penalty: Optional[float] = DEFAULT_PRESENCE_PENALTY,
+    seed: Optional[int] = DEFAULT_SEED,
+    use_cache: bool = True,
+    model: str = DEFAULT_MODEL,
+    response_format: Optional[Dict[str, Any]] = None,
+    cacheable: Optional[Callable[[str], bool]] = None,
+):
+    """Async counterpart of get_completion on the pooled per-loop client."""
+    params = _completion_params(max_tokens, temperature, top_p, frequency_penalty, presence_penalty, seed,
+                                model, response_format)
+    cache = get_response_cache() if use_cache else None
+    annotate(model=params['model'])
+    if cache is not None:
+        # Cache lookups may embed the prompt or hit a cache server
+        cached = await asyncio.to_thread(cache.get, messages, params)
+        if cached is not None:
+            count_llm_call(get_endpoint(), params['model'], 'cached')
+            annotate(cache_hit=True)
+            return cached
+
+    async_client = get_async_client()
+    timings = {}
+    try:
+        response = await get_scheduler().arun(
+            lambda: async_client.chat.completions.create(
+                messages=messages,  # type: ignore
+                stream=False,
+                **params,
+            ),
+            messages,
+            params,
+            timings,
+        )
+    except Exception:
+        count_llm_call(get_endpoint(), params['model'], 'error')
+        raise
     reply_content = response.choices[0].message.content
+    _log_usage(messages, params, reply_content or '', response.usage, timings)
     if reply_content:
+        # Replies the caller is going to reject, e.g. JSON not matching its schema, are not cached
+        if cache is not None and (cacheable is None or cacheable(reply_content)):
+            await asyncio.to_thread(cache.set, messages, params, response)
         return response
 
-    raise ValueError("No reply content from API response!")
\ No newline at end of file
+    raise ValueError("No reply content from API response!")
+
+
+@traced("llm_stream")
+async def astream_completion(
+    messages: List[Dict[str, str]],
+    max_tokens: Optional[int] = DEFAULT_MAX_TOKENS,
+    temperature: Optional[float] = DEFAULT_TEMPERATURE,
+    top_p: Optional[float] = DEFAULT_TOP_P,
+    frequency_penalty: Optional[float] = DEFAULT_FREQUENCY_PENALTY,
+    presence_penalty: Optional[float] = DEFAULT_PRESENCE_PENALTY,
+    seed: Optional[int] = DEFAULT_SEED,
+    use_cache: bool = True,
+    model: str = DEFAULT_MODEL,
+    response_format: Optional[Dict[str, Any]] = None,
+    cacheable: Optional[Callable[[str], bool]] = None,
+) -> AsyncIterator[str]:
+    """Yield the reply content piece by piece as the model generates it.
+
+    A cached reply is yielded in one piece; a completed stream is stored in
+    the response cache like a regular completion, subject to `cacheable`.
+    """
+    params = _completion_params(max_tokens, temperature, top_p, frequency_penalty, presence_penalty, seed,
+                                model, response_format)
+    cache = get_response_cache() if use_cache else None
+    annotate(model=params['model'])
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, messages, params)
+        if cached is not None:
+            count_llm_call(get_endpoint(), params['model'], 'cached')
+            annotate(cache_hit=True)
+            yield cached.choices[0].message.content
+            return
+
+    # Only opening the stream is retried; tokens already sent cannot be taken back
+    async_client = get_async_client()
+    timings = {}
+    parts = []
+    chunk = None
+    finish_reason = None
+    usage = None
+    scheduler = get_scheduler()
+    try:
+        stream = await scheduler.arun(
+            lambda: async_client.chat.completions.create(
+                messages=messages,  # type: ignore
+                stream=True,
+                # Passed through extra_body as the pinned SDK predates the stream_options argument
+                extra_body={'stream_options': {'include_usage': True}},
+                **params,
+            ),
+            messages,
+            params,
+            timings,
+        )
+        opened = time.perf_counter()
+        async for chunk in stream:
+            # The final chunk carries the usage and no choices
+            usage = _chunk_usage(chunk) or usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            if choice.delta.content:
+                parts.append(choice.delta.content)
+                yield choice.delta.content
+    except Exception:
+        count_llm_call(get_endpoint(), params['model'], 'error')
+        raise
+
+    # Tokens are counted locally if the provider sent no usage chunk
+    timings['latency_seconds'] += time.perf_counter() - opened
+    _, total_tokens = _log_usage(messages, params, ''.join(parts), usage, timings)
+    scheduler.settle(scheduler.estimate(messages, params), total_tokens)
+    if not parts:
+        raise ValueError("No reply content from API response!")
+    if cache is not None and (cacheable is None or cacheable(''.join(parts))):
+        response = ChatCompletion.model_validate({
+            "id": chunk.id,
+            "object": "chat.completion",
+            "created": chunk.created,
+            "model": chunk.model,
+            "choices": [{
+                "index": 0,
+                "finish_reason": finish_reason or "stop",
+                "message": {"role": "assistant", "content": "".join(parts)},
+            }],
+        })
+        await asyncio.to_thread(cache.set, messages, params, response)
@@ -0,0 +1,196 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from openai.types.chat import ChatCompletion
+
+from api.request_context import get_endpoint
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 2048
+KEY_PREFIX = "llm-completion:"
+
+
+def completion_key(messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+    """Hash of the messages and every request parameter that changes the completion."""
+    payload = json.dumps({"messages": messages, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class InProcessBackend:
+    """Per-worker store with TTL and least-recently-used eviction past `max_entries`."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict, ttl: int) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DjangoCacheBackend:
+    """Store entries in a configured Django cache, shared according to that cache's backend.
+
+    Size-based eviction is the cache's own (e.g. MAX_ENTRIES in its OPTIONS).
+    """
+
+    def __init__(self, alias: str = "default"):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.cache.get(KEY_PREFIX + key)
+
+    def set(self, key: str, value: Dict, ttl: int) -> None:
+        self.cache.set(KEY_PREFIX + key, value, timeout=ttl)
+
+
+class SemanticIndex:
+    """Normalised prompt embeddings pointing at exact-tier keys.
+
+    Entries are partitioned by the system messages and request parameters,
+    so only prompts that differ in their user turns can match each other.
+    """
+
+    def __init__(self, threshold: float, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._partitions: Dict[str, Tuple[np.ndarray, List[str]]] = {}
+
+    @staticmethod
+    def partition(messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        system = [m for m in messages if m.get("role") == "system"]
+        return completion_key(system, params)
+
+    @staticmethod
+    def prompt_text(messages: List[Dict[str, str]]) -> str:
+        return "\n".join(m["content"] for m in messages if m.get("role") != "system" and m.get("content"))
+
+    def embed(self, messages: List[Dict[str, str]]) -> np.ndarray:
+        from api.embeddings import get_embedding_service
+        vector = np.asarray(get_embedding_service().embed_query(self.prompt_text(messages)), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, partition: str, vector: np.ndarray) -> Optional[str]:
+        with self._lock:
+            entry = self._partitions.get(partition)
+            if entry is None:
+                return None
+            matrix, keys = entry
+            similarities = matrix @ vector
+        best = int(similarities.argmax())
+        return keys[best] if similarities[best] >= self.threshold else None
+
+    def add(self, partition: str, vector: np.ndarray, key: str) -> None:
+        with self._lock:
+            matrix, keys = self._partitions.get(partition, (np.empty((0, len(vector)), dtype=np.float32), []))
+            matrix = np.vstack([matrix, vector[None, :]])[-self.max_entries:]
+            keys = (keys + [key])[-self.max_entries:]
+            self._partitions[partition] = (matrix, keys)
+
+
+class ResponseCache:
+    """Two-tier cache for chat completions.
+
+    The exact tier is keyed by `completion_key`. The optional semantic tier
+    returns the cached answer of an earlier prompt whose embedding is within
+    `semantic_threshold` cosine similarity. Hits and misses are counted per
+    endpoint.
+    """
+
+    def __init__(self, backend, ttl: int = DEFAULT_TTL, semantic_threshold: Optional[float] = None):
+        self.backend = backend
+        self.ttl = ttl
+        self.semantic = SemanticIndex(semantic_threshold) if semantic_threshold is not None else None
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"exact_hits": 0, "semantic_hits": 0, "misses": 0})
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            self._counters[get_endpoint()][outcome] += 1
+
+    def get(self, messages: List[Dict[str, str]], params: Dict[str, Any]) -> Optional[ChatCompletion]:
+        key = completion_key(messages, params)
+        value = self.backend.get(key)
+        if value is not None:
+            self._count("exact_hits")
+            return ChatCompletion.model_validate(value)
+
+        if self.semantic is not None:
+            similar = self.semantic.lookup(SemanticIndex.partition(messages, params), self.semantic.embed(messages))
+            value = self.backend.get(similar) if similar else None
+            if value is not None:
+                self._count("semantic_hits")
+                return ChatCompletion.model_validate(value)
+
+        self._count("misses")
+        return None
+
+    def set(self, messages: List[Dict[str, str]], params: Dict[str, Any], response: ChatCompletion) -> None:
+        key = completion_key(messages, params)
+        self.backend.set(key, response.model_dump(), self.ttl)
+        if self.semantic is not None:
+            self.semantic.add(SemanticIndex.partition(messages, params), self.semantic.embed(messages), key)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            counters = {endpoint: dict(c) for endpoint, c in self._counters.items()}
+        for c in counters.values():
+            lookups = c["exact_hits"] + c["semantic_hits"] + c["misses"]
+            c["hit_rate"] = (c["exact_hits"] + c["semantic_hits"]) / lookups if lookups else 0.0
+        return counters
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the process-wide response cache, or None when LLM_CACHE_BACKEND is "off"."""
+    global _response_cache
+    backend_name = getattr(settings, "LLM_CACHE_BACKEND", "memory")
+    if backend_name == "off":
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                if backend_name == "django":
+                    backend = DjangoCacheBackend(getattr(settings, "LLM_CACHE_ALIAS", "default"))
+                elif backend_name == "memory":
+                    backend = InProcessBackend(getattr(settings, "LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+                else:
+                    raise ValueError(f"Unknown LLM_CACHE_BACKEND {backend_name!r}.")
+                _response_cache = ResponseCache(
+                    backend,
+                    ttl=getattr(settings, "LLM_CACHE_TTL", DEFAULT_TTL),
+                    semantic_threshold=getattr(settings, "LLM_SEMANTIC_CACHE_THRESHOLD", None),
+                )
+    return _response_cache
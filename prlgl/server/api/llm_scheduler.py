@@ -0,0 +1,312 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import openai
+from django.conf import settings
+
+from api.metrics import LLM_QUEUE_DEPTH, LLM_RETRIES
+from api.tokens import num_tokens_from_messages
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RPM_LIMIT = 500
+DEFAULT_TPM_LIMIT = 30000
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_MAX_DELAY = 30.0
+STATS_WINDOW = 1024
+
+# Failures worth another attempt: rate limits, timeouts, dropped connections and 5xx.
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+# Error codes that come with a retryable status but will not succeed on retry,
+# e.g. a 429 for an account out of credit.
+PERMANENT_ERROR_CODES = {"insufficient_quota"}
+
+
+class TokenBucket:
+    """Budget of `capacity` units refilled evenly over a minute.
+
+    `reserve` always debits, letting the balance go negative, and returns how
+    long the caller has to wait for the debt to be repaid. Callers therefore
+    queue in arrival order without holding the lock while they wait, and the
+    bucket can be shared by threads and event loops alike.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self._lock = threading.Lock()
+        self._level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        # A single request larger than the whole budget would never be admitted.
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self._level -= amount
+            return max(0.0, -self._level / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """Return (positive) or charge (negative) units once the real cost is known."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._level = min(self.capacity, self._level + amount)
+
+
+class SchedulerStats:
+    """Queue depth, admission wait and retry counters for the scheduler."""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self._lock = threading.Lock()
+        self._waits_ms = deque(maxlen=window)
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.admitted = 0
+        self.retries = 0
+        self.retries_by_error: Dict[str, int] = {}
+        self.failures = 0
+
+    def enqueue(self) -> None:
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        LLM_QUEUE_DEPTH.inc()
+
+    def admit(self, wait_ms: float) -> None:
+        with self._lock:
+            self.queue_depth -= 1
+            self.admitted += 1
+            self._waits_ms.append(wait_ms)
+        LLM_QUEUE_DEPTH.dec()
+
+    def abandon(self) -> None:
+        """Leave the queue without being admitted, e.g. when the caller is cancelled."""
+        with self._lock:
+            self.queue_depth -= 1
+        LLM_QUEUE_DEPTH.dec()
+
+    def retry(self, error: Exception) -> None:
+        with self._lock:
+            self.retries += 1
+            name = type(error).__name__
+            self.retries_by_error[name] = self.retries_by_error.get(name, 0) + 1
+        LLM_RETRIES.labels(name).inc()
+
+    def fail(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = np.asarray(self._waits_ms, dtype=np.float64)
+            stats = {
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "admitted": self.admitted,
+                "retries": self.retries,
+                "retries_by_error": dict(self.retries_by_error),
+                "failures": self.failures,
+            }
+        if len(waits):
+            stats.update(
+                wait_ms_mean=float(waits.mean()),
+                wait_ms_p95=float(np.percentile(waits, 95)),
+                wait_ms_max=float(waits.max()),
+            )
+        return stats
+
+
+def is_retryable(error: Exception) -> bool:
+    return isinstance(error, RETRYABLE_ERRORS) and getattr(error, "code", None) not in PERMANENT_ERROR_CODES
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait, from the Retry-After header if present."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LLMScheduler:
+    """Admission control and retries for every call to the chat completions API.
+
+    Each call reserves one request from the requests-per-minute bucket and its
+    estimated tokens (prompt plus `max_tokens`) from the tokens-per-minute
+    bucket, waiting if either is overdrawn. Once the response reports real
+    usage, the token estimate is corrected. Transient failures are retried
+    with full-jitter exponential backoff, honouring Retry-After.
+    A limit of 0 disables that bucket.
+    """
+
+    def __init__(
+        self,
+        rpm_limit: int = DEFAULT_RPM_LIMIT,
+        tpm_limit: int = DEFAULT_TPM_LIMIT,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        base_delay: float = DEFAULT_RETRY_BASE_DELAY,
+        max_delay: float = DEFAULT_RETRY_MAX_DELAY,
+    ):
+        self.requests = TokenBucket(rpm_limit) if rpm_limit else None
+        self.tokens = TokenBucket(tpm_limit) if tpm_limit else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = SchedulerStats()
+
+    def estimate(self, messages: List[Dict[str, str]], params: Dict[str, Any]) -> int:
+        return num_tokens_from_messages(messages, model=params["model"]) + (params.get("max_tokens") or 0)
+
+    def _reserve(self, cost: int) -> float:
+        delay = self.requests.reserve(1) if self.requests is not None else 0.0
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(cost))
+        return delay
+
+    def _refund(self, cost: int, request: bool = False) -> None:
+        """Give back the tokens of an attempt that failed, and its request if it was never sent."""
+        if self.tokens is not None:
+            self.tokens.adjust(min(cost, self.tokens.capacity))
+        if request and self.requests is not None:
+            self.requests.adjust(1)
+
+    def _settle(self, cost: int, response) -> None:
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.settle(cost, usage.total_tokens)
+
+    def settle(self, cost: int, total_tokens: int) -> None:
+        """Correct the estimated `cost` of an admitted call once its real token count is known.
+
+        Streamed calls report usage only at the end of the stream, so their
+        caller settles them.
+        """
+        if self.tokens is not None:
+            self.tokens.adjust(cost - total_tokens)
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        hinted = retry_after(error)
+        return max(delay, hinted) if hinted is not None else delay
+
+    def _should_retry(self, attempt: int, error: Exception) -> bool:
+        if attempt < self.max_retries and is_retryable(error):
+            self.stats.retry(error)
+            logger.warning("LLM call failed with %s, retry %d of %d.", type(error).__name__, attempt + 1, self.max_retries)
+            return True
+        self.stats.fail()
+        return False
+
+    def run(
+        self,
+        call: Callable[[], Any],
+        messages: List[Dict[str, str]],
+        params: Dict[str, Any],
+        timings: Optional[Dict[str, float]] = None,
+    ):
+        """Run the blocking `call` once admitted, retrying transient failures.
+
+        If given, `timings` receives "queue_seconds" (admission waits and
+        backoff) and "latency_seconds" (the successful attempt).
+        """
+        cost = self.estimate(messages, params)
+        call_started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            self.stats.enqueue()
+            started = time.perf_counter()
+            try:
+                time.sleep(self._reserve(cost))
+            except BaseException:
+                self.stats.abandon()
+                self._refund(cost, request=True)
+                raise
+            attempt_started = time.perf_counter()
+            self.stats.admit((attempt_started - started) * 1000)
+            try:
+                response = call()
+            except BaseException as e:
+                # Failed attempts use no tokens; each retry reserves its own
+                self._refund(cost)
+                if not (isinstance(e, Exception) and self._should_retry(attempt, e)):
+                    raise
+                time.sleep(self.backoff(attempt, e))
+                continue
+            self._settle(cost, response)
+            if timings is not None:
+                timings["queue_seconds"] = attempt_started - call_started
+                timings["latency_seconds"] = time.perf_counter() - attempt_started
+            return response
+
+    async def arun(
+        self,
+        call: Callable[[], Any],
+        messages: List[Dict[str, str]],
+        params: Dict[str, Any],
+        timings: Optional[Dict[str, float]] = None,
+    ):
+        """Async counterpart of `run`; `call` returns an awaitable."""
+        cost = self.estimate(messages, params)
+        call_started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            self.stats.enqueue()
+            started = time.perf_counter()
+            try:
+                await asyncio.sleep(self._reserve(cost))
+            except BaseException:
+                self.stats.abandon()
+                self._refund(cost, request=True)
+                raise
+            attempt_started = time.perf_counter()
+            self.stats.admit((attempt_started - started) * 1000)
+            try:
+                response = await call()
+            except BaseException as e:
+                # Failed attempts use no tokens; each retry reserves its own
+                self._refund(cost)
+                if not (isinstance(e, Exception) and self._should_retry(attempt, e)):
+                    raise
+                await asyncio.sleep(self.backoff(attempt, e))
+                continue
+            self._settle(cost, response)
+            if timings is not None:
+                timings["queue_seconds"] = attempt_started - call_started
+                timings["latency_seconds"] = time.perf_counter() - attempt_started
+            return response
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """Return the process-wide scheduler configured from settings."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler(
+                    rpm_limit=getattr(settings, "LLM_RPM_LIMIT", DEFAULT_RPM_LIMIT),
+                    tpm_limit=getattr(settings, "LLM_TPM_LIMIT", DEFAULT_TPM_LIMIT),
+                    max_retries=getattr(settings, "LLM_MAX_RETRIES", DEFAULT_MAX_RETRIES),
+                    base_delay=getattr(settings, "LLM_RETRY_BASE_DELAY", DEFAULT_RETRY_BASE_DELAY),
+                    max_delay=getattr(settings, "LLM_RETRY_MAX_DELAY", DEFAULT_RETRY_MAX_DELAY),
+                )
+    return _scheduler
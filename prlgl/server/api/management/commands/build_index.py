@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ingest import ingest_directory
+from api.knowledge_index import FAISS_INDEX_DIR, KNOWLEDGE_BASE_DIR
+
+
+class Command(BaseCommand):
+    help = "Incrementally (re)build the versioned FAISS index for a directory of documents and make it current."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default=KNOWLEDGE_BASE_DIR, help="Directory of PDF/text documents to index.")
+        parser.add_argument("--index-dir", default=FAISS_INDEX_DIR, help="Directory holding index versions.")
+        parser.add_argument("--force", action="store_true", help="Re-embed every document from scratch.")
+
+    def handle(self, *args, **options):
+        try:
+            report = ingest_directory(options["source"], options["index_dir"], force=options["force"])
+        except (FileNotFoundError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for label, sources in (
+            ("added", report.added_documents),
+            ("changed", report.changed_documents),
+            ("deleted", report.deleted_documents),
+        ):
+            for source in sources:
+                self.stdout.write(f"  {label}: {source}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Knowledge index {report.version} is current: {report.total_chunks} chunks, "
+            f"{report.embedded_chunks} embedded, {report.removed_chunks} removed, "
+            f"{report.unchanged_documents} documents unchanged."
+        ))
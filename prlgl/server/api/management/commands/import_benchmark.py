@@ -0,0 +1,81 @@
+import os
+import re
+import sys
+import json
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a worker imports before it can serve its first request.
+BOOT_SNIPPET = "import django; django.setup(); import {urlconf}"
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def parse_importtime(stderr: str):
+    """(module, self_us, cumulative_us, depth) for each line of `python -X importtime` output."""
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure cold-start import time of a worker in a fresh interpreter and report it per module. "
+        "Exits with an error when the total exceeds --max-ms."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=15, help="Number of slowest top-level imports to list.")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs to take the fastest of.")
+        parser.add_argument("--max-ms", type=float, default=None, help="Fail if total import time exceeds this.")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+
+    def run_once(self):
+        env = dict(os.environ)
+        # Measure the default boot path, without opt-in warm-up
+        env.update(WARMUP_EMBEDDINGS="false", PRELOAD_KNOWLEDGE_INDEX="false")
+        env.setdefault("DJANGO_SETTINGS_MODULE", os.environ.get("DJANGO_SETTINGS_MODULE", "server.settings"))
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", BOOT_SNIPPET.format(urlconf=settings.ROOT_URLCONF)],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Worker boot failed:\n{result.stderr[-2000:]}")
+        return parse_importtime(result.stderr)
+
+    def handle(self, *args, **options):
+        runs = [self.run_once() for _ in range(max(1, options["repeat"]))]
+        totals = [sum(cumulative for _, _, cumulative, depth in rows if depth == 0) for rows in runs]
+        rows = runs[totals.index(min(totals))]
+
+        top_level = sorted((r for r in rows if r[3] == 0), key=lambda r: r[2], reverse=True)
+        api_modules = sorted((r for r in rows if r[0].split(".")[0] == "api"), key=lambda r: r[2], reverse=True)
+        report = {
+            "total_ms": min(totals) / 1000,
+            "runs_ms": [t / 1000 for t in totals],
+            "top_level": [{"module": m, "cumulative_ms": c / 1000} for m, _, c, _ in top_level[:options["top"]]],
+            "api": [{"module": m, "cumulative_ms": c / 1000, "self_ms": s / 1000} for m, s, c, _ in api_modules],
+        }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(f"Worker import time: {report['total_ms']:.0f} ms (best of {len(totals)})")
+            self.stdout.write("Slowest top-level imports:")
+            for entry in report["top_level"]:
+                self.stdout.write(f"  {entry['cumulative_ms']:8.1f} ms  {entry['module']}")
+            self.stdout.write("api modules:")
+            for entry in report["api"]:
+                self.stdout.write(f"  {entry['cumulative_ms']:8.1f} ms  {entry['module']}")
+
+        if options["max_ms"] is not None and report["total_ms"] > options["max_ms"]:
+            raise CommandError(f"Import time {report['total_ms']:.0f} ms exceeds the {options['max_ms']:.0f} ms budget.")
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import tempfile
+import subprocess
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+DJANGO_SERVER_COMMAND = "{python} manage.py runserver 127.0.0.1:{port} --noreload"
+FASTAPI_SERVER_COMMAND = "{python} -m uvicorn api:app --host 127.0.0.1 --port {port}"
+READY_TIMEOUT = 120.0
+
+
+def dict_error_body(i: int) -> Dict:
+    return {
+        "clause": f"The Tenant shall pay a late fee of {i % 50 + 1}% per day on any overdue rent, without limit.",
+        "error": "unreasonable penalty",
+        "rule": "Penalty clauses must be a genuine pre-estimate of loss.",
+    }
+
+
+def find_institution_body(i: int) -> Dict:
+    # Mentions arbitration without a known institution, so the LLM is asked
+    return {"text": f"Any dispute arising under this agreement (ref. {i}) shall be settled by arbitration in Geneva."}
+
+
+def chatbot_body(i: int) -> Dict:
+    return {"question": f"What does an indemnity clause cover, in question {i}?"}
+
+
+def generate_contract_body(i: int) -> Dict:
+    return {
+        "landlord_name": "Alice Example",
+        "tenant_name": f"Tenant {i}",
+        "property_address": "1 Example Street",
+        "rent_amount": "1000",
+        "security_deposit": "2000",
+        "lease_term": "12 months",
+        "start_date": "2025-01-01",
+    }
+
+
+# name -> (server, path, request body for the i-th request)
+SCENARIOS: Dict[str, tuple] = {
+    "dict-error": ("django", "/dict-error/", dict_error_body),
+    "find-institution": ("django", "/find-institution/", find_institution_body),
+    "chatbot-api": ("django", "/chatbot-api/", chatbot_body),
+    "generate-contract": ("fastapi", "/api/generate-contract", generate_contract_body),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """High-water resident set size of a running process, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def latency_summary(latencies: List[float], statuses: List[int], wall_seconds: float) -> Dict:
+    ok = [latency for latency, status in zip(latencies, statuses) if 200 <= status < 300]
+    counts: Dict[str, int] = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    summary = {
+        "requests": len(statuses),
+        "ok": len(ok),
+        "status_counts": counts,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(ok) / wall_seconds, 3) if wall_seconds else 0.0,
+    }
+    if ok:
+        p50, p95, p99 = np.percentile(np.array(ok) * 1000, [50, 95, 99])
+        summary.update(p50_ms=round(p50, 1), p95_ms=round(p95, 1), p99_ms=round(p99, 1),
+                       mean_ms=round(float(np.mean(ok)) * 1000, 1))
+    return summary
+
+
+async def drive(url: str, body: Callable[[int], Dict], n_requests: int, concurrency: int, timeout: float) -> Dict:
+    """Send `n_requests` POSTs with `concurrency` in flight and summarise their latencies."""
+    latencies: List[float] = []
+    statuses: List[int] = []
+    next_index = iter(range(n_requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def worker():
+            for i in next_index:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json=body(i))
+                    status = response.status_code
+                except httpx.HTTPError:
+                    status = 0  # Connection error or timeout
+                latencies.append(time.perf_counter() - started)
+                statuses.append(status)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall_seconds = time.perf_counter() - started
+    return latency_summary(latencies, statuses, wall_seconds)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the API offline: start a fake OpenAI server, start the Django (and optionally FastAPI) "
+        "server pointed at it, drive endpoints at fixed concurrency levels and report p50/p95/p99 "
+        "latency, throughput and peak RSS as JSON. dict-error/ needs a built knowledge index."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=None,
+                            help="Endpoints to drive; default all Django ones, plus generate-contract with --fastapi-dir.")
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+        parser.add_argument("--requests", type=int, default=100, help="Requests per scenario and concurrency level.")
+        parser.add_argument("--warmup", type=int, default=3, help="Unmeasured requests per scenario first.")
+        parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds.")
+        parser.add_argument("--latency-ms", type=float, default=300.0, help="Fake LLM time to first token.")
+        parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Fake LLM generation speed.")
+        parser.add_argument("--completion-tokens", type=int, default=150, help="Fake LLM plain-text reply length.")
+        parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of fake LLM calls answered 429.")
+        parser.add_argument("--server-command", default=DJANGO_SERVER_COMMAND,
+                            help="Django server to start, with {python} and {port} placeholders.")
+        parser.add_argument("--fastapi-dir", default=None, help="Directory of the FastAPI app (main/server) to start.")
+        parser.add_argument("--fastapi-command", default=FASTAPI_SERVER_COMMAND)
+        parser.add_argument("--output", default=None, help="Write the JSON report to this file.")
+
+    def start(self, command: str, cwd: str, env: Dict[str, str], ready_url: str, name: str) -> subprocess.Popen:
+        """Start a server and wait until `ready_url` answers; its output goes to a temporary log."""
+        log = tempfile.TemporaryFile()
+        process = subprocess.Popen(command.replace("{python}", sys.executable).split(),
+                                   cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                log.seek(0)
+                raise CommandError(f"{name} exited during start-up:\n{log.read().decode(errors='replace')[-2000:]}")
+            try:
+                if httpx.get(ready_url, timeout=1.0).status_code < 500:
+                    return process
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        process.kill()
+        raise CommandError(f"{name} did not answer {ready_url} within {READY_TIMEOUT:.0f}s.")
+
+    def handle(self, *args, **options):
+        scenarios = options["scenarios"] or [
+            name for name, (server, _, _) in SCENARIOS.items() if server == "django" or options["fastapi_dir"]
+        ]
+        if any(SCENARIOS[name][0] == "fastapi" for name in scenarios) and not options["fastapi_dir"]:
+            raise CommandError("generate-contract needs --fastapi-dir.")
+
+        fake_port, django_port, fastapi_port = free_port(), free_port(), free_port()
+        env = dict(os.environ)
+        env.update(
+            OPENAI_BASE_URL=f"http://127.0.0.1:{fake_port}/v1",
+            # Never reach the real API from a load test
+            OPENAI_API_KEY="load-test",
+            # Every request should reach the fake LLM
+            LLM_CACHE_BACKEND="off",
+            PYTHONUNBUFFERED="1",
+        )
+        env.setdefault("DJANGO_SECRET_KEY", "load-test")
+
+        processes: Dict[str, subprocess.Popen] = {}
+        try:
+            processes["fake_openai"] = self.start(
+                f"{{python}} -m api.fake_openai --port {fake_port} --latency-ms {options['latency_ms']} "
+                f"--tokens-per-second {options['tokens_per_second']} --completion-tokens {options['completion_tokens']} "
+                f"--rate-limit-rate {options['rate_limit_rate']} --seed 0",
+                settings.BASE_DIR, env, f"http://127.0.0.1:{fake_port}/stats", "Fake OpenAI server",
+            )
+            bases = {"django": f"http://127.0.0.1:{django_port}"}
+            if any(SCENARIOS[name][0] == "django" for name in scenarios):
+                processes["django"] = self.start(
+                    options["server_command"].replace("{port}", str(django_port)), settings.BASE_DIR, env,
+                    f"{bases['django']}/metrics/", "Django server",
+                )
+            if options["fastapi_dir"]:
+                bases["fastapi"] = f"http://127.0.0.1:{fastapi_port}"
+                processes["fastapi"] = self.start(
+                    options["fastapi_command"].replace("{port}", str(fastapi_port)), options["fastapi_dir"], env,
+                    f"{bases['fastapi']}/metrics", "FastAPI server",
+                )
+
+            results: Dict[str, Dict] = {}
+            for name in scenarios:
+                server, path, body = SCENARIOS[name]
+                url = bases[server] + path
+                if options["warmup"]:
+                    asyncio.run(drive(url, body, options["warmup"], 1, options["timeout"]))
+                results[name] = {}
+                for concurrency in options["concurrency"]:
+                    summary = asyncio.run(drive(url, body, options["requests"], concurrency, options["timeout"]))
+                    results[name][f"c{concurrency}"] = summary
+                    self.stderr.write(
+                        f"{name:18} c={concurrency:<4} {summary['throughput_rps']:8.2f} req/s  "
+                        f"p50 {summary.get('p50_ms', '-')} ms  p99 {summary.get('p99_ms', '-')} ms  "
+                        f"statuses {summary['status_counts']}"
+                    )
+
+            report = {
+                "commit": self.commit(),
+                "config": {key: options[key] for key in (
+                    "concurrency", "requests", "latency_ms", "tokens_per_second", "completion_tokens", "rate_limit_rate",
+                )},
+                "scenarios": results,
+                "peak_rss_mb": {name: peak_rss_mb(p.pid) for name, p in processes.items() if name != "fake_openai"},
+                "fake_llm": httpx.get(f"http://127.0.0.1:{fake_port}/stats").json(),
+            }
+        finally:
+            for process in processes.values():
+                process.terminate()
+            for process in processes.values():
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        self.stdout.write(output)
+
+    def commit(self) -> Optional[str]:
+        try:
+            return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import tempfile
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from api.knowledge_index import FAISS_INDEX_DIR, current_version
+from api.quantization import VECTORS_FILE, QuantizedIndex, binarize, save_quantized
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray, k: int) -> float:
+    """Mean fraction of the exact top-k present in the approximate top-k."""
+    hits = [len(set(f[:k]) & set(t[:k])) for f, t in zip(found, truth)]
+    return round(float(np.mean(hits)) / k, 4)
+
+
+def synthetic_vectors(n: int, d: int, rng: np.random.Generator) -> np.ndarray:
+    """Unit vectors in loose clusters, which resembles sentence embeddings of related documents."""
+    centres = rng.standard_normal((max(1, n // 50), d)).astype(np.float32)
+    vectors = centres[rng.integers(0, len(centres), n)] + 0.6 * rng.standard_normal((n, d)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare memory use, recall@k against exact float32 search and query latency of the "
+        "int8 and binary dense indexes, on the current knowledge index or on synthetic vectors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--index-dir", default=FAISS_INDEX_DIR, help="Directory holding index versions.")
+        parser.add_argument("--synthetic", type=int, default=None, help="Benchmark N random vectors instead.")
+        parser.add_argument("--dim", type=int, default=384, help="Dimension of synthetic vectors.")
+        parser.add_argument("--queries", type=int, default=200, help="Number of queries.")
+        parser.add_argument("--k", type=int, nargs="+", default=[5, 20], help="Cut-offs for recall@k.")
+        parser.add_argument("--rescore-factor", type=int, nargs="+", default=[1, 4, 10])
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+
+    def load_vectors(self, options, rng):
+        if options["synthetic"]:
+            return synthetic_vectors(options["synthetic"], options["dim"], rng), "synthetic"
+        version = current_version(options["index_dir"])
+        if version is None:
+            raise CommandError("No knowledge index built; run build_index or pass --synthetic N.")
+        path = os.path.join(options["index_dir"], version, VECTORS_FILE)
+        if not os.path.exists(path):
+            raise CommandError(f"Version {version} has no {VECTORS_FILE}; rebuild it with build_index --force.")
+        return np.load(path), version
+
+    def handle(self, *args, **options):
+        import faiss
+
+        rng = np.random.default_rng(options["seed"])
+        vectors, source = self.load_vectors(options, rng)
+        n, d = vectors.shape
+        k_max = min(max(options["k"]), n)
+
+        # Queries near stored chunks, as a clause is near the passages that discuss it
+        queries = vectors[rng.integers(0, n, options["queries"])]
+        queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32) / np.sqrt(d)
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+
+        float_index = faiss.IndexFlatL2(d)
+        float_index.add(vectors)
+        started = time.perf_counter()
+        _, truth = float_index.search(queries, k_max)
+        float_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+        report = {
+            "source": source,
+            "vectors": n,
+            "dim": d,
+            "queries": len(queries),
+            "float32": {"bytes": n * d * 4, "latency_ms": float_ms},
+        }
+        with tempfile.TemporaryDirectory() as folder:
+            save_quantized(float_index, folder)
+            for mode in ("int8", "binary"):
+                index = QuantizedIndex.load(folder, mode)
+                if index is None:
+                    continue
+                compact_queries = binarize(queries) if mode == "binary" else queries
+                _, compact_only = index.compact.search(compact_queries, k_max)
+                results = {
+                    "bytes": index.compact_bytes,
+                    "compression": n * d * 4 / index.compact_bytes,
+                    "recall_without_rescoring": {f"@{k}": recall_at_k(compact_only, truth, k) for k in options["k"]},
+                    "rescored": {},
+                }
+                for factor in options["rescore_factor"]:
+                    index.rescore_factor = factor
+                    started = time.perf_counter()
+                    _, found = index.search(queries, k_max)
+                    results["rescored"][f"x{factor}"] = {
+                        "latency_ms": (time.perf_counter() - started) * 1000 / len(queries),
+                        "recall": {f"@{k}": recall_at_k(found, truth, k) for k in options["k"]},
+                    }
+                report[mode] = results
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{n} vectors of dimension {d} ({source}), {len(queries)} queries")
+        self.stdout.write(f"  float32  {report['float32']['bytes'] / 2**20:8.2f} MiB  {float_ms:.3f} ms/query")
+        for mode in ("int8", "binary"):
+            if mode not in report:
+                continue
+            results = report[mode]
+            self.stdout.write(
+                f"  {mode:7}  {results['bytes'] / 2**20:8.2f} MiB  ({results['compression']:.0f}x smaller)  "
+                f"recall without re-scoring {results['recall_without_rescoring']}"
+            )
+            for factor, rescored in results["rescored"].items():
+                self.stdout.write(f"    re-score {factor:4} {rescored['latency_ms']:.3f} ms/query  recall {rescored['recall']}")
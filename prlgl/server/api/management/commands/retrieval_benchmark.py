@@ -0,0 +1,366 @@
+import os
+import json
+import math
+import time
+import itertools
+import tempfile
+from typing import Dict, List, Tuple
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from api.knowledge_index import CHUNK_OVERLAP, CHUNK_SIZE, get_embeddings
+from api.tokens import num_tokens_from_strings
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "int8", "hybrid")
+# splitter -> (default chunk sizes, default overlaps); "clause" counts tokens, "recursive" characters
+SPLITTERS = {
+    "clause": ([96, CHUNK_SIZE, 240], [CHUNK_OVERLAP]),
+    "recursive": ([256, 512, 1024], [128]),
+}
+
+PREFIXES = ["Ash", "Bel", "Cor", "Dun", "El", "Fen", "Gar", "Hal", "Ist", "Jor", "Kel", "Lan",
+            "Mar", "Nor", "Or", "Pel", "Quin", "Ros", "Sel", "Tor", "Ul", "Var", "Wen", "Yar"]
+ROOTS = ["bridge", "ford", "mere", "wick", "dale", "holt", "stead", "worth", "field", "gate", "moor", "crest",
+         "haven", "ridge", "brook", "wood", "vale", "mont", "port", "ton", "by", "ley", "combe", "shaw"]
+SUFFIXES = ["Holdings", "Logistics", "Systems", "Partners", "Industries", "Capital"]
+
+# topic -> (clause, question asking for it in other words); {party} and {n} are filled in
+TOPICS: Dict[str, Tuple[str, str]] = {
+    "Confidentiality": (
+        "{party} shall keep all Confidential Information strictly confidential and shall not disclose it to any "
+        "third party for a period of {n} years following termination of this Agreement.",
+        "How long must {party} keep information secret after the contract ends?",
+    ),
+    "Limitation of Liability": (
+        "The aggregate liability of {party} arising under or in connection with this Agreement shall not exceed "
+        "{n} per cent of the Fees paid in the twelve months preceding the claim.",
+        "What is the most {party} can be held liable for?",
+    ),
+    "Termination": (
+        "{party} may terminate this Agreement for convenience by giving the other party not less than {n} days' "
+        "prior written notice.",
+        "How much notice does {party} need to give to end the agreement early?",
+    ),
+    "Payment": (
+        "{party} shall pay each undisputed invoice within {n} days of receipt, failing which interest shall accrue "
+        "on the overdue amount at the statutory rate.",
+        "When are invoices owed by {party} due?",
+    ),
+    "Indemnity": (
+        "{party} shall indemnify and hold harmless the other party against all losses, costs and expenses arising "
+        "from any breach of its data protection obligations, up to {n} million euros.",
+        "Does {party} have to compensate for breaches of data protection law?",
+    ),
+    "Force Majeure": (
+        "{party} shall not be liable for any failure to perform caused by events beyond its reasonable control, "
+        "provided that it notifies the other party within {n} days of the event.",
+        "Is {party} excused when something outside its control prevents performance?",
+    ),
+    "Non-Competition": (
+        "During the term and for {n} months thereafter, {party} shall not engage in any business that competes "
+        "with the Services within the Territory.",
+        "Is {party} restricted from working for competitors?",
+    ),
+    "Intellectual Property": (
+        "All Intellectual Property Rights in the Deliverables created by {party} shall vest in the Customer upon "
+        "payment, and {party} waives all moral rights to the extent permitted by law within {n} days.",
+        "Who owns the work product that {party} creates?",
+    ),
+    "Audit": (
+        "{party} shall keep complete and accurate records and permit the other party to audit them on {n} "
+        "business days' notice, no more than once in any calendar year.",
+        "Can the records of {party} be inspected?",
+    ),
+    "Insurance": (
+        "{party} shall maintain professional indemnity insurance with a reputable insurer for not less than "
+        "{n} million euros per claim throughout the term.",
+        "What insurance cover does {party} have to hold?",
+    ),
+    "Assignment": (
+        "{party} shall not assign, novate or subcontract any of its rights or obligations under this Agreement "
+        "without prior written consent, which shall be given or refused within {n} days.",
+        "Can {party} transfer the contract to someone else?",
+    ),
+    "Dispute Resolution": (
+        "Any dispute involving {party} shall first be referred to senior management and, if unresolved within "
+        "{n} days, finally settled by arbitration seated in Geneva.",
+        "How are disputes with {party} resolved?",
+    ),
+}
+GENERIC_PARTIES = ["the Supplier", "the Customer", "each party", "the Contractor", "the Licensee"]
+CLAUSES_PER_PAGE = 7
+
+
+def party_names(n: int, rng: np.random.Generator) -> List[str]:
+    """`n` distinct made-up company names, so each needle clause is identifiable."""
+    names = [f"{p}{r} {s}" for p, r, s in itertools.product(PREFIXES, ROOTS, SUFFIXES)]
+    if n > len(names):
+        raise CommandError(f"At most {len(names)} pages are supported.")
+    return [names[i] for i in rng.permutation(len(names))[:n]]
+
+
+def write_contract_pdf(path: str, n_pages: int, rng: np.random.Generator) -> List[Tuple[str, str]]:
+    """Write a synthetic contract of `n_pages` pages and return its (question, party) needles.
+
+    Every page is one article of numbered clauses about assorted topics.
+    One clause per page names a unique party; the matching question asks
+    about it in other words, and only chunks containing that party's name
+    count as relevant.
+    """
+    import fitz
+
+    topics = list(TOPICS)
+    parties = party_names(n_pages, rng)
+    needles = []
+    doc = fitz.open()
+    for page_no, party in enumerate(parties, start=1):
+        needle_at = int(rng.integers(CLAUSES_PER_PAGE))
+        title = topics[int(rng.integers(len(topics)))]
+        lines = [f"Article {page_no}. {title}", ""]
+        for clause_no in range(CLAUSES_PER_PAGE):
+            topic = topics[int(rng.integers(len(topics)))]
+            clause, question = TOPICS[topic]
+            if clause_no == needle_at:
+                name = party
+                needles.append((question.format(party=party), party))
+            else:
+                name = GENERIC_PARTIES[int(rng.integers(len(GENERIC_PARTIES)))]
+            text = clause.format(party=name, n=int(rng.integers(2, 90)))
+            lines.append(f"{page_no}.{clause_no + 1} {text[0].upper()}{text[1:]}")
+        page = doc.new_page()
+        if page.insert_textbox(fitz.Rect(56, 56, page.rect.width - 56, page.rect.height - 56),
+                               "\n".join(lines), fontsize=10, fontname="helv") < 0:
+            raise CommandError(f"Page {page_no} text does not fit on the page.")
+    doc.save(path, deflate=True)
+    doc.close()
+    return needles
+
+
+def recall_at_k(rankings: List[List[str]], parties: List[str], k: int) -> float:
+    """Share of questions with a chunk naming the right party among the first k results."""
+    hits = [any(party in " ".join(text.split()) for text in ranking[:k]) for ranking, party in zip(rankings, parties)]
+    return round(float(np.mean(hits)), 4) if hits else 0.0
+
+
+def per_second(count: int, seconds: float) -> float:
+    return round(count / seconds, 1) if seconds else float("inf")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the retrieval pipeline stage by stage on synthetic contract PDFs: page loading, "
+        "chunking, embedding, index build and search, with recall@k, for several chunk sizes and index types."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000], help="Synthetic PDF sizes.")
+        parser.add_argument(
+            "--splitter", choices=SPLITTERS, default="clause",
+            help="clause: api.chunking, sized in tokens; recursive: LangChain's character splitter.",
+        )
+        parser.add_argument("--chunk-sizes", type=int, nargs="+", default=None, help="Defaults depend on --splitter.")
+        parser.add_argument("--chunk-overlaps", type=int, nargs="+", default=None)
+        parser.add_argument("--index-types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+        parser.add_argument("--queries", type=int, default=100, help="Questions per document.")
+        parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10], help="Cut-offs for recall@k.")
+        parser.add_argument("--hnsw-m", type=int, default=32)
+        parser.add_argument("--hnsw-ef-search", type=int, default=64)
+        parser.add_argument("--ivf-nprobe", type=int, default=8)
+        parser.add_argument("--pdf-dir", default=None, help="Keep the generated PDFs here instead of a temporary directory.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+        parser.add_argument("--output", default=None, help="Also write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        # Imported lazily by the pipeline; pay for it here, not in the first timing
+        from langchain.text_splitter import RecursiveCharacterTextSplitter  # noqa: F401
+        from api.tokens import get_encoding
+        get_encoding()
+        from sklearn.feature_extraction.text import TfidfVectorizer  # noqa: F401
+
+        embeddings = get_embeddings()
+        # Measure encoding, not the query embedding cache
+        embeddings.cache = None
+        default_sizes, default_overlaps = SPLITTERS[options["splitter"]]
+        configs = [
+            (size, overlap)
+            for size in options["chunk_sizes"] or default_sizes
+            for overlap in options["chunk_overlaps"] or default_overlaps
+            if overlap < size
+        ]
+        if not configs:
+            raise CommandError("Every chunk overlap is at least the chunk size.")
+
+        report = {
+            "embedding_model": embeddings.model_name,
+            "current": {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP},
+            "splitter": options["splitter"],
+            "documents": [],
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_dir = options["pdf_dir"] or tmp
+            os.makedirs(pdf_dir, exist_ok=True)
+            for n_pages in options["pages"]:
+                rng = np.random.default_rng(options["seed"])
+                path = os.path.join(pdf_dir, f"contract-{n_pages}.pdf")
+                needles = write_contract_pdf(path, n_pages, rng)
+                picked = rng.choice(len(needles), min(options["queries"], len(needles)), replace=False)
+                questions, parties = zip(*(needles[i] for i in picked))
+                report["documents"].append(self.run_document(path, n_pages, list(questions), list(parties), configs, options))
+                self.print_document(report["documents"][-1], options)
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        if options["json"]:
+            self.stdout.write(output)
+
+    def run_document(self, path, n_pages, questions, parties, configs, options) -> Dict:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from langchain_community.document_loaders import PyMuPDFLoader
+        from api.chunking import ClauseSplitter
+
+        embeddings = get_embeddings()
+        started = time.perf_counter()
+        pages = PyMuPDFLoader(path).load()
+        load_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        query_vectors = np.asarray(embeddings.embed_documents(questions), dtype=np.float32)
+        query_seconds = time.perf_counter() - started
+
+        result = {
+            "pages": n_pages,
+            "pdf_bytes": os.path.getsize(path),
+            "queries": len(questions),
+            "load": {"seconds": round(load_seconds, 4), "pages_per_second": per_second(len(pages), load_seconds)},
+            "query_embedding": {"seconds": round(query_seconds, 4), "queries_per_second": per_second(len(questions), query_seconds)},
+            "chunking": [],
+        }
+        for chunk_size, chunk_overlap in configs:
+            if options["splitter"] == "clause":
+                splitter = ClauseSplitter(chunk_size, chunk_overlap)
+            else:
+                splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+            started = time.perf_counter()
+            chunks = splitter.split_documents(pages)
+            split_seconds = time.perf_counter() - started
+            texts = [chunk.page_content for chunk in chunks]
+            tokens = num_tokens_from_strings(texts)
+
+            started = time.perf_counter()
+            vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+            embed_seconds = time.perf_counter() - started
+
+            config = {
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "chunks": len(chunks),
+                "tokens_per_chunk": {"mean": round(float(np.mean(tokens)), 1), "max": max(tokens)} if tokens else {},
+                "split": {"seconds": round(split_seconds, 4), "chunks_per_second": per_second(len(chunks), split_seconds)},
+                "embed": {"seconds": round(embed_seconds, 4), "embeddings_per_second": per_second(len(chunks), embed_seconds)},
+                "indexes": {},
+            }
+            for index_type in options["index_types"]:
+                config["indexes"][index_type] = self.run_index(
+                    index_type, chunks, vectors, questions, query_vectors, parties, options
+                )
+            result["chunking"].append(config)
+        return result
+
+    def run_index(self, index_type, chunks, vectors, questions, query_vectors, parties, options) -> Dict:
+        import faiss
+
+        if index_type == "hybrid":
+            return self.run_hybrid(chunks, vectors, questions, parties, options)
+        k_max = max(options["k"])
+        texts = [chunk.page_content for chunk in chunks]
+
+        started = time.perf_counter()
+        index = self.build_index(index_type, vectors, options)
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        _, positions = index.search(query_vectors, min(k_max, len(texts)))
+        search_seconds = time.perf_counter() - started
+        rankings = [[texts[j] for j in row if j != -1] for row in positions]
+        return {
+            "build_seconds": round(build_seconds, 4),
+            "bytes": len(faiss.serialize_index(index)),
+            "queries_per_second": per_second(len(questions), search_seconds),
+            "recall": {f"@{k}": recall_at_k(rankings, parties, k) for k in options["k"]},
+        }
+
+    def build_index(self, index_type: str, vectors: np.ndarray, options):
+        import faiss
+
+        n, d = vectors.shape
+        if index_type == "flat":
+            # What FAISS.from_documents builds for an uploaded document
+            index = faiss.IndexFlatL2(d)
+        elif index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(d, options["hnsw_m"])
+            index.hnsw.efSearch = options["hnsw_ef_search"]
+        elif index_type == "ivf":
+            # ~4 sqrt(n) lists, but at least 39 training points per list as FAISS asks
+            n_lists = max(1, min(int(4 * math.sqrt(n)), n // 39))
+            index = faiss.IndexIVFFlat(faiss.IndexFlatL2(d), d, n_lists)
+            index.nprobe = min(options["ivf_nprobe"], n_lists)
+        else:
+            index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(vectors)
+        return index
+
+    def run_hybrid(self, chunks, vectors, questions, parties, options) -> Dict:
+        """The retriever PDF_base uses: flat dense search fused with TF-IDF, queries embedded per search."""
+        import faiss
+        from langchain_community.vectorstores.faiss import FAISS
+        from api.retrieval import HybridRetriever, SparseIndex
+
+        texts = [chunk.page_content for chunk in chunks]
+        started = time.perf_counter()
+        vector_store = FAISS.from_embeddings(
+            list(zip(texts, vectors.tolist())), get_embeddings(), metadatas=[chunk.metadata for chunk in chunks]
+        )
+        sparse_index = SparseIndex.from_vector_store(vector_store)
+        retriever = HybridRetriever(vector_store, sparse_index)
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = retriever.search_batch(questions, k=max(options["k"]))
+        search_seconds = time.perf_counter() - started
+        rankings = [[doc.page_content for doc, _ in docs_and_scores] for docs_and_scores in results]
+        matrix = sparse_index.matrix
+        return {
+            "build_seconds": round(build_seconds, 4),
+            "bytes": len(faiss.serialize_index(vector_store.index)) + matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes,
+            # Includes embedding the questions, unlike the dense-only index types
+            "queries_per_second": per_second(len(questions), search_seconds),
+            "recall": {f"@{k}": recall_at_k(rankings, parties, k) for k in options["k"]},
+        }
+
+    def print_document(self, result: Dict, options) -> None:
+        if options["json"]:
+            return
+        self.stdout.write(
+            f"{result['pages']} pages ({result['pdf_bytes'] / 2**20:.2f} MiB), {result['queries']} questions: "
+            f"load {result['load']['pages_per_second']} pages/s, "
+            f"question embedding {result['query_embedding']['queries_per_second']} queries/s"
+        )
+        for config in result["chunking"]:
+            self.stdout.write(
+                f"  chunk {config['chunk_size']}/{config['chunk_overlap']}: {config['chunks']} chunks "
+                f"(tokens mean {config['tokens_per_chunk'].get('mean')}, max {config['tokens_per_chunk'].get('max')}), "
+                f"split {config['split']['chunks_per_second']} chunks/s, "
+                f"embed {config['embed']['embeddings_per_second']} embeddings/s"
+            )
+            for index_type, stats in config["indexes"].items():
+                recall = "  ".join(f"R{k} {value:.2f}" for k, value in stats["recall"].items())
+                self.stdout.write(
+                    f"    {index_type:7} build {stats['build_seconds'] * 1000:9.1f} ms  {stats['bytes'] / 2**20:8.2f} MiB  "
+                    f"{stats['queries_per_second']:10.1f} queries/s  {recall}"
+                )
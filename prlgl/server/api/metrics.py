@@ -0,0 +1,89 @@
+import os
+from typing import Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+LLM_LABELS = ("endpoint", "model")
+
+LLM_CALLS = Counter(
+    "llm_calls_total", "Chat completion calls by outcome (ok, error, cached).", LLM_LABELS + ("outcome",)
+)
+LLM_PROMPT_TOKENS = Counter("llm_prompt_tokens_total", "Prompt tokens sent.", LLM_LABELS)
+LLM_COMPLETION_TOKENS = Counter("llm_completion_tokens_total", "Completion tokens received.", LLM_LABELS)
+LLM_COST = Counter("llm_cost_usd_total", "Estimated spend in USD.", LLM_LABELS)
+LLM_PROMPT_SIZE = Histogram("llm_prompt_size_tokens", "Prompt tokens per call.", LLM_LABELS, buckets=TOKEN_BUCKETS)
+LLM_QUEUE_TIME = Histogram(
+    "llm_queue_seconds", "Time waiting for rate-limit admission and retry backoff.", LLM_LABELS,
+    buckets=LATENCY_BUCKETS,
+)
+LLM_LATENCY = Histogram(
+    "llm_provider_latency_seconds", "Provider time for the successful attempt.", LLM_LABELS,
+    buckets=LATENCY_BUCKETS,
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_scheduler_queue_depth", "Calls waiting for rate-limit admission.", multiprocess_mode="livesum"
+)
+LLM_RETRIES = Counter("llm_retries_total", "Retried chat completion attempts.", ("error",))
+LLM_STRUCTURED_OUTPUTS = Counter(
+    "llm_structured_outputs_total", "Structured replies by schema and outcome (valid, repaired, invalid).",
+    ("endpoint", "schema", "outcome"),
+)
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to produce a response, per endpoint.", ("endpoint", "method", "status"),
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def count_llm_call(endpoint: str, model: str, outcome: str) -> None:
+    LLM_CALLS.labels(endpoint, model, outcome).inc()
+
+
+def count_structured_output(endpoint: str, schema: str, outcome: str) -> None:
+    LLM_STRUCTURED_OUTPUTS.labels(endpoint, schema, outcome).inc()
+
+
+def record_llm_usage(
+    endpoint: str,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cost: float,
+    queue_seconds: Optional[float] = None,
+    latency_seconds: Optional[float] = None,
+) -> None:
+    """Record one successful provider call."""
+    LLM_CALLS.labels(endpoint, model, "ok").inc()
+    LLM_PROMPT_TOKENS.labels(endpoint, model).inc(prompt_tokens)
+    LLM_COMPLETION_TOKENS.labels(endpoint, model).inc(completion_tokens)
+    LLM_COST.labels(endpoint, model).inc(cost)
+    LLM_PROMPT_SIZE.labels(endpoint, model).observe(prompt_tokens)
+    if queue_seconds is not None:
+        LLM_QUEUE_TIME.labels(endpoint, model).observe(queue_seconds)
+    if latency_seconds is not None:
+        LLM_LATENCY.labels(endpoint, model).observe(latency_seconds)
+
+
+def exposition() -> Tuple[bytes, str]:
+    """Current metrics in the Prometheus text format, and its content type.
+
+    Under a pre-forking server with PROMETHEUS_MULTIPROC_DIR set, the
+    samples of every worker are aggregated.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import Dict, List, Optional, Union
+
+from pydantic import BaseModel, ConfigDict, Field
 
 class DictErrorRequest(BaseModel):
     clause: str
@@ -8,14 +10,57 @@ class DictErrorRequest(BaseModel):
 class DictErrorResponse(BaseModel):
     reply: list
 
+class DictErrorBatchRequest(BaseModel):
+    items: List[DictErrorRequest]
+
+class DictErrorBatchItem(BaseModel):
+    reply: Optional[object] = None
+    error: Optional[str] = None
+
+class DictErrorBatchResponse(BaseModel):
+    results: List[DictErrorBatchItem]
+
 class InstitutionExtractionRequest(BaseModel):
     text: str  # Assuming the payload has a text attribute
 
 class InstitutionExtractionResponse(BaseModel):
     Institutions: list
 
+class InstitutionBatchRequest(BaseModel):
+    # Either a list of clauses, answered by position, or a map of clause id to clause
+    clauses: Union[List[str], Dict[str, str]]
+
+class InstitutionBatchResponse(BaseModel):
+    Institutions: Dict[str, list]
+
 class ChatbotRequest(BaseModel):
     question: str
+    session_id: Optional[str] = None
 
 class ChatbotResponse(BaseModel):
     response: str
+    session_id: str
+
+# Structured LLM outputs (see api.structured)
+
+NO_ISSUE_FOUND = "No issue found"
+
+class ClauseIssue(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+    context_and_legal_implications: str = Field(alias="Context and Legal Implications")
+    suggestion: str = Field(alias="Suggestion")
+
+class ClauseReview(BaseModel):
+    issues: List[ClauseIssue]  # Empty when the clause has no issue
+
+    def to_reply(self):
+        # The shape clients already read: "No issue found" or a list of issues
+        if not self.issues:
+            return NO_ISSUE_FOUND
+        return [issue.model_dump(by_alias=True) for issue in self.issues]
+
+class InstitutionsOutput(BaseModel):
+    institutions: List[str]
+
+class InstitutionBatchOutput(BaseModel):
+    institutions: Dict[str, List[str]]  # Clause id -> institutions
@@ -0,0 +1,197 @@
+import os
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from django.conf import settings
+from langchain_core.document_loaders import BaseLoader
+from langchain_core.documents import Document
+
+from api.embedding_cache import LRUTier, SQLiteStore
+
+DEFAULT_PAGE_CACHE_SIZE = 5000
+# Smaller documents are extracted in the calling process; a pool round trip costs more than it saves.
+DEFAULT_PARALLEL_MIN_PAGES = 200
+DEFAULT_PAGES_PER_TASK = 50
+
+
+# Documents a pool worker has open, so consecutive ranges of one file skip re-parsing it.
+_worker_documents: "OrderedDict[tuple, object]" = OrderedDict()
+WORKER_OPEN_DOCUMENTS = 4
+
+
+def extract_pages(path: str, pages: Sequence[int]) -> List[str]:
+    """Text of the given pages; runs in a pool worker, which opens the file itself."""
+    import fitz
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    doc = _worker_documents.get(key)
+    if doc is None:
+        doc = _worker_documents[key] = fitz.open(path)
+        while len(_worker_documents) > WORKER_OPEN_DOCUMENTS:
+            _worker_documents.popitem(last=False)[1].close()
+    _worker_documents.move_to_end(key)
+    return [doc[page].get_text() for page in pages]
+
+
+class PageCache:
+    """Extracted page text keyed by file hash and page number.
+
+    The in-process LRU holds `max_entries` pages; with a path, pages are
+    also kept in SQLite so other workers and later builds reuse them.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_PAGE_CACHE_SIZE, path: Optional[str] = None):
+        self.memory = LRUTier(max_entries)
+        self.disk = SQLiteStore(path, "pages", {"text": "TEXT"}) if path else None
+
+    @staticmethod
+    def key(file_hash: str, page: int) -> str:
+        return f"{file_hash}:{page}"
+
+    def get_many(self, file_hash: str, pages: Sequence[int]) -> Dict[int, str]:
+        found = {}
+        for page in pages:
+            text = self.memory.get(self.key(file_hash, page))
+            if text is not None:
+                found[page] = text
+        missing = {self.key(file_hash, page): page for page in pages if page not in found}
+        if missing and self.disk is not None:
+            for key, text in self.disk.get_many(list(missing), "text").items():
+                self.memory.put(key, text)
+                found[missing[key]] = text
+        return found
+
+    def put_many(self, file_hash: str, texts: Dict[int, str]) -> None:
+        items = {self.key(file_hash, page): text for page, text in texts.items()}
+        for key, text in items.items():
+            self.memory.put(key, text)
+        if self.disk is not None:
+            self.disk.put_many({key: (text,) for key, text in items.items()})
+
+
+class PDFLoader(BaseLoader):
+    """Loads a PDF one page at a time, like PyMuPDFLoader and with the same metadata.
+
+    The file is opened in place, so nothing is copied before pages are read.
+    Pages already in `cache` are not extracted again. Documents of at least
+    `parallel_min_pages` uncached pages are split into ranges of
+    `pages_per_task` extracted by `executor`; pages are still yielded in
+    order, with at most `max_in_flight` ranges submitted ahead.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        cache: Optional[PageCache] = None,
+        executor: Optional[ProcessPoolExecutor] = None,
+        parallel_min_pages: int = DEFAULT_PARALLEL_MIN_PAGES,
+        pages_per_task: int = DEFAULT_PAGES_PER_TASK,
+        max_in_flight: Optional[int] = None,
+    ):
+        self.file_path = file_path
+        self.cache = cache
+        self.executor = executor
+        self.parallel_min_pages = parallel_min_pages
+        self.pages_per_task = pages_per_task
+        # Two ranges per core keep every worker busy without buffering the whole document
+        self.max_in_flight = max_in_flight or 2 * (os.cpu_count() or 1)
+
+    def lazy_load(self) -> Iterator[Document]:
+        import fitz
+        from api.knowledge_index import file_sha256
+
+        file_hash = file_sha256(self.file_path) if self.cache is not None else None
+        with fitz.open(self.file_path) as doc:
+            n_pages = doc.page_count
+            metadata = {k: v for k, v in doc.metadata.items() if type(v) in (str, int)}
+            cached = self.cache.get_many(file_hash, range(n_pages)) if self.cache is not None else {}
+            missing = [page for page in range(n_pages) if page not in cached]
+            if self.executor is not None and len(missing) >= self.parallel_min_pages:
+                texts = self._extract_parallel(missing)
+            else:
+                texts = ((page, doc[page].get_text()) for page in missing)
+
+            extracted: Dict[int, str] = {}
+            for page in range(n_pages):
+                if page in cached:
+                    text = cached[page]
+                else:
+                    _, text = next(texts)
+                    extracted[page] = text
+                    if self.cache is not None and len(extracted) >= self.pages_per_task:
+                        self.cache.put_many(file_hash, extracted)
+                        extracted = {}
+                yield Document(page_content=text, metadata={
+                    "source": self.file_path,
+                    "file_path": self.file_path,
+                    "page": page,
+                    "total_pages": n_pages,
+                    **metadata,
+                })
+            if self.cache is not None:
+                self.cache.put_many(file_hash, extracted)
+
+    def _extract_parallel(self, pages: List[int]) -> Iterator[tuple]:
+        ranges = deque(pages[i:i + self.pages_per_task] for i in range(0, len(pages), self.pages_per_task))
+        in_flight: "deque[tuple[List[int], Future]]" = deque()
+        try:
+            while ranges or in_flight:
+                while ranges and len(in_flight) < self.max_in_flight:
+                    batch = ranges.popleft()
+                    in_flight.append((batch, self.executor.submit(extract_pages, self.file_path, batch)))
+                batch, future = in_flight.popleft()
+                yield from zip(batch, future.result())
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+
+_cache: Optional[PageCache] = None
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def get_page_cache() -> PageCache:
+    """Return the page cache shared by every loader in this process."""
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = PageCache(
+                    max_entries=getattr(settings, "PDF_PAGE_CACHE_SIZE", DEFAULT_PAGE_CACHE_SIZE),
+                    path=getattr(settings, "PDF_PAGE_CACHE_PATH", None),
+                )
+    return _cache
+
+
+def extract_workers() -> int:
+    return getattr(settings, "PDF_EXTRACT_WORKERS", None) or os.cpu_count() or 1
+
+
+def get_page_executor() -> Optional[ProcessPoolExecutor]:
+    """Return the process-wide extraction pool, or None if PDF_EXTRACT_WORKERS is 1."""
+    global _executor
+    workers = extract_workers()
+    if workers <= 1:
+        return None
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                # Spawned, not forked: the server process may hold threads and a loaded model
+                _executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def pdf_loader(file_path: str) -> PDFLoader:
+    """A loader using the shared page cache and extraction pool."""
+    return PDFLoader(
+        file_path,
+        cache=get_page_cache(),
+        executor=get_page_executor(),
+        parallel_min_pages=getattr(settings, "PDF_PARALLEL_MIN_PAGES", DEFAULT_PARALLEL_MIN_PAGES),
+        pages_per_task=getattr(settings, "PDF_PAGES_PER_TASK", DEFAULT_PAGES_PER_TASK),
+        max_in_flight=2 * extract_workers(),
+    )
@@ -0,0 +1,114 @@
+import os
+import json
+from typing import Optional, Tuple
+
+import numpy as np
+
+VECTORS_FILE = "vectors.npy"
+INT8_INDEX_FILE = "int8.faiss"
+BINARY_INDEX_FILE = "binary.faiss"
+QUANTIZED_META_FILE = "quantized.json"
+
+QUANTIZATION_MODES = ("none", "int8", "binary")
+# The compact index returns this many times the requested candidates for exact re-scoring.
+RESCORE_FACTOR = 4
+MIN_RESCORE_CANDIDATES = 32
+
+
+def binarize(vectors: np.ndarray) -> np.ndarray:
+    """One sign bit per dimension, packed into bytes."""
+    return np.packbits(vectors > 0, axis=1)
+
+
+def float_vectors(index) -> np.ndarray:
+    """All vectors of a flat FAISS index as a float32 matrix, in position order."""
+    return index.reconstruct_n(0, index.ntotal).astype(np.float32, copy=False)
+
+
+def save_quantized(index, folder_path: str) -> None:
+    """Store the float vectors for re-scoring, plus int8 and binary indexes over them."""
+    import faiss
+
+    vectors = float_vectors(index)
+    np.save(os.path.join(folder_path, VECTORS_FILE), vectors)
+    with open(os.path.join(folder_path, QUANTIZED_META_FILE), "w") as f:
+        json.dump({"d": index.d, "metric_type": index.metric_type}, f)
+
+    int8 = faiss.IndexScalarQuantizer(index.d, faiss.ScalarQuantizer.QT_8bit, index.metric_type)
+    int8.train(vectors)
+    int8.add(vectors)
+    faiss.write_index(int8, os.path.join(folder_path, INT8_INDEX_FILE))
+
+    if index.d % 8 == 0:
+        binary = faiss.IndexBinaryFlat(index.d)
+        binary.add(binarize(vectors))
+        faiss.write_index_binary(binary, os.path.join(folder_path, BINARY_INDEX_FILE))
+
+
+class QuantizedIndex:
+    """Compact first-pass index with exact re-scoring, searchable like a FAISS index.
+
+    `search` asks the int8 or binary index for `rescore_factor` times as many
+    candidates as requested, then ranks those candidates by their exact
+    distance to the query using full-precision vectors read from a
+    memory-mapped file. The float vectors therefore stay in the page cache,
+    shared by every worker, rather than in each worker's heap. Distances
+    follow the metric of the float index they were built from.
+    """
+
+    def __init__(self, compact, vectors: np.ndarray, metric_type: int, binary: bool, rescore_factor: int = RESCORE_FACTOR):
+        self.compact = compact
+        self.vectors = vectors
+        self.metric_type = metric_type
+        self.binary = binary
+        self.rescore_factor = rescore_factor
+        self.d = vectors.shape[1]
+        self.ntotal = vectors.shape[0]
+
+    @classmethod
+    def load(cls, folder_path: str, mode: str, rescore_factor: int = RESCORE_FACTOR) -> Optional["QuantizedIndex"]:
+        """Load the `mode` index saved by `save_quantized`, or None if this build has none."""
+        import faiss
+
+        index_file = {"int8": INT8_INDEX_FILE, "binary": BINARY_INDEX_FILE}[mode]
+        paths = [os.path.join(folder_path, name) for name in (index_file, VECTORS_FILE, QUANTIZED_META_FILE)]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        with open(paths[2]) as f:
+            metric_type = json.load(f)["metric_type"]
+        read = faiss.read_index_binary if mode == "binary" else faiss.read_index
+        return cls(read(paths[0]), np.load(paths[1], mmap_mode="r"), metric_type, mode == "binary", rescore_factor)
+
+    @property
+    def compact_bytes(self) -> int:
+        """Bytes held in memory by the compact codes."""
+        if self.binary:
+            return self.compact.ntotal * self.compact.code_size
+        return self.compact.sa_code_size() * self.compact.ntotal
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        import faiss
+
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        n_candidates = min(self.ntotal, max(k * self.rescore_factor, MIN_RESCORE_CANDIDATES))
+        compact_queries = binarize(queries) if self.binary else queries
+        _, candidates = self.compact.search(compact_queries, n_candidates)
+
+        distances = np.full((len(queries), k), np.inf if self.metric_type == faiss.METRIC_L2 else -np.inf, dtype=np.float32)
+        positions = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, row in enumerate(candidates):
+            row = row[row != -1]
+            if not len(row):
+                continue
+            # Sorted reads are sequential on the memory-mapped file
+            row = np.sort(row)
+            exact = np.asarray(self.vectors[row], dtype=np.float32)
+            if self.metric_type == faiss.METRIC_L2:
+                scores = ((exact - queries[i]) ** 2).sum(axis=1)
+                order = np.argsort(scores)[:k]
+            else:
+                scores = exact @ queries[i]
+                order = np.argsort(-scores)[:k]
+            distances[i, :len(order)] = scores[order]
+            positions[i, :len(order)] = row[order]
+        return distances, positions
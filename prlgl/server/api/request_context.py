@@ -0,0 +1,65 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.urls import Resolver404, resolve
+
+from api.metrics import HTTP_LATENCY
+
+# URL name of the view handling the current request, e.g. "reply_dict_error_api".
+current_endpoint: ContextVar[Optional[str]] = ContextVar("current_endpoint", default=None)
+
+
+def get_endpoint() -> str:
+    return current_endpoint.get() or "unknown"
+
+
+def _endpoint_name(request) -> Optional[str]:
+    try:
+        return resolve(request.path_info).url_name
+    except Resolver404:
+        return None
+
+
+def _observe(request, response, started: float) -> None:
+    HTTP_LATENCY.labels(get_endpoint(), request.method, response.status_code).observe(time.perf_counter() - started)
+
+
+class RequestContextMiddleware:
+    """Record which endpoint is being served so lower layers can label their metrics,
+    and how long the endpoint took to respond.
+
+    Works in both sync and async mode so async views are not pushed onto a
+    thread by the middleware stack.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = current_endpoint.set(_endpoint_name(request))
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            _observe(request, response, started)
+            return response
+        finally:
+            current_endpoint.reset(token)
+
+    async def __acall__(self, request):
+        token = current_endpoint.set(_endpoint_name(request))
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            _observe(request, response, started)
+            return response
+        finally:
+            current_endpoint.reset(token)
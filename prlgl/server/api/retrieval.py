@@ -0,0 +1,174 @@
+import os
+import json
+import pickle
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from api.tracing import span
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+    import scipy.sparse as sp
+    from langchain_community.vectorstores.faiss import FAISS
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+SPARSE_MATRIX_FILE = "sparse.npz"
+SPARSE_VECTORIZER_FILE = "vectorizer.pkl"
+SPARSE_IDS_FILE = "sparse_ids.json"
+
+# Keeps section numbers and citations such as "s.12(3)" or "[2014]" as tokens.
+TOKEN_PATTERN = r"(?u)\[?\b\w+(?:[.()/:-]\w+)*\)?\]?"
+
+RRF_K = 60
+CANDIDATES = 20
+# Cosine similarity at which a lexical hit is trusted without the dense pass.
+SPARSE_ONLY_MIN_SCORE = 0.6
+
+
+class SparseIndex:
+    """TF-IDF matrix over every chunk, stored as CSR with L2-normalised rows."""
+
+    def __init__(self, vectorizer: "TfidfVectorizer", matrix: "sp.csr_matrix", ids: List[str]):
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self.ids = ids
+
+    @classmethod
+    def from_texts(cls, texts: Sequence[str], ids: List[str]) -> "SparseIndex":
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        vectorizer = TfidfVectorizer(
+            token_pattern=TOKEN_PATTERN,
+            ngram_range=(1, 2),
+            sublinear_tf=True,
+            dtype=np.float32,
+        )
+        matrix = vectorizer.fit_transform(texts).tocsr()
+        return cls(vectorizer, matrix, ids)
+
+    @classmethod
+    def from_vector_store(cls, vector_store: "FAISS") -> "SparseIndex":
+        """Build rows in FAISS position order so row i and vector i are the same chunk."""
+        ids = [vector_store.index_to_docstore_id[i] for i in range(len(vector_store.index_to_docstore_id))]
+        texts = [vector_store.docstore.search(id_).page_content for id_ in ids]
+        return cls.from_texts(texts, ids)
+
+    def save(self, folder_path: str) -> None:
+        import scipy.sparse as sp
+        sp.save_npz(os.path.join(folder_path, SPARSE_MATRIX_FILE), self.matrix)
+        with open(os.path.join(folder_path, SPARSE_VECTORIZER_FILE), "wb") as f:
+            pickle.dump(self.vectorizer, f)
+        with open(os.path.join(folder_path, SPARSE_IDS_FILE), "w") as f:
+            json.dump(self.ids, f)
+
+    @classmethod
+    def load(cls, folder_path: str) -> Optional["SparseIndex"]:
+        """Load the sparse index saved next to a FAISS index, or None for older builds."""
+        if not os.path.exists(os.path.join(folder_path, SPARSE_MATRIX_FILE)):
+            return None
+        import scipy.sparse as sp
+        matrix = sp.load_npz(os.path.join(folder_path, SPARSE_MATRIX_FILE)).tocsr()
+        with open(os.path.join(folder_path, SPARSE_VECTORIZER_FILE), "rb") as f:
+            vectorizer = pickle.load(f)
+        with open(os.path.join(folder_path, SPARSE_IDS_FILE), "r") as f:
+            ids = json.load(f)
+        return cls(vectorizer, matrix, ids)
+
+    def scores(self, queries: Sequence[str]) -> np.ndarray:
+        """Cosine similarity of every query against every chunk, shape (n_queries, n_chunks)."""
+        q = self.vectorizer.transform(queries)
+        return (q @ self.matrix.T).toarray()
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores of each row, best first."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, part, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(part, order, axis=1)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], rrf_k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists: each id scores sum(1 / (rrf_k + rank))."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking, start=1):
+            fused[id_] = fused.get(id_, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridRetriever:
+    """Dense FAISS search and sparse TF-IDF search fused with reciprocal-rank fusion.
+
+    Queries whose best lexical match reaches `sparse_only_min_score` are
+    answered from the sparse ranking alone, without embedding the query.
+    Without a sparse index the retriever is dense only.
+    """
+
+    def __init__(
+        self,
+        vector_store: "FAISS",
+        sparse_index: Optional[SparseIndex] = None,
+        rrf_k: int = RRF_K,
+        candidates: int = CANDIDATES,
+        sparse_only_min_score: Optional[float] = SPARSE_ONLY_MIN_SCORE,
+    ):
+        self.vector_store = vector_store
+        self.sparse_index = sparse_index
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+        self.sparse_only_min_score = sparse_only_min_score
+
+    def search(self, query: str, k: int = 5) -> List[Tuple["Document", float]]:
+        return self.search_batch([query], k=k)[0]
+
+    def search_batch(self, queries: Sequence[str], k: int = 5) -> List[List[Tuple["Document", float]]]:
+        """Return the fused top-k (document, score) pairs for each query."""
+        n_candidates = max(k, self.candidates)
+        sparse_rankings: List[List[str]] = [[] for _ in queries]
+        needs_dense = list(range(len(queries)))
+
+        if self.sparse_index is not None and self.sparse_index.ids:
+            with span("sparse_search", queries=len(queries)):
+                scores = self.sparse_index.scores(queries)
+                best = top_k(scores, n_candidates)
+            needs_dense = []
+            for i, row in enumerate(best):
+                row = [j for j in row if scores[i, j] > 0]
+                sparse_rankings[i] = [self.sparse_index.ids[j] for j in row]
+                confident = (
+                    self.sparse_only_min_score is not None
+                    and row
+                    and scores[i, row[0]] >= self.sparse_only_min_score
+                )
+                if not confident:
+                    needs_dense.append(i)
+
+        dense_rankings: List[List[str]] = [[] for _ in queries]
+        if needs_dense:
+            dense_rankings_subset = self.dense_search([queries[i] for i in needs_dense], n_candidates)
+            for i, ranking in zip(needs_dense, dense_rankings_subset):
+                dense_rankings[i] = ranking
+
+        results = []
+        for sparse_ranking, dense_ranking in zip(sparse_rankings, dense_rankings):
+            fused = reciprocal_rank_fusion([r for r in (dense_ranking, sparse_ranking) if r], self.rrf_k)
+            results.append([(self.vector_store.docstore.search(id_), score) for id_, score in fused[:k]])
+        return results
+
+    def dense_search(self, queries: Sequence[str], k: int) -> List[List[str]]:
+        """Docstore ids of the k nearest chunks per query, from one batched FAISS search."""
+        embeddings = self.vector_store.embeddings
+        with span("embed_query", queries=len(queries)):
+            if hasattr(embeddings, "embed_queries"):
+                vectors = np.asarray(embeddings.embed_queries(list(queries)), dtype=np.float32)
+            elif len(queries) == 1:
+                vectors = np.asarray([embeddings.embed_query(queries[0])], dtype=np.float32)
+            else:
+                vectors = np.asarray(embeddings.embed_documents(list(queries)), dtype=np.float32)
+        with span("faiss_search", queries=len(queries), k=k):
+            _, positions = self.vector_store.index.search(vectors, k)
+        mapping = self.vector_store.index_to_docstore_id
+        return [[mapping[int(j)] for j in row if j != -1] for row in positions]
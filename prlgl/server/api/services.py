@@ -1,26 +1,21 @@
-import os
-from PyPDF2 import PdfReader
-import re
-import json
-from api.llm import get_completion
-import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-
-import ast
-
-
-import tempfile
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores.faiss import FAISS
-
-FAISS_INDEX_DIR = "./data/faiss_index"
-CHUNK_SIZE = 512
-CHUNK_OVERLAP = 128
-
+import asyncio
+import logging
+
+from api.llm import DEFAULT_MODEL, aget_completion, astream_completion, get_completion
+from api.knowledge_index import CHUNK_SIZE, CHUNK_OVERLAP, get_embeddings, get_retriever
+from api.context import DEFAULT_TOKEN_BUDGET, build_context
+from api.institutions import NO_INSTITUTIONS, get_institution_extractor
+from api.glossary import GlossaryIndex, get_glossary
+from api.tokens import num_tokens_from_string
+from api.tracing import span, traced
+from api.structured import (
+    JSON_MODE, StructuredOutputError, aget_structured_completion, aparse_or_repair, get_structured_completion, matches_schema,
+    with_schema,
+)
+from api.models import ClauseReview, InstitutionBatchOutput, InstitutionsOutput
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
 
 QNA_TEMPLATE_dict_error = """ Given the following knowledge base as context and the legal rule, examine the following clause with\
 and explain why is it flagged because of the error '{error}'.\
@@ -48,49 +43,12 @@ Answer: """
 
 
 
-# Processing PDF files with related clauses
-class PDF_base:
-    def __init__(self, pdf_file_path):
-        self.pdf_file_path = pdf_file_path
-        self.pdf_processing()
-        
-        
-    def pdf_processing(self):
-        with tempfile.NamedTemporaryFile(delete=False) as f:
-            with open(self.pdf_file_path, "rb") as pdf_file:
-                f.write(pdf_file.read())
-            self.documents = PyMuPDFLoader(f.name).load()
-            
-    def chunks_pdf_clause(self, clause, top_k = 5):
-        
-        embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-        
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-
-        chunked_docs = text_splitter.split_documents(self.documents)
-
-        vector_store = FAISS.from_documents(chunked_docs, embeddings)
+DEFAULT_BATCH_CONCURRENCY = 8
+DEFAULT_INSTITUTION_LLM_THRESHOLD = 0.75
+DEFAULT_INSTITUTION_BATCH_TOKENS = 3000
+DEFAULT_INSTITUTION_BATCH_MAX_CLAUSES = 20
 
-        vector_store.save_local( folder_path=FAISS_INDEX_DIR, index_name= 'sample')
-        
-        docs_and_scores = vector_store.similarity_search_with_score(clause, k=top_k)
-        
-        context = ""
-        
-        if docs_and_scores:
-            for doc, score in docs_and_scores:
-                context += f"\n{doc.page_content}"
-                
-        return context
-    
-    def genAI_dict_error_response(self,clause,rule, error):
-        
-        # here is where the knowledge base is
-        context = self.chunks_pdf_clause(clause)
-        
-        updated_input  = QNA_TEMPLATE_dict_error.format(context=context, rule=rule, clause=clause, error=error)
-        
-        sys_message = f"""
+SYS_MESSAGE_dict_error = """
 
             As a legal assistant specialized in contract analysis, your role is to assist users in identifying and addressing potential legal issues within contractual clauses. Leveraging a comprehensive knowledge base of legal documents, precedents, and principles, you are expected to:
 
@@ -100,60 +58,207 @@ class PDF_base:
 
             Your responses should be concise, precise, and tailored to non-specialist users, ensuring they are accessible and actionable. 
 
-            In instances where a clause is adequately structured and presents no legal concerns, it is important to affirm the clause's validity with a simple 'No issue found.'
+            In instances where a clause is adequately structured and presents no legal concerns, it is important to affirm the clause's validity with an empty list of issues.
 
-            For clauses with identified issues, your response should format as follows:
+            Your response should be a JSON object formatted as follows:
             
-            {{
-                "Context and Legal Implications": "A detailed explanation combining the specific legal issue detected with its potential consequences or risks, providing a comprehensive understanding of the matter at hand.",
-                "Suggestion": "Specific advice on how to amend the clause to address the identified issue effectively."
-            }}
+            {
+                "issues": [
+                    {
+                        "Context and Legal Implications": "A detailed explanation combining the specific legal issue detected with its potential consequences or risks, providing a comprehensive understanding of the matter at hand.",
+                        "Suggestion": "Specific advice on how to amend the clause to address the identified issue effectively."
+                    }
+                ]
+            }
 
             This approach ensures users receive both the insight needed to understand the context and potential legal ramifications, along with the guidance necessary to rectify any concerns effectively.
             Example:
 
             user: ```clause....```
 
-            output if there is no issue with the given clause: ```No issue found```
+            output if there is no issue with the given clause: {"issues": []}
 
             output if there is an issue with the given clause:
             
-            [{{
-                "Context and legal implications": "The clause does not clearly define the terms of the agreement",
+            {"issues": [{
+                "Context and Legal Implications": "The clause does not clearly define the terms of the agreement",
                 "Suggestion": "The clause should be rewritten to clearly define the terms of the agreement"
-            }}]
+            }]}
+
+"""
 
+
+# Processing PDF files with related clauses
+class PDF_base:
+    def __init__(self, pdf_file_path=None, retriever=None):
+        # Without a path, queries go to the process-wide knowledge index
+        # built by `manage.py build_index`.
+        self.pdf_file_path = pdf_file_path
+        self.retriever = retriever
+        if pdf_file_path is not None:
+            self.pdf_processing()
+        
+        
+    @traced()
+    def pdf_processing(self):
+        # Read in place, without a temporary copy; pages are cached by file hash
+        from api.pdf_loader import pdf_loader
+        
+        self.documents = pdf_loader(self.pdf_file_path).load()
+            
+    def get_retriever(self):
+        if self.retriever is None:
+            if self.pdf_file_path is None:
+                self.retriever = get_retriever()
+            else:
+                # Ad-hoc document: index it in memory once per instance.
+                from langchain_community.vectorstores.faiss import FAISS
+                from api.chunking import ClauseSplitter
+                from api.retrieval import HybridRetriever, SparseIndex
+                
+                text_splitter = ClauseSplitter(CHUNK_SIZE, CHUNK_OVERLAP)
+                with span("split_pages", pages=len(self.documents)):
+                    chunked_docs = text_splitter.split_documents(self.documents)
+                with span("index_pages", chunks=len(chunked_docs)):
+                    vector_store = FAISS.from_documents(chunked_docs, get_embeddings())
+                    self.retriever = HybridRetriever(vector_store, SparseIndex.from_vector_store(vector_store))
+        return self.retriever
+            
+    @traced()
+    def chunks_pdf_clause(self, clause, top_k = 5):
+        
+        docs_and_scores = self.get_retriever().search(clause, k=top_k)
+        
+        return self.build_context(docs_and_scores)
+    
+    @traced()
+    def chunks_pdf_clauses(self, clauses, top_k = 5):
+        """Context for each clause, from one batched search over the index."""
+        
+        results = self.get_retriever().search_batch(clauses, k=top_k)
+        
+        return [self.build_context(docs_and_scores) for docs_and_scores in results]
+    
+    def build_context(self, docs_and_scores):
+        # Overlapping chunks are merged and the result packed into the token budget
+        token_budget = getattr(settings, "CONTEXT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET)
+        with span("build_context", chunks=len(docs_and_scores)):
+            return build_context(docs_and_scores, token_budget=token_budget, model=DEFAULT_MODEL)
+    
+    @traced("build_prompt")
+    def dict_error_messages(self, context, clause, rule, error):
+        
+        updated_input  = QNA_TEMPLATE_dict_error.format(context=context, rule=rule, clause=clause, error=error)
+        
+        sys_message = SYS_MESSAGE_dict_error
+        
+        return [{"role": "system", "content": sys_message},
+                {"role": "user", "content": updated_input}]
+    
+    @traced("build_prompt")
+    def dict_no_error_messages(self, context, clause):
+        
+        updated_input = QNA_TEMPLATE_dict_no_error.format(context=context, clause=clause)
+        
+        return [{"role": "system", "content": SYS_MESSAGE_dict_error},
+                {"role": "user", "content": updated_input}]
+    
+    @traced()
+    def genAI_dict_error_response(self,clause,rule, error):
+        
+        # here is where the knowledge base is
+        context = self.chunks_pdf_clause(clause)
+        
+        messages = self.dict_error_messages(context, clause, rule, error)
+        
+        review = get_structured_completion(messages, ClauseReview)
+        
+        return review.to_reply()
+    
+    @traced()
+    async def agenAI_dict_error_response(self, clause, rule, error):
+        
+        # Retrieval is CPU bound, keep it off the event loop
+        context = await asyncio.to_thread(self.chunks_pdf_clause, clause)
+        
+        messages = self.dict_error_messages(context, clause, rule, error)
+        
+        review = await aget_structured_completion(messages, ClauseReview)
+        
+        return review.to_reply()
+    
+    @traced()
+    async def astream_dict_error_response(self, clause, rule, error):
+        """Yield ("token", text) events as the JSON reply is generated, then ("result", validated reply)."""
+        
+        context = await asyncio.to_thread(self.chunks_pdf_clause, clause)
+        
+        messages = with_schema(self.dict_error_messages(context, clause, rule, error), ClauseReview)
+        
+        parts = []
+        async for delta in astream_completion(messages, response_format=JSON_MODE, cacheable=matches_schema(ClauseReview)):
+            parts.append(delta)
+            yield "token", delta
+        
+        review = await aparse_or_repair("".join(parts), ClauseReview)
+        yield "result", review.to_reply()
+    
+    @traced()
+    async def agenAI_dict_error_batch(self, items, max_concurrency=DEFAULT_BATCH_CONCURRENCY):
+        """Review many (clause, rule, error) items, returning one dict per item, in order.
+        
+        Each dict holds either "reply" or "error", so one failed item does not fail the batch.
         """
         
-        messages = [{"role": "system", "content": sys_message},
-                    {"role": "user", "content": updated_input}]
+        contexts = await asyncio.to_thread(self.chunks_pdf_clauses, [item["clause"] for item in items])
         
-        response = get_completion(messages)
+        semaphore = asyncio.Semaphore(max_concurrency)
         
-        reply = response.choices[0].message.content
+        async def review(item, context):
+            messages = self.dict_error_messages(context, item["clause"], item["rule"], item["error"])
+            try:
+                async with semaphore:
+                    review = await aget_structured_completion(messages, ClauseReview)
+                return {"reply": review.to_reply()}
+            except Exception as e:
+                return {"error": str(e)}
         
-        try:
-            # Assuming 'reply' is the variable holding the string to be evaluated
-            result = ast.literal_eval(reply)
-
-        except SyntaxError:
-            # Handle the error: log it, return a meaningful error message, etc.
-            print("Received a string that is not a valid Python literal.")
+        return await asyncio.gather(*(review(item, context) for item, context in zip(items, contexts)))
+    
+    @traced()
+    def genAI_dict_no_error_response(self, clause):
         
-        return result
+        context = self.chunks_pdf_clause(clause)
+        
+        messages = self.dict_no_error_messages(context, clause)
+        
+        review = get_structured_completion(messages, ClauseReview)
+        
+        return review.to_reply()
+    
+    @traced()
+    async def agenAI_dict_no_error_response(self, clause):
+        
+        context = await asyncio.to_thread(self.chunks_pdf_clause, clause)
+        
+        messages = self.dict_no_error_messages(context, clause)
+        
+        review = await aget_structured_completion(messages, ClauseReview)
+        
+        return review.to_reply()
         
         
 # Named entity Recognition
-def extract_institution(clause):
-    sys_message = f"""
+def institution_messages(clause):
+    sys_message = """
     You are a legal assistant here to help the user with contract reviewing who is an expert in \
     natural language processing and especially name entity recognition for legal institutions.
     
     Your task is to identify the institutions specified in the following clause.
         
-    If there is no legal institutions are found within the clause, please respond with 'No legal institutions found'.
+    If there is no legal institutions are found within the clause, please respond with an empty list.
     
-    Your responses should be in the list of institutions.
+    Your responses should be a JSON object with the list of institutions.
     
     Example:
     
@@ -161,59 +266,204 @@ def extract_institution(clause):
     
     output if there are legal institutions in the clause:
     
-    ["institution_1", "institution_2", "institution_3"]
+    {"institutions": ["institution_1", "institution_2", "institution_3"]}
     
     output if there are no legal institutions in the clause:
     
-    ["No legal institutions found"]
+    {"institutions": []}
     
     """        
     
-    messages = [{"role": "system", "content": sys_message},
-                {"role": "user", "content": clause}]
-    
-    response = get_completion(messages)
-    reply = response.choices[0].message.content
-    
-    print(reply)
+    return [{"role": "system", "content": sys_message},
+            {"role": "user", "content": clause}]
 
-    # Error handling
-    try:
-        reply = ast.literal_eval(reply)
 
-    except ValueError as e:
-        print(f"Error evaluating reply: {e}")
-    
+def clean_institution_names(names):
+    # Keep names with at least one capitalised word
     reply_new = []
-    for name in reply:
+    for name in names:
         for n in name.split():
             if n.istitle():
                 reply_new.append(name)
                 break
     if len(reply_new) == 0:
-        reply_new = ["No legal institutions found"]
+        reply_new = [NO_INSTITUTIONS]
     
     return reply_new
+
+
+@traced()
+def local_institutions(clause):
+    # Gazetteer and NER answer confident cases without an LLM call
+    result = get_institution_extractor().extract(clause)
+    if result.confidence >= getattr(settings, "INSTITUTION_LLM_THRESHOLD", DEFAULT_INSTITUTION_LLM_THRESHOLD):
+        return result.institutions
+    return None
+
+
+@traced()
+def extract_institution(clause):
+    institutions = local_institutions(clause)
+    if institutions is not None:
+        return institutions
+    reply = get_structured_completion(institution_messages(clause), InstitutionsOutput)
+    return clean_institution_names(reply.institutions)
+
+
+async def allm_institutions(clause):
+    reply = await aget_structured_completion(institution_messages(clause), InstitutionsOutput)
+    return clean_institution_names(reply.institutions)
+
+
+@traced()
+async def aextract_institution(clause):
+    institutions = await asyncio.to_thread(local_institutions, clause)
+    if institutions is not None:
+        return institutions
+    return await allm_institutions(clause)
+
+
+def institution_batch_messages(clauses):
+    """One prompt for many clauses; `clauses` maps clause id to text."""
+    sys_message = """
+    You are a legal assistant here to help the user with contract reviewing who is an expert in \
+    natural language processing and especially name entity recognition for legal institutions.
+    
+    Your task is to identify the institutions specified in each of the clauses below. Each clause \
+    is enclosed in <clause id="..."> and </clause> tags.
+    
+    Respond with a JSON object whose "institutions" maps every clause id to the list of institutions \
+    in that clause. If no legal institutions are found within a clause, its list should be empty.
+    
+    Example:
+    
+    user:
+    <clause id="1">clause....</clause>
+    <clause id="2">clause....</clause>
+    
+    output:
+    
+    {"institutions": {"1": ["institution_1", "institution_2"], "2": []}}
+    
+    """
+    
+    user_message = "\n".join(f'<clause id="{clause_id}">{clause}</clause>' for clause_id, clause in clauses.items())
+    return [{"role": "system", "content": sys_message},
+            {"role": "user", "content": user_message}]
+
+
+def split_institution_batches(clauses, token_budget, max_clauses):
+    """Split {id: clause} into batches whose clauses total at most `token_budget` tokens."""
+    batches, batch, batch_tokens = [], {}, 0
+    for clause_id, clause in clauses.items():
+        # Ids and tags cost a few tokens per clause
+        n_tokens = num_tokens_from_string(clause) + 8
+        if batch and (batch_tokens + n_tokens > token_budget or len(batch) >= max_clauses):
+            batches.append(batch)
+            batch, batch_tokens = {}, 0
+        batch[clause_id] = clause
+        batch_tokens += n_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+@traced()
+async def aextract_institutions_batch(clauses):
+    """Institutions for many clauses, as {clause id: institutions}.
+
+    Clauses the local extractor is confident about are answered without the
+    LLM. The rest are packed into as few prompts as the token budget allows,
+    and any clause whose answer is missing from a batch reply is asked about
+    on its own. A clause that still gets no valid answer maps to None.
+    """
+    
+    local = await asyncio.to_thread(lambda: {clause_id: local_institutions(clause) for clause_id, clause in clauses.items()})
+    results = {clause_id: names for clause_id, names in local.items() if names is not None}
+    remaining = {clause_id: clause for clause_id, clause in clauses.items() if clause_id not in results}
+    
+    batches = split_institution_batches(
+        remaining,
+        getattr(settings, "INSTITUTION_BATCH_TOKENS", DEFAULT_INSTITUTION_BATCH_TOKENS),
+        getattr(settings, "INSTITUTION_BATCH_MAX_CLAUSES", DEFAULT_INSTITUTION_BATCH_MAX_CLAUSES),
+    )
+    
+    async def extract_batch(batch):
+        if len(batch) == 1:
+            [(clause_id, clause)] = batch.items()
+            return {clause_id: await allm_institutions(clause)}
+        try:
+            reply = await aget_structured_completion(institution_batch_messages(batch), InstitutionBatchOutput)
+            found = {clause_id: clean_institution_names(reply.institutions[str(clause_id)])
+                     for clause_id in batch if str(clause_id) in reply.institutions}
+        except StructuredOutputError:
+            found = {}
+        
+        missing = [clause_id for clause_id in batch if clause_id not in found]
+        if missing:
+            logger.info("Batch reply had no usable answer for %d of %d clauses; asking for them one by one.", len(missing), len(batch))
+            replies = await asyncio.gather(*(allm_institutions(batch[clause_id]) for clause_id in missing), return_exceptions=True)
+            for clause_id, reply in zip(missing, replies):
+                if isinstance(reply, Exception) and not isinstance(reply, StructuredOutputError):
+                    raise reply
+                found[clause_id] = None if isinstance(reply, Exception) else reply
+        return found
+    
+    for found in await asyncio.gather(*(extract_batch(batch) for batch in batches)):
+        results.update(found)
+    return {clause_id: results[clause_id] for clause_id in clauses}
         
         
         
 # Chatbot
 class Chatbot:
-    def __init__(self, knowledge_base = None):
+    def __init__(self, knowledge_base = None, history = None):
+        # Only the glossary entries relevant to each question go into the prompt
+        if knowledge_base is None:
+            knowledge_base = get_glossary()
+        elif isinstance(knowledge_base, dict):
+            glossary = GlossaryIndex()
+            glossary.update(knowledge_base)
+            knowledge_base = glossary
         self.knowledge_base = knowledge_base
+        # Earlier turns of the session (see api.conversation), oldest first
+        self.history = history or []
         
-    def handle_query(self, user_question):
+    @traced("build_prompt")
+    def messages(self, user_question):
         system_message = "You are a legal assistant here to help us with clause review and checking concept."
         messages = [
             {'role': 'system', 'content': system_message},
+            *self.history,
             {'role': 'user', 'content': user_question},
-            {'role': 'system', 'content': self.knowledge_base}
         ]
-        response = get_completion(messages=messages)
+        knowledge = self.knowledge_base.context(user_question)
+        if knowledge:
+            messages.append({'role': 'system', 'content': knowledge})
+        return messages
+        
+    @traced()
+    def handle_query(self, user_question):
+        response = get_completion(messages=self.messages(user_question))
         reply_content = response.choices[0].message.content
         return reply_content
     
+    @traced()
+    async def ahandle_query(self, user_question):
+        # Embedding the question for the glossary search blocks, so it runs off the event loop
+        messages = await asyncio.to_thread(self.messages, user_question)
+        response = await aget_completion(messages=messages)
+        return response.choices[0].message.content
+    
+    @traced()
+    async def astream_query(self, user_question):
+        """Yield the reply piece by piece as it is generated."""
+        messages = await asyncio.to_thread(self.messages, user_question)
+        async for delta in astream_completion(messages=messages):
+            yield delta
+    
     def update_knowledge_base(self, term, explanation):
-        self.knowledge_base[term] = explanation
+        # Embeds just this term; the rest of the glossary is untouched
+        self.knowledge_base.add(term, explanation)
         
         
@@ -0,0 +1,161 @@
+import json
+import logging
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple, Type, TypeVar
+
+from django.conf import settings
+from pydantic import BaseModel, ValidationError
+
+from api.llm import aget_completion, get_completion
+from api.metrics import count_structured_output
+from api.request_context import get_endpoint
+from api.tracing import span
+
+logger = logging.getLogger(__name__)
+
+JSON_MODE = {"type": "json_object"}
+# Cheap model that only has to reformat a reply, never to redo the analysis.
+DEFAULT_REPAIR_MODEL = "gpt-3.5-turbo-0125"
+
+Schema = TypeVar("Schema", bound=BaseModel)
+
+
+class StructuredOutputError(ValueError):
+    """The model's reply did not match the schema, even after the repair attempt."""
+
+    def __init__(self, schema: Type[BaseModel], content: str, error: Exception):
+        super().__init__(f"Reply does not match {schema.__name__}: {error}")
+        self.schema = schema
+        self.content = content
+
+
+class StructuredStats:
+    """Per-schema counts of replies that were valid, needed a repair, or stayed invalid."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = defaultdict(lambda: {"valid": 0, "repaired": 0, "invalid": 0})
+
+    def record(self, schema: str, outcome: str) -> None:
+        with self._lock:
+            self._counts[schema][outcome] += 1
+        count_structured_output(get_endpoint(), schema, outcome)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            counts = {schema: dict(c) for schema, c in self._counts.items()}
+        for c in counts.values():
+            total = c["valid"] + c["repaired"] + c["invalid"]
+            # Share of first replies that did not parse
+            c["parse_failure_rate"] = (c["repaired"] + c["invalid"]) / total if total else 0.0
+        return counts
+
+
+stats = StructuredStats()
+
+
+def schema_instructions(schema: Type[BaseModel]) -> str:
+    return (
+        "Respond with a single JSON object, and nothing else, that conforms to this JSON schema:\n"
+        + json.dumps(schema.model_json_schema())
+    )
+
+
+def with_schema(messages: List[Dict[str, str]], schema: Type[BaseModel]) -> List[Dict[str, str]]:
+    """The messages followed by a system message describing the expected JSON."""
+    # Appended rather than merged so the prompt prefix stays the same across schemas
+    return messages + [{"role": "system", "content": schema_instructions(schema)}]
+
+
+def parse_structured(content: str, schema: Type[Schema]) -> Schema:
+    """Validate a JSON reply, tolerating a surrounding Markdown code fence."""
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.strip("`").removeprefix("json").strip()
+    return schema.model_validate_json(content)
+
+
+def matches_schema(schema: Type[BaseModel]) -> Callable[[str], bool]:
+    """Whether a reply validates against `schema`; only such replies go into the response cache."""
+    def matches(content: str) -> bool:
+        try:
+            parse_structured(content, schema)
+        except ValidationError:
+            return False
+        return True
+    return matches
+
+
+def repair_messages(content: str, error: Exception, schema: Type[BaseModel]) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": (
+            "Rewrite the text below as JSON that conforms to the schema. Keep its meaning and wording; "
+            "do not add information. " + schema_instructions(schema)
+        )},
+        {"role": "user", "content": f"Text:\n{content}\n\nValidation error:\n{error}"},
+    ]
+
+
+def _repair_model() -> str:
+    return getattr(settings, "LLM_REPAIR_MODEL", DEFAULT_REPAIR_MODEL)
+
+
+def _validate(content: str, schema: Type[Schema]) -> Tuple[Optional[Schema], Optional[ValidationError]]:
+    try:
+        with span("parse_reply", schema=schema.__name__):
+            value = parse_structured(content, schema)
+    except ValidationError as e:
+        logger.info("%s reply failed validation: %s", schema.__name__, e)
+        return None, e
+    stats.record(schema.__name__, "valid")
+    return value, None
+
+
+def _repaired(repaired: str, schema: Type[Schema], original: str) -> Schema:
+    try:
+        value = parse_structured(repaired, schema)
+    except ValidationError as e:
+        stats.record(schema.__name__, "invalid")
+        raise StructuredOutputError(schema, original, e) from e
+    stats.record(schema.__name__, "repaired")
+    return value
+
+
+def parse_or_repair(content: str, schema: Type[Schema]) -> Schema:
+    """Validate `content`, or make one reformatting call to the repair model and validate that."""
+    value, error = _validate(content, schema)
+    if value is not None:
+        return value
+    response = get_completion(repair_messages(content, error, schema), model=_repair_model(), response_format=JSON_MODE,
+                              cacheable=matches_schema(schema))
+    return _repaired(response.choices[0].message.content, schema, content)
+
+
+async def aparse_or_repair(content: str, schema: Type[Schema]) -> Schema:
+    value, error = _validate(content, schema)
+    if value is not None:
+        return value
+    response = await aget_completion(repair_messages(content, error, schema), model=_repair_model(),
+                                     response_format=JSON_MODE, cacheable=matches_schema(schema))
+    return _repaired(response.choices[0].message.content, schema, content)
+
+
+def get_structured_completion(messages: List[Dict[str, str]], schema: Type[Schema], **kwargs) -> Schema:
+    """Completion in JSON mode, validated against `schema`.
+
+    A reply that does not validate gets one repair attempt on the cheap
+    repair model, which sees only the reply and the validation error, not
+    the original prompt. Raises StructuredOutputError if that fails too.
+    Only replies that validate as they are are cached.
+    """
+    response = get_completion(with_schema(messages, schema), response_format=JSON_MODE,
+                              cacheable=matches_schema(schema), **kwargs)
+    return parse_or_repair(response.choices[0].message.content, schema)
+
+
+async def aget_structured_completion(messages: List[Dict[str, str]], schema: Type[Schema], **kwargs) -> Schema:
+    """Async counterpart of get_structured_completion."""
+    response = await aget_completion(with_schema(messages, schema), response_format=JSON_MODE,
+                                     cacheable=matches_schema(schema), **kwargs)
+    return await aparse_or_repair(response.choices[0].message.content, schema)
@@ -1,3 +1,460 @@
-from django.test import TestCase
+import os
+import re
+import random
+import shutil
+import asyncio
+import tempfile
+import zlib
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import numpy as np
+import openai
+from django.test import SimpleTestCase, override_settings
+from langchain_core.embeddings import Embeddings
+
+from api import llm, llm_scheduler, structured
+from api.chunking import ClauseSplitter
+from api.conversation import Conversation, ConversationStore
+from api.embedding_cache import SQLiteTier
+from api.ingest import chunk_id, ingest_directory
+from api.institutions import UNRESOLVED_CONFIDENCE, InstitutionExtractor
+from api.knowledge_index import load_index, load_retriever, read_manifest
+from api.llm_scheduler import LLMScheduler, TokenBucket
+from api.models import InstitutionsOutput
+from api.retrieval import reciprocal_rank_fusion, top_k
+from api.structured import StructuredOutputError, get_structured_completion, parse_or_repair
+from api.tokens import get_encoding
+
+WORDS = ("supplier customer shall indemnify losses arising notwithstanding foregoing termination "
+         "notice agreement confidential information party obligations").split()
+
+
+def words(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def completion(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class HashingEmbeddings(Embeddings):
+    """Bag-of-words vectors, so indexes can be built without loading a model."""
+
+    dim = 64
+
+    def embed_documents(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                vectors[i, zlib.crc32(word.encode()) % self.dim] += 1
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class ClauseSplitterTests(SimpleTestCase):
+    def n_tokens(self, text: str) -> int:
+        return len(get_encoding().encode_ordinary(text))
+
+    def test_chunks_fit_the_token_budget(self):
+        rng = random.Random(0)
+        splitter = ClauseSplitter(chunk_size=60, chunk_overlap=20)
+        for _ in range(50):
+            # Sentences of very different lengths, so overlap is carried over often
+            text = " ".join(
+                words(rng, rng.choice([3, 8, 20, 40, 70, 150])).capitalize() + "."
+                for _ in range(rng.randint(5, 40))
+            )
+            for chunk in splitter.split_spans(text):
+                self.assertLessEqual(self.n_tokens(text[chunk.start:chunk.end]), 60)
+                self.assertEqual(chunk.tokens, self.n_tokens(text[chunk.start:chunk.end]))
+
+    def test_text_without_boundaries_is_cut_by_tokens(self):
+        text = "x" * 5000
+        chunks = ClauseSplitter(chunk_size=50, chunk_overlap=10).split_spans(text)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(text[c.start:c.end] for c in chunks), text)
+        self.assertTrue(all(self.n_tokens(text[c.start:c.end]) <= 50 for c in chunks))
+
+    def test_articles_start_new_chunks(self):
+        rng = random.Random(1)
+        articles = [f"Article {n} {title}\n{n}.1 {words(rng, 40)}.\n{n}.2 {words(rng, 40)}."
+                    for n, title in enumerate(["Definitions", "Term", "Payment"], start=1)]
+        text = "\n\n".join(articles)
+        chunks = ClauseSplitter(chunk_size=1000, chunk_overlap=24, min_fill=0).split_spans(text)
+        self.assertEqual([text[c.start:c.end] for c in chunks], articles)
+        self.assertEqual([c.section for c in chunks], ["Article 1 Definitions", "Article 2 Term", "Article 3 Payment"])
+
+    def test_short_sections_share_a_chunk(self):
+        text = "Section 1 Scope\nThe services.\n\nSection 2 Fees\nFees are due monthly."
+        chunks = ClauseSplitter(chunk_size=160, chunk_overlap=24).split_spans(text)
+        self.assertEqual([text[c.start:c.end] for c in chunks], [text])
+        self.assertEqual(chunks[0].section, "Section 1 Scope")
+
+    def test_long_article_is_cut_at_clauses_without_overlap(self):
+        rng = random.Random(2)
+        clauses = [f"4.{n} {words(rng, 30)}." for n in range(1, 9)]
+        text = "Article 4 Liability\n" + "\n".join(clauses)
+        chunks = ClauseSplitter(chunk_size=100, chunk_overlap=24).split_spans(text)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks[1:]:
+            self.assertRegex(text[chunk.start:chunk.end], r"^4\.\d ")
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertGreater(chunk.start, previous.end)
+
+    def test_documents_keep_metadata_and_offsets(self):
+        from langchain_core.documents import Document
+
+        text = "Section 1 Scope\nThis agreement covers the services.\n\nSection 2 Fees\nFees are due monthly."
+        chunks = ClauseSplitter(chunk_size=10, chunk_overlap=2).split_documents([Document(page_content=text, metadata={"page": 3})])
+        for chunk in chunks:
+            self.assertEqual(chunk.metadata["page"], 3)
+            self.assertEqual(text[chunk.metadata["start_index"]:chunk.metadata["end_index"]], chunk.page_content)
+        self.assertEqual(chunks[-1].metadata["section"], "Section 2 Fees")
+
+
+@override_settings(PDF_EXTRACT_WORKERS=1)
+class IngestTests(SimpleTestCase):
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source_dir, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+        embeddings = HashingEmbeddings()
+        for target in ("api.ingest.get_embeddings", "api.knowledge_index.get_embeddings"):
+            patcher = mock.patch(target, return_value=embeddings)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write(self, name: str, seed: int) -> None:
+        rng = random.Random(seed)
+        text = "\n\n".join(f"Article {n} Terms\n{n}.1 {words(rng, 60)}." for n in range(1, 5))
+        with open(os.path.join(self.source_dir, name), "w") as f:
+            f.write(text)
+
+    def ingest(self):
+        return ingest_directory(self.source_dir, self.index_dir)
+
+    def test_added_documents_are_indexed(self):
+        self.write("a.txt", 1)
+        self.write("b.md", 2)
+        report = self.ingest()
+        self.assertEqual(report.added_documents, ["a.txt", "b.md"])
+        manifest = read_manifest(self.index_dir)
+        self.assertEqual(set(manifest["documents"]), {"a.txt", "b.md"})
+        self.assertEqual(report.embedded_chunks, report.total_chunks)
+        self.assertEqual(len(load_index(self.index_dir).docstore._dict), report.total_chunks)
+
+    def test_unchanged_corpus_keeps_its_version(self):
+        self.write("a.txt", 1)
+        first = self.ingest()
+        second = self.ingest()
+        self.assertFalse(second.changed)
+        self.assertEqual(second.unchanged_documents, 1)
+        self.assertEqual(second.version, first.version)
+
+    def test_changed_document_only_embeds_new_chunks(self):
+        self.write("a.txt", 1)
+        self.write("b.txt", 2)
+        self.ingest()
+        before = read_manifest(self.index_dir)["documents"]
+        with open(os.path.join(self.source_dir, "a.txt"), "a") as f:
+            f.write("\n\nArticle 9 Notices\n9.1 Notices shall be given in writing.")
+        report = self.ingest()
+        after = read_manifest(self.index_dir)["documents"]
+        self.assertEqual(report.changed_documents, ["a.txt"])
+        self.assertEqual(report.unchanged_documents, 1)
+        self.assertEqual(after["b.txt"], before["b.txt"])
+        # Only chunks that are new to a.txt are embedded; its earlier articles are kept
+        new_chunks = set(after["a.txt"]["chunks"]) - set(before["a.txt"]["chunks"])
+        self.assertEqual(report.embedded_chunks, len(new_chunks))
+        self.assertTrue(set(after["a.txt"]["chunks"]) & set(before["a.txt"]["chunks"]))
+        self.assertEqual(report.removed_chunks, len(set(before["a.txt"]["chunks"]) - set(after["a.txt"]["chunks"])))
+
+    def test_deleted_document_leaves_a_tombstone(self):
+        self.write("a.txt", 1)
+        self.write("b.txt", 2)
+        self.ingest()
+        removed = read_manifest(self.index_dir)["documents"]["b.txt"]
+        os.remove(os.path.join(self.source_dir, "b.txt"))
+        report = self.ingest()
+        self.assertEqual(report.deleted_documents, ["b.txt"])
+        manifest = read_manifest(self.index_dir)
+        self.assertNotIn("b.txt", manifest["documents"])
+        self.assertEqual(manifest["tombstones"]["b.txt"]["chunks"], removed["chunks"])
+        docstore = load_index(self.index_dir).docstore._dict
+        self.assertFalse(set(removed["chunks"]) & set(docstore))
+
+        # Restoring the document lifts its tombstone
+        self.write("b.txt", 2)
+        self.assertEqual(self.ingest().added_documents, ["b.txt"])
+        self.assertNotIn("b.txt", read_manifest(self.index_dir)["tombstones"])
+
+    def test_deleting_the_last_document_empties_the_index(self):
+        self.write("a.txt", 1)
+        self.ingest()
+        os.remove(os.path.join(self.source_dir, "a.txt"))
+        # An empty directory is refused outright, so leave a document without text
+        open(os.path.join(self.source_dir, "blank.txt"), "w").close()
+        report = self.ingest()
+        self.assertEqual(report.deleted_documents, ["a.txt"])
+        self.assertEqual(report.total_chunks, 0)
+        self.assertEqual(load_index(self.index_dir).docstore._dict, {})
+        self.assertEqual(load_retriever(self.index_dir).search("termination notice"), [])
+
+        self.write("a.txt", 1)
+        self.assertEqual(self.ingest().added_documents, ["a.txt"])
+
+    def test_chunk_ids_depend_on_source_and_text(self):
+        self.assertEqual(chunk_id("a.txt", "text"), chunk_id("a.txt", "text"))
+        self.assertNotEqual(chunk_id("a.txt", "text"), chunk_id("b.txt", "text"))
+
+
+class SQLiteTierTests(SimpleTestCase):
+    def test_oldest_rows_are_evicted_past_the_limit(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        tier = SQLiteTier(os.path.join(folder, "embeddings.sqlite3"), max_entries=3)
+        with mock.patch("api.embedding_cache.time.time", side_effect=range(5)):
+            for i in range(5):
+                tier.put_many("model", {f"k{i}": np.full(4, i, dtype=np.float32)})
+        self.assertEqual(set(tier.get_many([f"k{i}" for i in range(5)])), {"k2", "k3", "k4"})
+        self.assertEqual(tier.evictions, 2)
+
+
+class RetrievalTests(SimpleTestCase):
+    def test_top_k_returns_best_first(self):
+        scores = np.array([[0.1, 0.9, 0.5, 0.7], [3.0, 1.0, 2.0, 0.0]])
+        np.testing.assert_array_equal(top_k(scores, 2), [[1, 3], [0, 2]])
+
+    def test_top_k_is_capped_at_the_number_of_columns(self):
+        self.assertEqual(top_k(np.array([[0.2, 0.1]]), 5).tolist(), [[0, 1]])
+        self.assertEqual(top_k(np.zeros((2, 0)), 3).shape, (2, 0))
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]], rrf_k=60)
+        self.assertEqual([id_ for id_, _ in fused], ["b", "c", "a", "d"])
+        self.assertAlmostEqual(dict(fused)["b"], 1 / 62 + 1 / 61)
+        self.assertAlmostEqual(dict(fused)["d"], 1 / 63)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(llm_scheduler.time, "monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reserve_within_capacity_does_not_wait(self):
+        bucket = TokenBucket(600)
+        self.assertEqual(bucket.reserve(600), 0.0)
+
+    def test_overdraft_waits_for_refill(self):
+        bucket = TokenBucket(600)  # 10 per second
+        bucket.reserve(600)
+        self.assertAlmostEqual(bucket.reserve(50), 5.0)
+        self.now += 2
+        self.assertAlmostEqual(bucket.reserve(0), 3.0)
+
+    def test_reserve_larger_than_capacity_is_capped(self):
+        bucket = TokenBucket(600)
+        self.assertEqual(bucket.reserve(10_000), 0.0)
+        self.assertAlmostEqual(bucket.reserve(0), 0.0)
+        self.assertAlmostEqual(bucket.reserve(10), 1.0)
+
+    def test_adjust_refunds_and_charges(self):
+        bucket = TokenBucket(600)
+        bucket.reserve(600)
+        bucket.adjust(100)
+        self.assertEqual(bucket.reserve(100), 0.0)
+        bucket.adjust(-30)
+        self.assertAlmostEqual(bucket.reserve(0), 3.0)
+
+    def test_adjust_never_exceeds_capacity(self):
+        bucket = TokenBucket(600)
+        bucket.adjust(1000)
+        bucket.reserve(600)
+        self.assertAlmostEqual(bucket.reserve(10), 1.0)
+
+
+class SchedulerTests(SimpleTestCase):
+    messages = [{"role": "user", "content": "Hello"}]
+    params = {"model": "gpt-35-turbo-16k", "max_tokens": 100}
+
+    def rate_limit_error(self, body=None):
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        return openai.RateLimitError("Rate limited", response=httpx.Response(429, request=request), body=body)
+
+    def test_failed_attempts_are_refunded(self):
+        scheduler = LLMScheduler(rpm_limit=0, tpm_limit=10_000, max_retries=2, base_delay=0)
+        error = self.rate_limit_error()
+
+        def call():
+            raise error
+
+        with self.assertRaises(openai.RateLimitError):
+            scheduler.run(call, self.messages, self.params)
+        self.assertEqual(scheduler.stats.retries, 2)
+        self.assertEqual(scheduler.tokens.reserve(0), 0.0)
+        self.assertGreater(scheduler.tokens._level, 9_900)
+
+    def test_cancelled_wait_leaves_the_queue(self):
+        scheduler = LLMScheduler(rpm_limit=0, tpm_limit=600)
+        scheduler.tokens.reserve(600)
+
+        async def wait_then_cancel():
+            task = asyncio.ensure_future(scheduler.arun(lambda: asyncio.sleep(0), self.messages, self.params))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(wait_then_cancel())
+        self.assertEqual(scheduler.stats.queue_depth, 0)
+        self.assertEqual(scheduler.stats.admitted, 0)
+
+    def test_exhausted_quota_is_not_retried(self):
+        scheduler = LLMScheduler(rpm_limit=0, tpm_limit=10_000, max_retries=2, base_delay=0)
+        error = self.rate_limit_error({"code": "insufficient_quota", "message": "You exceeded your current quota."})
+        call = mock.Mock(side_effect=error)
+
+        with self.assertRaises(openai.RateLimitError):
+            scheduler.run(call, self.messages, self.params)
+        call.assert_called_once()
+        self.assertEqual(scheduler.stats.retries, 0)
+
+    def test_stream_is_settled_from_its_usage_chunk(self):
+        scheduler = LLMScheduler(rpm_limit=0, tpm_limit=10_000)
+
+        def chunk(choices, **extra):
+            return openai.types.chat.ChatCompletionChunk.construct(
+                id="c", object="chat.completion.chunk", created=0, model=self.params["model"], choices=choices, **extra)
+
+        async def stream():
+            yield chunk([{"index": 0, "delta": {"content": "Hi"}, "finish_reason": "stop"}])
+            yield chunk([], usage={"prompt_tokens": 8, "completion_tokens": 2, "total_tokens": 10})
+
+        async def create(**kwargs):
+            self.assertEqual(kwargs["extra_body"], {"stream_options": {"include_usage": True}})
+            return stream()
+
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+        async def consume():
+            return [part async for part in llm.astream_completion(
+                self.messages, max_tokens=self.params["max_tokens"], model=self.params["model"], use_cache=False)]
+
+        with mock.patch.object(llm, "get_scheduler", return_value=scheduler), \
+                mock.patch.object(llm, "get_async_client", return_value=client), \
+                mock.patch.object(scheduler.tokens, "adjust") as adjust:
+            self.assertEqual(asyncio.run(consume()), ["Hi"])
+        # Only the 10 tokens used stay charged, not the estimate
+        adjust.assert_called_once_with(scheduler.estimate(self.messages, self.params) - 10)
+
+
+class ConversationStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.store = ConversationStore(n_past_messages=2, summary_trigger_tokens=20, token_cap=120)
+        self.addCleanup(self.store.cache.clear)
+
+    def exchange(self, conversation, n):
+        question = f"Question {n}: " + words(random.Random(n), 12)
+        asyncio.run(self.store.add_exchange(conversation, question, f"Answer {n}."))
+
+    def test_cap_leaves_older_turns_for_the_summary(self):
+        conversation = Conversation("s1")
+        with mock.patch.object(self.store, "compact_in_background"):
+            for n in range(3):
+                self.exchange(conversation, n)
+        self.assertEqual(len(self.store.load("s1").turns), 6)
+
+    def test_failed_summary_keeps_the_turns(self):
+        conversation = Conversation("s2")
+        with mock.patch.object(self.store, "compact_in_background"):
+            for n in range(3):
+                self.exchange(conversation, n)
+        with mock.patch.object(self.store, "summarize", side_effect=openai.APIConnectionError(request=mock.Mock())):
+            self.store.compact("s2")
+        self.assertEqual(self.store.load("s2").turns, conversation.turns)
+
+        with mock.patch.object(self.store, "summarize", return_value="Three questions were asked."):
+            self.store.compact("s2")
+        compacted = self.store.load("s2")
+        self.assertEqual(compacted.summary, "Three questions were asked.")
+        self.assertEqual(compacted.turns, conversation.turns[-2:])
+
+
+class ViewTests(SimpleTestCase):
+    def test_malformed_requests_are_rejected(self):
+        for url, body in [
+            ("/dict-error/", "not json"),
+            ("/dict-error/", '{"clause": "The supplier shall indemnify the customer."}'),
+            ("/dict-no-error/", "[]"),
+            ("/find-institution/", "{"),
+        ]:
+            with self.subTest(url=url, body=body):
+                response = self.client.post(url, body, content_type="application/json")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+
+class StructuredOutputTests(SimpleTestCase):
+    def test_valid_reply_needs_no_repair(self):
+        with mock.patch.object(structured, "get_completion") as get_completion:
+            value = parse_or_repair('```json\n{"institutions": ["ICC"]}\n```', InstitutionsOutput)
+        self.assertEqual(value.institutions, ["ICC"])
+        get_completion.assert_not_called()
+
+    @override_settings(LLM_REPAIR_MODEL="repair-model")
+    def test_invalid_reply_is_repaired_once(self):
+        with mock.patch.object(structured, "get_completion", return_value=completion('{"institutions": ["ICC"]}')) as get_completion:
+            value = parse_or_repair("The institution is the ICC.", InstitutionsOutput)
+        self.assertEqual(value.institutions, ["ICC"])
+        get_completion.assert_called_once()
+        self.assertEqual(get_completion.call_args.kwargs["model"], "repair-model")
+        self.assertIn("The institution is the ICC.", get_completion.call_args.args[0][-1]["content"])
+
+    def test_failed_repair_raises(self):
+        with mock.patch.object(structured, "get_completion", return_value=completion('{"names": []}')):
+            with self.assertRaises(StructuredOutputError) as raised:
+                parse_or_repair('{"institutions": "ICC"}', InstitutionsOutput)
+        self.assertEqual(raised.exception.content, '{"institutions": "ICC"}')
+
+    def test_only_valid_replies_are_cached(self):
+        cache = mock.Mock()
+        cache.get.return_value = None
+        scheduler = mock.Mock()
+        replies = ["The institution is the ICC.", '{"institutions": ["ICC"]}']
+        scheduler.run.side_effect = [SimpleNamespace(usage=None, **vars(completion(reply))) for reply in replies]
+        with mock.patch.object(llm, "get_response_cache", return_value=cache), \
+                mock.patch.object(llm, "get_scheduler", return_value=scheduler):
+            value = get_structured_completion([{"role": "user", "content": "Which institution?"}], InstitutionsOutput)
+        self.assertEqual(value.institutions, ["ICC"])
+        # Only the repair call's reply is stored
+        cache.set.assert_called_once()
+        self.assertEqual(cache.set.call_args.args[2].choices[0].message.content, replies[1])
+
+
+class InstitutionExtractorTests(SimpleTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".csv")
+        self.addCleanup(os.remove, self.path)
+        with os.fdopen(fd, "w") as f:
+            f.write("Flag\nICC\nVienna International Arbitral Centre\n")
+
+    def test_gazetteer_hit_alone_is_not_confident_without_ner(self):
+        result = InstitutionExtractor(self.path, ner_model=None).extract("Disputes shall be referred to the ICC.")
+        self.assertEqual(result.institutions, ["ICC"])
+        self.assertLess(result.confidence, 0.75)
+
+    def test_unknown_institution_next_to_a_known_one_lowers_confidence(self):
+        extractor = InstitutionExtractor(self.path, ner_model=None)
+        result = extractor.extract("Any dispute shall be settled by the ICC or by the Atlantis Supreme Arbitration Board.")
+        self.assertEqual(result.confidence, UNRESOLVED_CONFIDENCE)
+
+    def test_clause_without_institution_cues_is_confident(self):
+        result = InstitutionExtractor(self.path, ner_model=None).extract("This agreement is governed by Swiss law.")
+        self.assertGreaterEqual(result.confidence, 0.75)
@@ -2,11 +2,14 @@
 # https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
 # https://github.com/langchain-ai/langchain/blob/master/libs/community/langchain_community/callbacks/openai_info.py
 
-from typing import Dict, List
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
 import tiktoken
 from loguru import logger
 
+from api.metrics import record_llm_usage
+
 MODEL_COST_PER_1K_TOKENS = {
     # GPT-4 input
     "gpt-4": 0.03,
@@ -19,6 +22,12 @@ MODEL_COST_PER_1K_TOKENS = {
     "gpt-4-1106-preview": 0.01,
     "gpt-4-0125-preview": 0.01,
     "gpt-4-turbo-preview": 0.01,
+    "gpt-4-turbo": 0.01,
+    "gpt-4-turbo-2024-04-09": 0.01,
+    "gpt-4o": 0.005,
+    "gpt-4o-2024-05-13": 0.005,
+    "gpt-4o-mini": 0.00015,
+    "gpt-4o-mini-2024-07-18": 0.00015,
     # GPT-4 output
     "gpt-4-completion": 0.06,
     "gpt-4-0314-completion": 0.06,
@@ -30,6 +39,12 @@ MODEL_COST_PER_1K_TOKENS = {
     "gpt-4-1106-preview-completion": 0.03,
     "gpt-4-0125-preview-completion": 0.03,
     "gpt-4-turbo-preview-completion": 0.03,
+    "gpt-4-turbo-completion": 0.03,
+    "gpt-4-turbo-2024-04-09-completion": 0.03,
+    "gpt-4o-completion": 0.015,
+    "gpt-4o-2024-05-13-completion": 0.015,
+    "gpt-4o-mini-completion": 0.0006,
+    "gpt-4o-mini-2024-07-18-completion": 0.0006,
     # GPT-3.5 input
     # gpt-3.5-turbo points at gpt-3.5-turbo-0613 until Feb 16, 2024.
     # Switches to gpt-3.5-turbo-0125 after.
@@ -71,76 +86,107 @@ MODEL_COST_PER_1K_TOKENS = {
 
 DEFAULT_MODEL = "gpt-35-turbo-16k"
 
+# Message framing per model family: (encoding, tokens_per_message, tokens_per_name).
+# Looked up by exact name first, then by the longest matching prefix.
+MODEL_TOKENIZATION = {
+    "gpt-4o": ("o200k_base", 3, 1),
+    "gpt-4": ("cl100k_base", 3, 1),
+    # every message follows <|start|>{role/name}\n{content}<|end|>\n
+    # if there's a name, the role is omitted
+    "gpt-3.5-turbo-0301": ("cl100k_base", 4, -1),
+    "gpt-3.5-turbo": ("cl100k_base", 3, 1),
+    "gpt-35-turbo": ("cl100k_base", 3, 1),
+}
+FALLBACK_TOKENIZATION = ("cl100k_base", 3, 1)
+
+# Lists at least this long are encoded with tiktoken's threaded batch encoder.
+BATCH_ENCODE_MIN = 16
+MEMOIZED_STRINGS = 4096
+
+
+@lru_cache(maxsize=None)
+def model_tokenization(model: str) -> Tuple[str, int, int]:
+    """Resolve a model name, e.g. "openai/gpt-4o-mini", to its tokenization table entry."""
+    name = model.lower().rsplit("/", 1)[-1]
+    if name in MODEL_TOKENIZATION:
+        return MODEL_TOKENIZATION[name]
+    prefixes = [prefix for prefix in MODEL_TOKENIZATION if name.startswith(prefix)]
+    if prefixes:
+        return MODEL_TOKENIZATION[max(prefixes, key=len)]
+    logger.warning(f"No tokenization known for model {model}, counting with {FALLBACK_TOKENIZATION[0]}.")
+    return FALLBACK_TOKENIZATION
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = DEFAULT_MODEL) -> tiktoken.Encoding:
+    """Return the tiktoken encoding for a model, loaded once per process."""
+    return tiktoken.get_encoding(model_tokenization(model)[0])
+
+
+@lru_cache(maxsize=MEMOIZED_STRINGS)
+def _memoized_count(encoding_name: str, text: str) -> int:
+    return len(tiktoken.get_encoding(encoding_name).encode_ordinary(text))
+
+
+def num_tokens_from_strings(texts: List[str], model: str = DEFAULT_MODEL) -> List[int]:
+    """Return the number of tokens of each string."""
+    encoding = get_encoding(model)
+    if len(texts) >= BATCH_ENCODE_MIN:
+        return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+    return [len(encoding.encode_ordinary(text)) for text in texts]
+
 
 def num_tokens_from_messages(
     messages: List[Dict[str, str]], model: str = DEFAULT_MODEL
 ) -> int:
-    """Return the number of tokens used by a list of messages."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-
-    if model in {
-        "gpt-4-0314",
-        "gpt-4-32k-0314",
-        "gpt-4-0613",
-        "gpt-4-32k-0613",
-        "gpt-3.5-turbo-0613",
-        "gpt-3.5-turbo-16k-0613",
-        "gpt-35-turbo-0613",
-        "gpt-35-turbo-16k",
-        "gpt-35-turbo-16k-0613",
-    }:
-        tokens_per_message = 3
-        tokens_per_name = 1
-    elif model == "gpt-3.5-turbo-0301":
-        # every message follows <|start|>{role/name}\n{content}<|end|>\n
-        tokens_per_message = 4
-        tokens_per_name = -1  # if there's a name, the role is omitted
-    elif "gpt-3.5-turbo" in model:
-        print(
-            "Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613."
-        )
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613")
-    elif "gpt-4" in model:
-        print(
-            "Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613."
-        )
-        return num_tokens_from_messages(messages, model="gpt-4-0613")
-    else:
-        raise NotImplementedError(
-            f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
-        )
+    """Return the number of tokens used by a list of messages.
+
+    Roles, names and system prompts repeat across requests, so their counts
+    are memoized; the remaining contents are encoded together.
+    """
+    encoding_name, tokens_per_message, tokens_per_name = model_tokenization(model)
 
     num_tokens = 0
+    unique = []
     for message in messages:
         num_tokens += tokens_per_message
         for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
+            if not value:
+                # e.g. the Chatbot's knowledge-base message before one is set
+                continue
+            if key == "content" and message.get("role") != "system":
+                unique.append(value)
+            else:
+                num_tokens += _memoized_count(encoding_name, value)
             if key == "name":
                 num_tokens += tokens_per_name
+    num_tokens += sum(num_tokens_from_strings(unique, model=model))
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
     return num_tokens
 
 
 def num_tokens_from_string(text: str, model: str = DEFAULT_MODEL) -> int:
     """Return the number of tokens used by a string."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-
-    num_tokens = len(encoding.encode(text))
-    return num_tokens
+    return len(get_encoding(model).encode_ordinary(text))
 
 
 def log_usage(
-    prompt: List[Dict[str, str]], completion: str, model: str = DEFAULT_MODEL
+    prompt: List[Dict[str, str]],
+    completion: str,
+    model: str = DEFAULT_MODEL,
+    endpoint: str = "unknown",
+    prompt_tokens: Optional[int] = None,
+    completion_tokens: Optional[int] = None,
+    queue_seconds: Optional[float] = None,
+    latency_seconds: Optional[float] = None,
 ):
-    """Log usage for token used and cost based on prompt and completion"""
-    n_prompt_tokens = num_tokens_from_messages(messages=prompt, model=model)
-    n_completion_tokens = num_tokens_from_string(completion, model=model)
+    """Log usage for token used and cost based on prompt and completion
+
+    Token counts reported by the API are used when given, otherwise they are
+    counted locally. The call is also recorded in the Prometheus metrics.
+    """
+    n_prompt_tokens = prompt_tokens if prompt_tokens is not None else num_tokens_from_messages(messages=prompt, model=model)
+    n_completion_tokens = completion_tokens if completion_tokens is not None else num_tokens_from_string(completion, model=model)
 
     prompt_cost = get_openai_token_cost_for_model(
         model_name=model,
@@ -164,25 +210,45 @@ def log_usage(
         f"Total Tokens: {total_tokens}, "
         f"Total Cost (USD): ${total_cost:.6f}"
     )
+    record_llm_usage(
+        endpoint=endpoint,
+        model=model,
+        prompt_tokens=n_prompt_tokens,
+        completion_tokens=n_completion_tokens,
+        cost=total_cost,
+        queue_seconds=queue_seconds,
+        latency_seconds=latency_seconds,
+    )
     return total_cost, total_tokens
 
 
 def get_openai_token_cost_for_model(
     model_name: str, num_tokens: int, is_completion: bool = False
 ) -> float:
-    """Get the cost in USD for a given model and number of tokens."""
+    """Get the cost in USD for a given model and number of tokens.
+
+    Models missing from the price table cost 0: usage accounting runs after
+    every completion and must never fail a request that already succeeded.
+    """
     model_name = standardize_model_name(model_name, is_completion=is_completion)
     if model_name not in MODEL_COST_PER_1K_TOKENS:
-        raise ValueError(
-            f"Unknown model: {model_name}. Please provide a valid OpenAI model name."
-            "Known models are: " + ", ".join(MODEL_COST_PER_1K_TOKENS.keys())
-        )
+        _warn_unknown_model(model_name)
+        return 0.0
     return MODEL_COST_PER_1K_TOKENS[model_name] * (num_tokens / 1000)
 
 
+@lru_cache(maxsize=None)
+def _warn_unknown_model(model_name: str) -> None:
+    # Once per model and process
+    logger.warning(
+        f"No price known for model {model_name}; its cost is recorded as 0. "
+        "Known models are: " + ", ".join(MODEL_COST_PER_1K_TOKENS.keys())
+    )
+
+
 def standardize_model_name(model_name: str, is_completion: bool = False) -> str:
     """Standardize the model name to a format that can be used in the OpenAI API."""
-    model_name = model_name.lower()
+    model_name = model_name.lower().rsplit("/", 1)[-1]
     if is_completion and (
         model_name.startswith("gpt-4")
         or model_name.startswith("gpt-3.5")
@@ -0,0 +1,386 @@
+"""Lightweight per-request tracing.
+
+A request is traced when it is sampled (TRACE_SAMPLE_RATE) or when the
+Server-Timing debug header is on (TRACE_DEBUG_HEADER). Code marks its
+stages with `span(...)` or `@traced(...)`; outside a traced request both
+cost one context variable lookup. Sampled traces are appended to
+TRACE_EXPORT_PATH as one JSON document per line, either in our own format
+("json") or as OTLP/JSON export requests ("otlp") that an OpenTelemetry
+collector's file receiver can read.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from api.request_context import get_endpoint
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+SERVICE_NAME = "plato-server"
+EXPORT_FORMATS = ("json", "otlp")
+
+
+class Span:
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.duration_ns = 0
+        self.error: Optional[str] = None
+        self._started = time.perf_counter_ns()
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def end(self) -> None:
+        self.duration_ns = time.perf_counter_ns() - self._started
+
+    @property
+    def duration_ms(self) -> float:
+        return self.duration_ns / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_unix_nano": self.start_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoSpan:
+    """Stands in for a span outside traced requests."""
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+class Trace:
+    def __init__(self, request_id: str, sampled: bool):
+        self.trace_id = uuid.uuid4().hex
+        self.request_id = request_id
+        self.sampled = sampled
+        # Appended to from threads and tasks; list.append is atomic
+        self.spans: List[Span] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "request_id": self.request_id,
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The trace as an OTLP/JSON ExportTraceServiceRequest."""
+        spans = []
+        for span in self.spans:
+            attributes = dict(span.attributes, **{"request.id": self.request_id})
+            spans.append({
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id or "",
+                "name": span.name,
+                "kind": 2 if span.parent_id is None else 1,  # SERVER for the request, INTERNAL below it
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.start_ns + span.duration_ns),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            })
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]}
+
+    def server_timing(self) -> str:
+        """Time per stage as a Server-Timing header value; repeated stages are summed."""
+        totals: Dict[str, List[float]] = {}
+        for span in self.spans:
+            if span.parent_id is None:
+                continue
+            total = totals.setdefault(span.name, [0.0, 0])
+            total[0] += span.duration_ms
+            total[1] += 1
+        entries = [
+            f'{name};dur={ms:.1f}' + (f';desc="{count} calls"' if count > 1 else "")
+            for name, (ms, count) in totals.items()
+        ]
+        root = next((span for span in self.spans if span.parent_id is None), None)
+        if root is not None:
+            entries.append(f"total;dur={root.duration_ms:.1f}")
+        return ", ".join(entries)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def get_request_id() -> Optional[str]:
+    trace = current_trace.get()
+    return trace.request_id if trace is not None else None
+
+
+def annotate(**attributes) -> None:
+    """Add attributes to the innermost open span, if any."""
+    s = current_span.get()
+    if s is not None and current_trace.get() is not None:
+        s.attributes.update(attributes)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Any]:
+    """Time the enclosed block as a stage of the current trace, if there is one."""
+    trace = current_trace.get()
+    if trace is None:
+        yield NO_SPAN
+        return
+    s = _open(name, attributes)
+    token = current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current_span.reset(token)
+        _close(trace, s)
+
+
+def _open(name: str, attributes: Dict[str, Any]) -> Span:
+    parent = current_span.get()
+    return Span(name, parent.span_id if parent is not None else None, attributes)
+
+
+def _close(trace: Trace, s: Span) -> None:
+    s.end()
+    trace.spans.append(s)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator running a function, coroutine function or async generator inside a span."""
+
+    def decorate(func):
+        span_name = name or func.__qualname__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                trace = current_trace.get()
+                if trace is None:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                    return
+                # The span covers the whole iteration, including time the consumer takes
+                s = _open(span_name, {})
+                try:
+                    async for item in _aiterate_within(trace, s, func(*args, **kwargs)):
+                        yield item
+                except BaseException as e:
+                    s.error = f"{type(e).__name__}: {e}"
+                    raise
+                finally:
+                    _close(trace, s)
+            return async_gen_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+# A generator runs in the context of whoever iterates it, and may be closed from yet another
+# one. So its span is made current for each step only, never across a yield.
+
+def _iterate_within(trace: Trace, s: Span, iterable):
+    iterator = iter(iterable)
+    while True:
+        trace_token, span_token = current_trace.set(trace), current_span.set(s)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            current_span.reset(span_token)
+            current_trace.reset(trace_token)
+        yield item
+
+
+async def _aiterate_within(trace: Trace, s: Span, iterable):
+    iterator = iterable.__aiter__()
+    while True:
+        trace_token, span_token = current_trace.set(trace), current_span.set(s)
+        try:
+            item = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        finally:
+            current_span.reset(span_token)
+            current_trace.reset(trace_token)
+        yield item
+
+
+class TraceExporter:
+    """Appends finished traces to a file, one JSON document per line."""
+
+    def __init__(self, path: str, export_format: str = "json"):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"TRACE_EXPORT must be one of {EXPORT_FORMATS}, not {export_format!r}.")
+        self.path = path
+        self.export_format = export_format
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        document = trace.to_otlp() if self.export_format == "otlp" else trace.to_dict()
+        line = json.dumps(document, default=str) + "\n"
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning("Could not export trace %s to %s: %s", trace.trace_id, self.path, e)
+
+
+_exporter: Optional[TraceExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> Optional[TraceExporter]:
+    """Return the process-wide exporter, or None if TRACE_EXPORT is off."""
+    global _exporter
+    export_format = getattr(settings, "TRACE_EXPORT", None)
+    if not export_format:
+        return None
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                path = getattr(settings, "TRACE_EXPORT_PATH", None) or os.path.join(settings.BASE_DIR, "traces.jsonl")
+                _exporter = TraceExporter(path, export_format)
+    return _exporter
+
+
+class TracingMiddleware:
+    """Start a trace per request, answer with its request id and, if enabled, its stage timings.
+
+    An incoming X-Request-ID header is kept as the request id. Streamed
+    responses are finished, and exported, once their last chunk is sent.
+    Must come after RequestContextMiddleware so the endpoint name is known.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def start(self, request) -> Trace:
+        request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        sampled = random.random() < getattr(settings, "TRACE_SAMPLE_RATE", 0.0)
+        return Trace(request_id, sampled)
+
+    def recording(self, trace: Trace) -> bool:
+        return trace.sampled or getattr(settings, "TRACE_DEBUG_HEADER", False)
+
+    def finish(self, trace: Trace, root: Span, response) -> None:
+        root.set("http.status_code", response.status_code)
+        if trace.sampled:
+            exporter = get_exporter()
+            if exporter is not None:
+                exporter.export(trace)
+
+    def respond(self, trace: Trace, root: Optional[Span], response):
+        response[REQUEST_ID_HEADER] = trace.request_id
+        if root is not None and getattr(settings, "TRACE_DEBUG_HEADER", False):
+            response["Server-Timing"] = trace.server_timing()
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trace = self.start(request)
+        if not self.recording(trace):
+            return self.respond(trace, None, self.get_response(request))
+        trace_token = current_trace.set(trace)
+        try:
+            with span(f"http {get_endpoint()}", **{"http.method": request.method, "http.path": request.path}) as root:
+                response = self.get_response(request)
+        finally:
+            current_trace.reset(trace_token)
+        if response.streaming:
+            response.streaming_content = self._finish_after(trace, root, response, response.streaming_content)
+        else:
+            self.finish(trace, root, response)
+        return self.respond(trace, root, response)
+
+    async def __acall__(self, request):
+        trace = self.start(request)
+        if not self.recording(trace):
+            return self.respond(trace, None, await self.get_response(request))
+        trace_token = current_trace.set(trace)
+        try:
+            with span(f"http {get_endpoint()}", **{"http.method": request.method, "http.path": request.path}) as root:
+                response = await self.get_response(request)
+        finally:
+            current_trace.reset(trace_token)
+        if response.streaming:
+            response.streaming_content = self._afinish_after(trace, root, response, response.streaming_content)
+        else:
+            await asyncio.to_thread(self.finish, trace, root, response)
+        return self.respond(trace, root, response)
+
+    def _finish_after(self, trace, root, response, content):
+        # The body is produced after the view returns, outside this middleware's context
+        try:
+            yield from _iterate_within(trace, root, content)
+        finally:
+            root.end()
+            self.finish(trace, root, response)
+
+    async def _afinish_after(self, trace, root, response, content):
+        try:
+            async for chunk in _aiterate_within(trace, root, content):
+                yield chunk
+        finally:
+            root.end()
+            await asyncio.to_thread(self.finish, trace, root, response)
@@ -1,46 +1,81 @@
-from django.shortcuts import render
 from .services import PDF_base
-from .services import extract_institution
-from django.http import JsonResponse
+from .services import aextract_institution, aextract_institutions_batch
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from .services import Chatbot
+from .conversation import get_conversation_store
+from .knowledge_index import get_retriever
+from .embeddings import embedding_stats
+from .llm_cache import get_response_cache
+from .llm_scheduler import get_scheduler
+from .structured import StructuredOutputError, stats as structured_stats
+from .metrics import exposition
+from .models import DictErrorBatchRequest, InstitutionBatchRequest
+from pydantic import ValidationError
 from django.conf import settings
 import json
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-import os
+import asyncio
 
 @csrf_exempt
 @require_http_methods(["POST"])
 
-def reply_dict_error_api(request):
+async def reply_dict_error_api(request):
     
-    pdf_directory_path = os.path.dirname(os.path.abspath(__file__))
-    pdf_filename = 'Knowledge_base.PDF'
-
-    pdf_file_path = os.path.join(pdf_directory_path, pdf_filename)
-    if not os.path.exists(pdf_file_path):
-        return JsonResponse({"error": f"File {pdf_filename} does not exist."}, status=404)
-    
-    pdf_bot = PDF_base(pdf_file_path)
-    
-    data = json.loads(request.body)
-    print("Request data parsed successfully.")
-    
-    clause = data['clause']
-    
-    error = data['error']
+    try:
+        data = json.loads(request.body)
+        clause, error, rule = data['clause'], data['error'], data['rule']
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected JSON with clause, error and rule.'}, status=400)
     
-    rule = data['rule']
+    try:
+        pdf_bot = PDF_base(retriever=await asyncio.to_thread(get_retriever))
+    except FileNotFoundError as e:
+        return JsonResponse({"error": str(e)}, status=404)
     
     # Use the method to get the rusult in the form of a json file
-    result = pdf_bot.genAI_dict_error_response(clause, rule, error)
+    try:
+        result = await pdf_bot.agenAI_dict_error_response(clause, rule, error)
+    except StructuredOutputError as e:
+        return JsonResponse({"error": str(e)}, status=502)
         
     if result:
         return JsonResponse({'reply': result}, safe=False)
     else:
-        return JsonResponse({"error": f"Failed to process PDF file {pdf_filename}."}, status=500)
+        return JsonResponse({"error": "Failed to process the clause against the knowledge base."}, status=500)
         
     
+@csrf_exempt
+@require_http_methods(["POST"])
+
+async def reply_dict_error_batch_api(request):
+    """Review a list of {clause, rule, error} items; results come back per item, in order."""
+    
+    try:
+        batch = DictErrorBatchRequest.model_validate_json(request.body)
+    except ValidationError as e:
+        return JsonResponse({'error': 'Expected JSON with a list of items with clause, error and rule.',
+                             'details': json.loads(e.json())}, status=400)
+    
+    max_items = getattr(settings, 'DICT_ERROR_BATCH_MAX_ITEMS', 200)
+    if len(batch.items) > max_items:
+        return JsonResponse({'error': f'At most {max_items} items per batch.'}, status=400)
+    if not batch.items:
+        return JsonResponse({'results': []})
+    
+    try:
+        pdf_bot = PDF_base(retriever=await asyncio.to_thread(get_retriever))
+    except FileNotFoundError as e:
+        return JsonResponse({"error": str(e)}, status=404)
+    
+    results = await pdf_bot.agenAI_dict_error_batch(
+        [item.model_dump() for item in batch.items],
+        max_concurrency=getattr(settings, 'DICT_ERROR_BATCH_CONCURRENCY', 8),
+    )
+    
+    return JsonResponse({'results': results})
+    
+    
 # @csrf_exempt
 # @require_http_methods(["POST"])
 # def reply_dict_error_api(request):
@@ -56,40 +91,46 @@ def reply_dict_error_api(request):
 @csrf_exempt
 @require_http_methods(["POST"])
 
-def reply_dict_no_error_api(request):
-    
+async def reply_dict_no_error_api(request):
     
-    pdf_directory_path = os.path.dirname(os.path.abspath(__file__))
-    pdf_filename = 'Knowledge_base.PDF'
-
-    pdf_file_path = os.path.join(pdf_directory_path, pdf_filename)
-    if not os.path.exists(pdf_file_path):
-        return JsonResponse({"error": f"File {pdf_filename} does not exist."}, status=404)
-    
-    pdf_bot = PDF_base(pdf_file_path)
-    
-    data = json.loads(request.body)
-    print("Request data parsed successfully.")
+    try:
+        clause = json.loads(request.body)['clause']
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected JSON with a clause.'}, status=400)
     
-    clause = data['clause']
+    try:
+        pdf_bot = PDF_base(retriever=await asyncio.to_thread(get_retriever))
+    except FileNotFoundError as e:
+        return JsonResponse({"error": str(e)}, status=404)
     
-    result = pdf_bot.genAI_dict_no_error_response(clause)
+    try:
+        result = await pdf_bot.agenAI_dict_no_error_response(clause)
+    except StructuredOutputError as e:
+        return JsonResponse({"error": str(e)}, status=502)
         
     if result:
         return JsonResponse({'reply': result}, safe=False)
     else:
-        return JsonResponse({"error": f"Failed to process PDF file {pdf_filename}."}, status=500)
+        return JsonResponse({"error": "Failed to process the clause against the knowledge base."}, status=500)
     
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
 
-def finding_fictional_institution(request):
-    data = json.loads(request.body)
-    print("Request data parsed successfully.")
+async def finding_fictional_institution(request):
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON.'}, status=400)
     
-    reply = extract_institution(data)
+    clause = data.get('text') or data.get('clause') if isinstance(data, dict) else data
+    if not clause:
+        return JsonResponse({'error': 'No text provided.'}, status=400)
+    try:
+        reply = await aextract_institution(clause)
+    except StructuredOutputError as e:
+        return JsonResponse({"error": str(e)}, status=502)
     
     if reply:
         return JsonResponse({'Institutions': reply}, safe=False)
@@ -97,21 +138,151 @@ def finding_fictional_institution(request):
         return JsonResponse({"error": f"Failed to extract institution from the given text."}, status=500)
     
     
+@csrf_exempt
+@require_http_methods(["POST"])
+
+async def finding_fictional_institution_batch(request):
+    """Institutions for many clauses in few LLM calls, keyed by clause id (or list position)."""
+    
+    try:
+        batch = InstitutionBatchRequest.model_validate_json(request.body)
+    except ValidationError as e:
+        return JsonResponse({'error': 'Expected JSON with a list or an object of clauses.',
+                             'details': json.loads(e.json())}, status=400)
+    
+    clauses = batch.clauses if isinstance(batch.clauses, dict) else {str(i): c for i, c in enumerate(batch.clauses)}
+    max_items = getattr(settings, 'INSTITUTION_BATCH_MAX_ITEMS', 500)
+    if len(clauses) > max_items:
+        return JsonResponse({'error': f'At most {max_items} clauses per batch.'}, status=400)
+    
+    reply = await aextract_institutions_batch(clauses)
+    return JsonResponse({'Institutions': reply})
+    
+    
 
 @csrf_exempt
 @require_http_methods(["POST"])
 
-def chatbot_api(request):
+async def chatbot_api(request):
     try:
         data = json.loads(request.body)
         user_question = data.get('question')
         if not user_question:
             return JsonResponse({'error': 'No question provided.'}, status=400)
-        chatbot = Chatbot()
-        response = chatbot.handle_query(user_question)
+        store = get_conversation_store()
+        conversation = await asyncio.to_thread(store.load, data.get('session_id'))
+        chatbot = Chatbot(history=store.history(conversation))
+        response = await chatbot.ahandle_query(user_question)
+        await store.add_exchange(conversation, user_question, response)
         
-        return JsonResponse({'response': response})
+        return JsonResponse({'response': response, 'session_id': conversation.session_id})
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON.'}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+
+async def reply_dict_error_stream_api(request):
+    """Server-sent events: `token` events while the reply is generated, then one `result` event."""
+    
+    try:
+        pdf_bot = PDF_base(retriever=await asyncio.to_thread(get_retriever))
+    except FileNotFoundError as e:
+        return JsonResponse({"error": str(e)}, status=404)
+    
+    try:
+        data = json.loads(request.body)
+        clause, error, rule = data['clause'], data['error'], data['rule']
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected JSON with clause, error and rule.'}, status=400)
+    
+    async def events():
+        try:
+            async for kind, payload in pdf_bot.astream_dict_error_response(clause, rule, error):
+                if kind == "token":
+                    yield sse_event("token", {"delta": payload})
+                else:
+                    yield sse_event("result", {"reply": payload})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+    
+    return sse_response(events())
+
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+
+async def chatbot_stream_api(request):
+    """Server-sent events: `token` events while the answer is generated, then one `result` event."""
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON.'}, status=400)
+    user_question = data.get('question')
+    if not user_question:
+        return JsonResponse({'error': 'No question provided.'}, status=400)
+    store = get_conversation_store()
+    conversation = await asyncio.to_thread(store.load, data.get('session_id'))
+    chatbot = Chatbot(history=store.history(conversation))
+    
+    async def events():
+        parts = []
+        try:
+            async for delta in chatbot.astream_query(user_question):
+                parts.append(delta)
+                yield sse_event("token", {"delta": delta})
+            yield sse_event("result", {"response": "".join(parts), "session_id": conversation.session_id})
+            await store.add_exchange(conversation, user_question, "".join(parts))
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+    
+    return sse_response(events())
+
+
+
+@require_http_methods(["GET"])
+
+def embedding_stats_api(request):
+    return JsonResponse(embedding_stats())
+
+
+@require_http_methods(["GET"])
+
+def llm_cache_stats_api(request):
+    cache = get_response_cache()
+    return JsonResponse(cache.stats() if cache is not None else {})
+
+
+@require_http_methods(["GET"])
+
+def llm_scheduler_stats_api(request):
+    return JsonResponse(get_scheduler().stats.snapshot())
+
+
+@require_http_methods(["GET"])
+
+def llm_structured_stats_api(request):
+    return JsonResponse(structured_stats.snapshot())
+
+
+@require_http_methods(["GET"])
+
+def metrics_api(request):
+    body, content_type = exposition()
+    return HttpResponse(body, content_type=content_type)
@@ -31,6 +31,113 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 if not OPENAI_API_KEY:
     raise ValueError("No OpenAI API key found in env. variables", os.getcwd())
 
+# Opt-in warm-up: load the knowledge base FAISS index when the app starts instead of on the first request
+PRELOAD_KNOWLEDGE_INDEX = os.getenv('PRELOAD_KNOWLEDGE_INDEX', 'false').lower() in ('1', 'true', 'yes')
+
+# Opt-in warm-up: load the embedding model (torch) at startup instead of on the first retrieval.
+# Concurrent query embeddings are batched either way.
+WARMUP_EMBEDDINGS = os.getenv('WARMUP_EMBEDDINGS', 'false').lower() in ('1', 'true', 'yes')
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', '32'))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv('EMBEDDING_MAX_WAIT_MS', '5'))
+
+# Query-embedding cache: in-process LRU size, plus an optional SQLite file shared by all workers
+# that keeps the EMBEDDING_CACHE_MAX_ROWS most recently written vectors (0 for no limit)
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '10000'))
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH') or None
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv('EMBEDDING_CACHE_MAX_ROWS', '100000'))
+
+# PDF loading: pages are cached by file hash and page number, PDF_PAGE_CACHE_SIZE pages per worker
+# plus an optional SQLite file shared by all workers. Documents with at least PDF_PARALLEL_MIN_PAGES
+# uncached pages are extracted by PDF_EXTRACT_WORKERS processes (default: one per core).
+PDF_PAGE_CACHE_SIZE = int(os.getenv('PDF_PAGE_CACHE_SIZE', '5000'))
+PDF_PAGE_CACHE_PATH = os.getenv('PDF_PAGE_CACHE_PATH') or None
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS')) if os.getenv('PDF_EXTRACT_WORKERS') else None
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '200'))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '50'))
+
+# Response cache in front of get_completion: "memory" (per worker), "django" (LLM_CACHE_ALIAS) or "off"
+LLM_CACHE_BACKEND = os.getenv('LLM_CACHE_BACKEND', 'memory')
+LLM_CACHE_ALIAS = os.getenv('LLM_CACHE_ALIAS', 'default')
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', str(24 * 60 * 60)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '2048'))
+# Cosine similarity above which a similar earlier prompt's answer is reused; unset disables the semantic tier
+LLM_SEMANTIC_CACHE_THRESHOLD = float(os.getenv('LLM_SEMANTIC_CACHE_THRESHOLD')) if os.getenv('LLM_SEMANTIC_CACHE_THRESHOLD') else None
+
+# LLM scheduler: per-process request and token budgets (0 disables a limit) and retry backoff
+LLM_RPM_LIMIT = int(os.getenv('LLM_RPM_LIMIT', '500'))
+LLM_TPM_LIMIT = int(os.getenv('LLM_TPM_LIMIT', '30000'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '5'))
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '0.5'))
+LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', '30'))
+
+# Model that gets one attempt at reformatting a reply that fails schema validation
+LLM_REPAIR_MODEL = os.getenv('LLM_REPAIR_MODEL', 'gpt-3.5-turbo-0125')
+
+# Dense index workers search: "none" (float32), "int8" or "binary"; compact indexes re-score
+# DENSE_RESCORE_FACTOR x the candidates with float vectors memory-mapped from disk
+DENSE_INDEX_QUANTIZATION = os.getenv('DENSE_INDEX_QUANTIZATION', 'none')
+DENSE_RESCORE_FACTOR = int(os.getenv('DENSE_RESCORE_FACTOR', '4'))
+
+# Largest retrieved context, in tokens, put into a clause-review prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+
+# Batch clause review: LLM calls in flight per request and largest accepted batch
+DICT_ERROR_BATCH_CONCURRENCY = int(os.getenv('DICT_ERROR_BATCH_CONCURRENCY', '8'))
+DICT_ERROR_BATCH_MAX_ITEMS = int(os.getenv('DICT_ERROR_BATCH_MAX_ITEMS', '200'))
+
+# Institution extraction: gazetteer CSV (reloaded when it changes), spaCy NER model
+# (empty for gazetteer only) and the local confidence below which the LLM is asked
+INSTITUTION_GAZETTEER_PATH = os.getenv('INSTITUTION_GAZETTEER_PATH') or None
+INSTITUTION_NER_MODEL = os.getenv('INSTITUTION_NER_MODEL', 'en_core_web_sm')
+INSTITUTION_LLM_THRESHOLD = float(os.getenv('INSTITUTION_LLM_THRESHOLD', '0.75'))
+
+# Batch institution extraction: clause tokens and clauses per LLM prompt, and largest accepted batch
+INSTITUTION_BATCH_TOKENS = int(os.getenv('INSTITUTION_BATCH_TOKENS', '3000'))
+INSTITUTION_BATCH_MAX_CLAUSES = int(os.getenv('INSTITUTION_BATCH_MAX_CLAUSES', '20'))
+INSTITUTION_BATCH_MAX_ITEMS = int(os.getenv('INSTITUTION_BATCH_MAX_ITEMS', '500'))
+
+# Chatbot sessions: kept in the "chat" cache, per worker ("memory") or in files shared by the
+# workers of a host ("file"). The last CHAT_N_PAST_MESSAGES messages are sent with each question;
+# older ones are summarised once they reach CHAT_SUMMARY_TRIGGER_TOKENS. The summary and recent
+# messages are capped at CHAT_SESSION_TOKEN_CAP tokens, as are the messages waiting to be summarised.
+CHAT_MEMORY_BACKEND = os.getenv('CHAT_MEMORY_BACKEND', 'memory')
+CHAT_MEMORY_LOCATION = os.getenv('CHAT_MEMORY_LOCATION', os.path.join(SERVER_DIR.parent, 'chat_sessions'))
+CHAT_MEMORY_CACHE_ALIAS = 'chat'
+CHAT_SESSION_TTL = int(os.getenv('CHAT_SESSION_TTL', str(24 * 60 * 60)))
+CHAT_N_PAST_MESSAGES = int(os.getenv('CHAT_N_PAST_MESSAGES', '10'))
+CHAT_SUMMARY_TRIGGER_TOKENS = int(os.getenv('CHAT_SUMMARY_TRIGGER_TOKENS', '1000'))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv('CHAT_SUMMARY_MAX_TOKENS', '300'))
+CHAT_SESSION_TOKEN_CAP = int(os.getenv('CHAT_SESSION_TOKEN_CAP', '4000'))
+
+# Chatbot glossary: optional JSON file of term -> explanation loaded at first use. Each question
+# gets at most CHATBOT_GLOSSARY_TOP_K relevant entries within CHATBOT_GLOSSARY_TOKEN_BUDGET tokens.
+CHATBOT_GLOSSARY_PATH = os.getenv('CHATBOT_GLOSSARY_PATH') or None
+CHATBOT_GLOSSARY_TOP_K = int(os.getenv('CHATBOT_GLOSSARY_TOP_K', '5'))
+CHATBOT_GLOSSARY_TOKEN_BUDGET = int(os.getenv('CHATBOT_GLOSSARY_TOKEN_BUDGET', '500'))
+CHATBOT_GLOSSARY_MIN_SIMILARITY = float(os.getenv('CHATBOT_GLOSSARY_MIN_SIMILARITY', '0.3'))
+
+# Tracing: a TRACE_SAMPLE_RATE share of requests is traced and, with TRACE_EXPORT set to "json" or
+# "otlp", appended to TRACE_EXPORT_PATH. TRACE_DEBUG_HEADER traces every request and adds a
+# Server-Timing header with the time spent per stage.
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+TRACE_EXPORT = os.getenv('TRACE_EXPORT') or None
+TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH', os.path.join(SERVER_DIR.parent, 'traces.jsonl'))
+TRACE_DEBUG_HEADER = os.getenv('TRACE_DEBUG_HEADER', 'false').lower() in ('1', 'true', 'yes')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'chat': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CHAT_MEMORY_LOCATION,
+    } if CHAT_MEMORY_BACKEND == 'file' else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'chat-sessions',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
 # This is Django secret key
 SECRET_KEY = os.getenv('DJANGO_SECRET_KEY')
 
@@ -69,9 +176,12 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.request_context.RequestContextMiddleware',
+    'api.tracing.TracingMiddleware',
 ]
 
 CORS_ORIGIN_ALLOW_ALL = True
+CORS_EXPOSE_HEADERS = ['X-Request-ID']
 CSRF_TRUSTED_ORIGINS = ['http://localhost:3000']
 
 
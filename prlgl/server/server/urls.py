@@ -19,10 +19,28 @@ from api.views import reply_dict_error_api
 from api.views import reply_dict_no_error_api
 from api.views import chatbot_api
 from api.views import finding_fictional_institution
+from api.views import finding_fictional_institution_batch
+from api.views import reply_dict_error_batch_api
+from api.views import reply_dict_error_stream_api
+from api.views import chatbot_stream_api
+from api.views import embedding_stats_api
+from api.views import llm_cache_stats_api
+from api.views import llm_scheduler_stats_api
+from api.views import llm_structured_stats_api
+from api.views import metrics_api
 
 urlpatterns = [
     path('dict-error/', reply_dict_error_api, name='reply_dict_error_api'), 
     path('dict-no-error/', reply_dict_no_error_api, name='reply_dict_no_error_api'),
     path('find-institution/', finding_fictional_institution, name='finding_fictional_institution'),
-    path('chatbot-api/', chatbot_api, name='chatbot_api')
+    path('chatbot-api/', chatbot_api, name='chatbot_api'),
+    path('dict-error/batch/', reply_dict_error_batch_api, name='reply_dict_error_batch_api'),
+    path('dict-error/stream/', reply_dict_error_stream_api, name='reply_dict_error_stream_api'),
+    path('find-institution/batch/', finding_fictional_institution_batch, name='finding_fictional_institution_batch'),
+    path('chatbot-api/stream/', chatbot_stream_api, name='chatbot_stream_api'),
+    path('embedding-stats/', embedding_stats_api, name='embedding_stats_api'),
+    path('llm-cache-stats/', llm_cache_stats_api, name='llm_cache_stats_api'),
+    path('llm-scheduler-stats/', llm_scheduler_stats_api, name='llm_scheduler_stats_api'),
+    path('llm-structured-stats/', llm_structured_stats_api, name='llm_structured_stats_api'),
+    path('metrics/', metrics_api, name='metrics'),
 ]